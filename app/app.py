@@ -1,17 +1,102 @@
 import os
-from flask import Flask, request, render_template, jsonify, make_response
-from search import search
-from data.parameters import R0, INC_PER, REC_TIME, TIME_STEPS, START_DATE
-import pandas as pd
-import func
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-import json
-import plotly
-
-historical_df, last_updated = func.get_covid_data()
+import threading
+import time
+import hashlib
+from datetime import datetime
+from flask import Flask, request, render_template, jsonify, make_response, url_for
+from search import search, search_page, search_cache
+from data.parameters import R0, INC_PER, REC_TIME, TIME_STEPS, START_DATE, ENSEMBLE_SIZE, ENSEMBLE_SPREAD
+from cache import ResultCache, normalize_params
+import jobs
+import timing
+
+MAX_SWEEP_SIZE = 100000
+MAX_ENSEMBLE_SIZE = int(os.environ.get('MAX_ENSEMBLE_SIZE', 10000))
+SEARCH_PAGE_SIZE = 10
+
+# LAZY_STARTUP=0 loads the simulation stack before the app is importable.
+# Otherwise it is loaded on first use, and by a warm-up thread unless WARMUP=0.
+LAZY_STARTUP = os.environ.get('LAZY_STARTUP', '1') != '0'
+WARMUP = os.environ.get('WARMUP', '1') != '0'
+
+# Serialized plots keyed by normalized slider values, dropped when the data version changes
+plot_cache = ResultCache(maxsize=int(os.environ.get('PLOT_CACHE_SIZE', 512)),
+	ttl=int(os.environ.get('PLOT_CACHE_TTL', 6*60*60)),
+	max_bytes=int(os.environ.get('PLOT_CACHE_BYTES', 128*1024*1024)))
+
+# Forecasts of every region for one set of slider values and the plots made from
+# them, see region_simulation(). Apart from plot_cache as region_data has its own version.
+region_results_cache = ResultCache(maxsize=int(os.environ.get('REGION_CACHE_SIZE', 8)),
+	ttl=int(os.environ.get('PLOT_CACHE_TTL', 6*60*60)))
+region_plot_cache = ResultCache(maxsize=int(os.environ.get('PLOT_CACHE_SIZE', 512)),
+	ttl=int(os.environ.get('PLOT_CACHE_TTL', 6*60*60)),
+	max_bytes=int(os.environ.get('PLOT_CACHE_BYTES', 128*1024*1024)) // 4)
+
+# Simulations requested with async=1 run here, see run_or_submit()
+job_queue = jobs.JobQueue(max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+	max_pending=int(os.environ.get('JOB_QUEUE_SIZE', 32)),
+	ttl=int(os.environ.get('JOB_TTL', 10*60)))
+MAX_JOB_WAIT = 20 # seconds, below the gunicorn worker timeout
+
+# Simulation stack, set by load_simulation(). The news routes never touch these,
+# so they are served without waiting on numpy/pandas/plotly or the JHU download.
+np = func = fitting = covid_data = region_data = None
+_load_lock = threading.Lock()
+_load_times = {}
+_load_error = None
+
+def load_simulation():
+	'''
+	Imports the simulation and plotting modules and loads the covid data
+	the first time it is called. Returns (historical_df, last_updated, version),
+	see data_source.CovidData.
+	'''
+	global np, func, fitting, covid_data, region_data, _load_error
+	if covid_data is None:
+		with _load_lock:
+			if covid_data is None:
+				try:
+					with timing.stage('import'):
+						start = time.perf_counter()
+						import numpy
+						import pandas
+						_load_times['numpy/pandas'] = time.perf_counter() - start
+
+						start = time.perf_counter()
+						import func as func_module
+						import fitting as fitting_module
+						import data_source
+						_load_times['plotting'] = time.perf_counter() - start
+
+					start = time.perf_counter()
+					data = data_source.CovidData()
+					with timing.stage('jhu_load'):
+						data.get()
+					data.start_refresher()
+					_load_times['covid_data'] = time.perf_counter() - start
+				except Exception as e:
+					_load_error = repr(e)
+					raise
+
+				np, func, fitting = numpy, func_module, fitting_module
+				region_data = data_source.RegionData() # loaded and refreshed from the first region request
+				_load_error = None
+				covid_data = data
+	return covid_data.get()
+
+def _warm_up():
+	try:
+		load_simulation()
+	except Exception:
+		app.logger.exception('Loading the simulation stack failed, will retry on first use')
+
 app = Flask(__name__)
+timing.init_app(app)
+
+if not LAZY_STARTUP:
+	load_simulation()
+elif WARMUP:
+	threading.Thread(target=_warm_up, name='simulation-warm-up', daemon=True).start()
 
 @app.route('/', methods = ['GET', 'POST'])
 def index():
@@ -23,79 +108,426 @@ def search_news():
 	if request.method == 'GET':
 		sort_by = request.args.get('sort_by')
 		query = request.args.get('search')
-		news_articles = search(query, 10)
+		try:
+			news_articles, next_page = search_page(query, SEARCH_PAGE_SIZE, sort_by=sort_by,
+				after=request.args.get('after'),
+				date_from=request.args.get('from'),
+				date_to=request.args.get('to'),
+				outlet=request.args.get('outlet'))
+		except ValueError as e:
+			return make_response(jsonify({'error': str(e)}), 400)
 
-		if sort_by == 'date':
-			news_articles = sorted(news_articles, key=lambda x: x.pubDate, reverse=True)
+	# Link to the next page keeps every argument but the cursor
+	next_args = None
+	if next_page:
+		next_args = dict(request.args.items(), after=next_page)
 
-	return render_template('index.html', news_articles = news_articles)
+	return render_template('index.html', news_articles = news_articles,
+		search_term = query,
+		next_args = next_args)
 
 @app.route('/simulation', methods = ['GET', 'POST'])
 def simulation():
+	if request.args.get('region'):
+		return region_simulation(request.args['region'])
+
+	historical_df, last_updated, version = load_simulation()
 
 	if request.method == 'GET':
-		plot = func.create_plot_from_data(historical_df)
+		series = plot_cache.get_or_compute(('historical', True),
+			lambda: func.create_plot_from_data(historical_df, compact=True),
+			version=version)
 		return render_template('simulation.html', 
 			last_updated=str(last_updated),
-			plot=plot)
+			series=series)
 
 	if request.method == 'POST':
 		btn = request.form['btn']
+		compact = wants_compact()
 
 		if btn == 'historical_btn':
-			plot = func.create_plot_from_data(historical_df)
-			payload = {'last_updated': last_updated, 'plot': plot}
+			plot = plot_cache.get_or_compute(('historical', compact),
+				lambda: func.create_plot_from_data(historical_df, compact=compact),
+				version=version)
+			payload = {'last_updated': last_updated, plot_field(compact): plot}
 
 		if btn == 'forecast_btn' or btn == 'simulate_btn':
 			# Get data from the form with sliders
 			R_0, inc_per, rec_time, time_steps, _ = get_data_from_sliders()
 			params = (R_0, inc_per, rec_time, time_steps)
-			plot = func.base_seir_model(params, time_steps, historical_df, last_updated)
-			payload = {'last_updated': last_updated, 
-				'plot': plot,
-				'R_0': R_0,
-				'inc_per': inc_per,
-				'rec_time': rec_time,
-				'time_steps': time_steps}
+			key = ('simulation', compact) + normalize_params(R_0, inc_per, rec_time, time_steps, last_updated)
+
+			def compute():
+				plot = plot_cache.get_or_compute(key,
+					lambda: func.base_seir_model(params, time_steps, historical_df, last_updated, compact=compact),
+					version=version)
+				return {'last_updated': last_updated, 
+					plot_field(compact): plot,
+					'R_0': R_0,
+					'inc_per': inc_per,
+					'rec_time': rec_time,
+					'time_steps': time_steps}
+
+			return run_or_submit(key, compute, version)
 
 		resp = make_response(payload)
 		resp.status_code = 200
 		resp.headers['Access-Control-Allow-Origin'] = '*'
 		return resp
 
+def region_simulation(region):
+	'''
+	Forecast for one region of data/regions.csv (e.g. ?region=Canada/Ontario)
+	with the slider values. Every region is simulated in the same batch and
+	cached, so other regions with the same values are served from the cache.
+	'''
+	load_simulation()
+	data, last_updated, version = region_data.get()
+	region_data.start_refresher()
+	regions = data['regions']
+	if region not in regions.index:
+		return make_response(jsonify({'error': 'Unknown region: %s' % region, 'regions': list(regions.index)}), 400)
+
+	R_0, inc_per, rec_time, time_steps, _ = get_data_from_sliders()
+	params = (R_0, inc_per, rec_time, time_steps)
+	key = normalize_params(R_0, inc_per, rec_time, time_steps, last_updated)
+	compact = wants_compact()
+
+	def compute():
+		dates, results = region_results_cache.get_or_compute(key,
+			lambda: func.region_seir_model(params, time_steps, data, last_updated),
+			version=version)
+		return func.region_plot(dates, results, regions.index.get_loc(region), compact=compact)
+
+	def compute_payload():
+		plot = region_plot_cache.get_or_compute((region, compact) + key, compute, version=version)
+		return {'region': region,
+			'last_updated': last_updated,
+			plot_field(compact): plot,
+			'R_0': R_0,
+			'inc_per': inc_per,
+			'rec_time': rec_time,
+			'time_steps': time_steps}
+
+	return run_or_submit(('region', region, compact) + key, compute_payload, version)
+
 @app.route('/tuning', methods= ['GET', 'POST'])
 def tuning():
+	historical_df, _, version = load_simulation()
 	R_0, inc_per, rec_time, time_steps, start_date = get_data_from_sliders()
 	params = (R_0, inc_per, rec_time, time_steps)
+	compact = wants_compact()
 
 	if request.method == "GET":
-		plot = func.create_tuning_plot(params, historical_df)
-		payload = {
-			'plot': plot,
+		start_date = START_DATE
+
+	key = ('tuning', compact) + normalize_params(R_0, inc_per, rec_time, None, start_date)
+
+	def compute():
+		plot = plot_cache.get_or_compute(key,
+			lambda: func.create_tuning_plot(params, historical_df, start_date=start_date, compact=compact),
+			version=version)
+		return {
+			plot_field(compact): plot,
 			'R_0': R_0,
 			'inc_per': inc_per,
 			'rec_time': rec_time,
 			'time_steps': time_steps
 		}
 
-	if request.method == "POST":
-		R_0, inc_per, rec_time, _, start_date = get_data_from_sliders()
-		print(start_date, _)
-		params = (R_0, inc_per, rec_time, time_steps)
-		plot = func.create_tuning_plot(params, historical_df, start_date=start_date)
-		payload = {
-			'plot': plot,
+	return run_or_submit(key, compute, version)
+
+@app.route('/sweep', methods = ['POST'])
+def sweep():
+	'''
+	Simulates many (R_0, inc_per, rec_time) combinations in one request.
+	Expects a json body with either:
+		{"params": [[R_0, inc_per, rec_time], ...]}
+	or a grid of values to combine:
+		{"grid": {"r_0": [...], "inc_per": [...], "rec_time": [...]}}
+	and an optional "start_date" (YYYY-MM-DD).
+	'''
+	historical_df, _, version = load_simulation()
+	req_data = request.get_json(force=True, silent=True)
+	if req_data is None:
+		req_data = {}
+	if not isinstance(req_data, dict):
+		return make_response(jsonify({'error': 'expected a json object'}), 400)
+
+	start_date = req_data.get('start_date', START_DATE)
+	try:
+		datetime.strptime(start_date, '%Y-%m-%d')
+	except (TypeError, ValueError):
+		return make_response(jsonify({'error': 'start_date must be a YYYY-MM-DD string'}), 400)
+
+	if 'params' in req_data:
+		param_sets = req_data['params']
+		if isinstance(param_sets, list) and len(param_sets) > MAX_SWEEP_SIZE:
+			return make_response(jsonify({'error': 'between 1 and %d parameter sets per sweep' % MAX_SWEEP_SIZE}), 400)
+	else:
+		grid = req_data.get('grid', {})
+		if not isinstance(grid, dict):
+			return make_response(jsonify({'error': 'grid must be an object of r_0, inc_per and rec_time lists'}), 400)
+		axes = [grid.get('r_0', [R0]), grid.get('inc_per', [INC_PER]), grid.get('rec_time', [REC_TIME])]
+		if not all(isinstance(axis, list) for axis in axes):
+			return make_response(jsonify({'error': 'grid must be an object of r_0, inc_per and rec_time lists'}), 400)
+
+		# Checked before the grid is built, its size grows as the product of the axes
+		size = len(axes[0]) * len(axes[1]) * len(axes[2])
+		if not 0 < size <= MAX_SWEEP_SIZE:
+			return make_response(jsonify({'error': 'between 1 and %d parameter sets per sweep' % MAX_SWEEP_SIZE}), 400)
+		param_sets = axes
+
+	try:
+		if 'params' not in req_data:
+			param_sets = func.parameter_grid(*param_sets)
+		param_sets = np.asarray(param_sets, dtype=np.float64)
+	except (TypeError, ValueError):
+		param_sets = None
+	if param_sets is None or param_sets.ndim != 2 or param_sets.shape[1] != 3:
+		return make_response(jsonify({'error': 'params must be a list of [R_0, inc_per, rec_time]'}), 400)
+
+	if not 0 < param_sets.shape[0] <= MAX_SWEEP_SIZE:
+		return make_response(jsonify({'error': 'between 1 and %d parameter sets per sweep' % MAX_SWEEP_SIZE}), 400)
+
+	if not np.all(np.isfinite(param_sets)) or np.any(param_sets[:, 1:] <= 0):
+		return make_response(jsonify({'error': 'inc_per and rec_time must be positive'}), 400)
+
+	def compute():
+		results_df = func.parameter_sweep(param_sets, historical_df, start_date=start_date,
+			progress=jobs.report_progress)
+		converged = np.isfinite(results_df.rmse)
+		best = results_df[converged].nsmallest(1, 'rmse').to_dict(orient='records')
+		results_df['rmse'] = results_df.rmse.astype(object).where(converged, None)
+		return {
+			'start_date': start_date,
+			'results': results_df.to_dict(orient='records'),
+			'best': best[0] if best else None
+		}
+
+	key = ('sweep', str(start_date), hashlib.sha1(param_sets.tobytes()).hexdigest())
+	return run_or_submit(key, compute, version)
+
+@app.route('/ensemble', methods = ['GET', 'POST'])
+def ensemble():
+	'''
+	Ensemble forecast with the slider values: 5/50/95 percentile bands of
+	Infected, Hospitalized and Total Deaths over members runs with sampled
+	parameters (see func.ensemble_seir_model). Optional values:
+		members - ensemble size, 1 to MAX_ENSEMBLE_SIZE
+		spread - relative spread of the sampled parameters
+		stochastic - 1 for the chain-binomial step
+		seed - random seed, the same seed gives the same bands
+	'''
+	historical_df, last_updated, version = load_simulation()
+	R_0, inc_per, rec_time, time_steps, _ = get_data_from_sliders()
+	params = (R_0, inc_per, rec_time, time_steps)
+	compact = wants_compact()
+
+	try:
+		members = int(request.values.get('members', ENSEMBLE_SIZE))
+		spread = float(request.values.get('spread', ENSEMBLE_SPREAD))
+		seed = int(request.values.get('seed', 0))
+	except ValueError:
+		return make_response(jsonify({'error': 'members and seed must be integers, spread a number'}), 400)
+	stochastic = request.values.get('stochastic', '0') not in ('0', 'false', '')
+
+	if not 1 <= members <= MAX_ENSEMBLE_SIZE:
+		return make_response(jsonify({'error': 'between 1 and %d members per ensemble' % MAX_ENSEMBLE_SIZE}), 400)
+	if spread < 0 or inc_per <= 0 or rec_time <= 0 or not time_steps or time_steps < 1:
+		return make_response(jsonify({'error': 'spread must be positive, inc_per, rec_time and time_steps above 0'}), 400)
+
+	def compute():
+		dates, bands = func.ensemble_seir_model(params, time_steps, historical_df, last_updated,
+			members=members, spread=spread, stochastic=stochastic, seed=seed, progress=jobs.report_progress)
+		return func.ensemble_plot(dates, bands, compact=compact)
+
+	key = normalize_params(R_0, inc_per, rec_time, time_steps, last_updated)
+	key = ('ensemble', compact, members, round(spread, 4), stochastic, seed) + key
+
+	def compute_payload():
+		plot = plot_cache.get_or_compute(key, compute, version=version)
+		return {'last_updated': last_updated,
+			plot_field(compact): plot,
 			'R_0': R_0,
 			'inc_per': inc_per,
 			'rec_time': rec_time,
+			'time_steps': time_steps,
+			'members': members,
+			'spread': spread,
+			'stochastic': stochastic,
+			'seed': seed}
+
+	return run_or_submit(key, compute_payload, version)
+
+@app.route('/fit', methods = ['GET', 'POST'])
+def fit():
+	'''
+	Fits R_0, inc_per and rec_time to the confirmed cases from start_date
+	and returns the fitted parameters with a plot of the fitted curve.
+	'''
+	historical_df, _, version = load_simulation()
+	_, _, _, time_steps, start_date = get_data_from_sliders()
+	start_date = request.args.get('start_date', start_date)
+
+	compact = wants_compact()
+
+	def compute():
+		result = fitting.get_fit(historical_df, version, start_date=start_date)
+		plot = result['plot']
+		if compact:
+			params = (result['R_0'], result['inc_per'], result['rec_time'], None)
+			key = ('tuning', True) + normalize_params(result['R_0'], result['inc_per'], result['rec_time'], None, start_date)
+			plot = plot_cache.get_or_compute(key,
+				lambda: func.create_tuning_plot(params, historical_df, start_date=start_date, compact=True),
+				version=version)
+
+		return {
+			plot_field(compact): plot,
+			'R_0': result['R_0'],
+			'inc_per': result['inc_per'],
+			'rec_time': result['rec_time'],
+			'rmse': result['rmse'],
+			'start_date': start_date,
 			'time_steps': time_steps
 		}
 
-	resp = make_response(payload)
+	return run_or_submit(('fit', compact, str(start_date), time_steps), compute, version)
+
+@app.route('/jobs/<job_id>', methods = ['GET'])
+def job_status(job_id):
+	'''
+	Status of a background job: queued, running (with progress from 0 to 1),
+	done (with the result) or failed (with the error). ?wait=<seconds>
+	holds the request until the job finishes, for at most MAX_JOB_WAIT
+	seconds, so clients can long poll instead of polling in a tight loop.
+	'''
+	job = job_queue.get(job_id)
+	if job is None:
+		return make_response(jsonify({'error': 'Unknown or expired job: %s' % job_id}), 404)
+
+	try:
+		wait = min(float(request.args.get('wait', 0)), MAX_JOB_WAIT)
+	except ValueError:
+		return make_response(jsonify({'error': 'wait must be a number of seconds'}), 400)
+	if wait > 0:
+		job.wait(wait)
+
+	resp = make_response(job_payload(job))
 	resp.status_code = 200
 	resp.headers['Access-Control-Allow-Origin'] = '*'
 	return resp
 
+@app.route('/cache_stats', methods = ['GET'])
+def cache_stats():
+	return jsonify({'plot_cache': plot_cache.stats(),
+		'fit_cache': fitting.fit_cache.stats() if fitting else None,
+		'region_results_cache': region_results_cache.stats(),
+		'region_plot_cache': region_plot_cache.stats(),
+		'search_cache': search_cache.stats()})
+
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+	'''
+	Stage and request timings plus cache and job counters of this worker
+	process, in the Prometheus text format.
+	'''
+	caches = {'plot': plot_cache.stats(),
+		'region_results': region_results_cache.stats(),
+		'region_plot': region_plot_cache.stats(),
+		'search': search_cache.stats()}
+	if fitting:
+		caches['fit'] = fitting.fit_cache.stats()
+
+	extra = []
+	for field, metric_type, help_text in (('hits', 'counter', 'Cache hits'),
+			('misses', 'counter', 'Cache misses'),
+			('evictions', 'counter', 'Entries evicted to stay within the cache bounds'),
+			('entries', 'gauge', 'Entries in the cache'),
+			('bytes', 'gauge', 'Size of the cached values')):
+		suffix = '_total' if metric_type == 'counter' else ''
+		samples = [({'cache': name}, stats[field]) for name, stats in sorted(caches.items()) if field in stats]
+		extra.append(('covid_cache_%s%s' % (field, suffix), metric_type, help_text, samples))
+
+	job_stats = job_queue.stats()
+	extra.append(('covid_jobs_total', 'counter', 'Background jobs by outcome of the submission or run',
+		[({'outcome': outcome}, job_stats[outcome]) for outcome in ('submitted', 'coalesced', 'rejected', 'completed', 'failed')]))
+	extra.append(('covid_jobs', 'gauge', 'Background jobs queued or running',
+		[({'status': status}, job_stats[status]) for status in ('queued', 'running')]))
+
+	resp = make_response(timing.metrics.render(extra))
+	resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+	return resp
+
+@app.route('/ready', methods = ['GET'])
+def ready():
+	'''
+	Reports what has loaded. The news routes are always ready; the simulation
+	routes are ready once load_simulation() has finished.
+	?component=simulation answers 503 until that component is ready.
+	'''
+	simulation_ready = covid_data is not None
+	payload = {
+		'news': True,
+		'simulation': simulation_ready,
+		'load_times': dict(_load_times),
+		'error': _load_error,
+		'last_updated': str(covid_data.get()[1]) if simulation_ready else None
+	}
+	status = 200
+	if request.args.get('component') == 'simulation' and not simulation_ready:
+		status = 503
+	return make_response(jsonify(payload), status)
+
+def run_or_submit(key, compute, version=None):
+	'''
+	Responds with the payload returned by compute(). With async=1 compute()
+	runs as a background job instead (see jobs.py) and the response is 202
+	with the job to poll at /jobs/<job_id>. key identifies the computation
+	within version (of the data): identical jobs in flight are shared.
+	A ValueError from compute() is a 400, or a failed job.
+	'''
+	if not wants_async():
+		try:
+			payload = compute()
+		except ValueError as e:
+			return make_response(jsonify({'error': str(e)}), 400)
+		resp = make_response(payload)
+		resp.status_code = 200
+		resp.headers['Access-Control-Allow-Origin'] = '*'
+		return resp
+
+	try:
+		job = job_queue.submit((str(version),) + tuple(key), compute)
+	except jobs.QueueFull as e:
+		resp = make_response(jsonify({'error': str(e)}), 503)
+		resp.headers['Retry-After'] = '5'
+		return resp
+
+	resp = make_response(job_payload(job))
+	resp.status_code = 202
+	resp.headers['Location'] = url_for('job_status', job_id=job.id)
+	resp.headers['Access-Control-Allow-Origin'] = '*'
+	return resp
+
+def job_payload(job):
+	payload = job.to_dict()
+	payload['status_url'] = url_for('job_status', job_id=job.id)
+	return payload
+
+def wants_async():
+	return request.values.get('async', '0') not in ('0', 'false', '')
+
+def wants_compact():
+	'''
+	format=compact asks for the series of func.compact_series, which
+	static/script.js turns into plotly traces, instead of the figure JSON.
+	'''
+	return request.values.get('format') == 'compact'
+
+def plot_field(compact):
+	return 'series' if compact else 'plot'
+
 def get_data_from_sliders():
 	R_0 = float(request.form.get('r_0', R0))
 	inc_per = float(request.form.get('inc_per', INC_PER))
@@ -0,0 +1,184 @@
+'''
+	Bounded LRU cache with TTL, used to memoize serialized simulation plots
+	and news search results.
+'''
+from collections import OrderedDict
+import json
+import threading
+import time
+
+class ResultCache():
+	'''
+	Thread safe LRU cache bounded by number of entries, total size and age.
+
+	Entries belong to a data version (e.g. last_updated of historical_df).
+	Reading or writing with a new version drops every entry from the old one.
+	'''
+	def __init__(self, maxsize=256, ttl=3600, max_bytes=64*1024*1024):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.version = None
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self.invalidations = 0
+		self._entries = OrderedDict() # key -> (expires_at, size, value)
+		self._bytes = 0
+		self._lock = threading.RLock()
+
+	def get(self, key, version=None):
+		with self._lock:
+			self._check_version(version)
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] < time.monotonic():
+				self._remove(key)
+				self.expirations += 1
+				entry = None
+
+			if entry is None:
+				self.misses += 1
+				return None
+
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[2]
+
+	def set(self, key, value, version=None):
+		size = _size_of(value)
+		if size > self.max_bytes:
+			return
+
+		with self._lock:
+			self._check_version(version)
+			if key in self._entries:
+				self._remove(key)
+			self._entries[key] = (time.monotonic() + self.ttl, size, value)
+			self._bytes += size
+
+			while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	def get_or_compute(self, key, compute, version=None):
+		'''
+		Returns the cached value for key, calling compute() to fill it on a miss.
+		'''
+		value = self.get(key, version)
+		if value is None:
+			value = compute()
+			self.set(key, value, version)
+		return value
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+
+	def stats(self):
+		with self._lock:
+			return {
+				'version': None if self.version is None else str(self.version),
+				'entries': len(self._entries),
+				'bytes': self._bytes,
+				'maxsize': self.maxsize,
+				'max_bytes': self.max_bytes,
+				'ttl': self.ttl,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'expirations': self.expirations,
+				'invalidations': self.invalidations}
+
+	def _check_version(self, version):
+		if version is not None and version != self.version:
+			if self._entries:
+				self.invalidations += 1
+			self.clear()
+			self.version = version
+
+	def _remove(self, key):
+		_, size, _ = self._entries.pop(key)
+		self._bytes -= size
+
+def _size_of(value):
+	'''
+	Bytes of the strings in value, e.g. the base64 series of a compact plot.
+	'''
+	if isinstance(value, (str, bytes)):
+		return len(value)
+	if isinstance(value, dict):
+		return sum(_size_of(v) for v in value.values())
+	if isinstance(value, (list, tuple)):
+		return sum(_size_of(v) for v in value)
+	return 0
+
+def normalize_params(R_0, inc_per, rec_time, time_steps=None, start_date=None):
+	'''
+	Normalizes slider values so that equivalent requests share a cache key
+	(e.g. '7', 7 and 7.0 for inc_per).
+	'''
+	return (round(float(R_0), 4),
+		round(float(inc_per), 4),
+		round(float(rec_time), 4),
+		None if time_steps is None else int(time_steps),
+		None if start_date is None else str(start_date))
+
+class RedisResultCache(ResultCache):
+	'''
+	ResultCache backed by Redis, so every gunicorn worker shares hits.
+
+	Values must be strings. Keys are prefixed with the version, so a new
+	version stops reading the old entries and they age out with the TTL.
+	Counters are per process. Needs the redis package.
+	'''
+	def __init__(self, url, prefix, ttl=3600, max_bytes=1024*1024):
+		import redis
+		super().__init__(maxsize=None, ttl=ttl, max_bytes=max_bytes)
+		self.prefix = prefix
+		self.errors = 0
+		self._redis = redis.Redis.from_url(url)
+		self._redis_error = redis.RedisError
+
+	def get(self, key, version=None):
+		try:
+			value = self._redis.get(self._key(key, version))
+		except self._redis_error:
+			self.errors += 1
+			value = None
+
+		with self._lock:
+			if value is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+		return value.decode('utf-8')
+
+	def set(self, key, value, version=None):
+		if len(value) > self.max_bytes:
+			return
+		try:
+			self._redis.set(self._key(key, version), value, ex=self.ttl)
+		except self._redis_error:
+			self.errors += 1
+
+	def clear(self):
+		try:
+			for key in self._redis.scan_iter(match=self.prefix + ':*'):
+				self._redis.delete(key)
+		except self._redis_error:
+			self.errors += 1
+
+	def stats(self):
+		with self._lock:
+			return {
+				'backend': 'redis',
+				'prefix': self.prefix,
+				'ttl': self.ttl,
+				'hits': self.hits,
+				'misses': self.misses,
+				'errors': self.errors}
+
+	def _key(self, key, version):
+		return '%s:%s:%s' % (self.prefix, version, json.dumps(key))
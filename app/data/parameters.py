@@ -4,4 +4,8 @@ INC_PER = 7
 REC_TIME = 21
 TIME_STEPS = 183
 CDR = 0.12
-START_DATE = '2020-04-05'
\ No newline at end of file
+START_DATE = '2020-04-05'
+COUNTRY = 'Canada'
+# Ensemble forecasts: members, relative spread (lognormal sigma) of the sampled parameters
+ENSEMBLE_SIZE = 1000
+ENSEMBLE_SPREAD = 0.1
@@ -0,0 +1,271 @@
+'''
+	Local cache and background refresh for the JHU time series.
+
+	Raw CSVs are kept on disk and revalidated with ETag / Last-Modified,
+	so an unchanged file is never downloaded twice. The reduced country
+	frame, and the per region arrays of load_region_data, are stored as
+	NumPy .npz files next to them and reused until one of the raw files
+	changes.
+
+	Sources can be overridden with environment variables, and may be local
+	file paths (or file:// urls) so the app works offline:
+		JHU_CONFIRMED_URL, JHU_RECOVERED_URL, JHU_DEATHS_URL
+		COVID_DATA_DIR - where the cached files are written
+		COVID_DATA_REFRESH - seconds between background refreshes
+'''
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import requests
+import func
+from data.parameters import COUNTRY
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.environ.get('COVID_DATA_DIR', os.path.join(os.path.dirname(__file__), 'data', 'cache'))
+REFRESH_INTERVAL = int(os.environ.get('COVID_DATA_REFRESH', 60*60))
+REQUEST_TIMEOUT = 30
+CHUNK_SIZE = 64*1024
+# Part of the region cache key, bump it when get_region_data computes its arrays differently
+REGION_DATA_FORMAT = 2
+
+def get_sources():
+	return (os.environ.get('JHU_CONFIRMED_URL', func.JHU_GLOBAL_CONFIRMED),
+		os.environ.get('JHU_RECOVERED_URL', func.JHU_GLOBAL_RECOVERED),
+		os.environ.get('JHU_DEATHS_URL', func.JHU_GLOBAL_DEATHS))
+
+def _local_path(source):
+	if source.startswith('file://'):
+		return source[len('file://'):]
+	if '://' not in source:
+		return source
+	return None
+
+def fetch_csv(source, data_dir=DATA_DIR, session=requests):
+	'''
+	Returns (path, validator) for source, downloading it only when the
+	server reports a change. Local sources are used in place.
+
+	If the download fails and a cached copy exists, the cached copy is used.
+	'''
+	path = _local_path(source)
+	if path is not None:
+		stat = os.stat(path)
+		return path, '%s:%d:%d' % (path, stat.st_mtime_ns, stat.st_size)
+
+	name = hashlib.md5(source.encode('utf-8')).hexdigest()
+	path = os.path.join(data_dir, name + '.csv')
+	meta_path = os.path.join(data_dir, name + '.json')
+	meta = {}
+	if os.path.exists(path) and os.path.exists(meta_path):
+		with open(meta_path) as f:
+			meta = json.load(f)
+
+	headers = {}
+	if meta.get('etag'):
+		headers['If-None-Match'] = meta['etag']
+	if meta.get('last_modified'):
+		headers['If-Modified-Since'] = meta['last_modified']
+
+	try:
+		with session.get(source, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as response:
+			if response.status_code != 304:
+				response.raise_for_status()
+				os.makedirs(data_dir, exist_ok=True)
+				sha1 = _download(response, path)
+				meta = {
+					'etag': response.headers.get('ETag'),
+					'last_modified': response.headers.get('Last-Modified'),
+					'sha1': sha1}
+				_atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+	except requests.RequestException:
+		if not meta:
+			raise
+		logger.warning('Could not revalidate %s, using cached copy', source, exc_info=True)
+
+	return path, meta['sha1']
+
+def _temp_file(path, suffix='.tmp'):
+	'''
+	Returns (file, name) of a new temporary file next to path. Each writer
+	gets its own, so gunicorn workers refreshing at once don't interleave.
+	'''
+	fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix=suffix,
+		dir=os.path.dirname(path) or '.')
+	return os.fdopen(fd, 'wb'), tmp_path
+
+def _replace(tmp_path, path):
+	try:
+		os.replace(tmp_path, path)
+	except OSError:
+		os.remove(tmp_path)
+		raise
+
+def _download(response, path):
+	'''
+	Streams the body of response to path, chunk by chunk, and returns its
+	sha1. The whole file is never held in memory.
+	'''
+	sha1 = hashlib.sha1()
+	f, tmp_path = _temp_file(path)
+	try:
+		with f:
+			for chunk in response.iter_content(CHUNK_SIZE):
+				sha1.update(chunk)
+				f.write(chunk)
+	except BaseException:
+		os.remove(tmp_path)
+		raise
+	_replace(tmp_path, path)
+	return sha1.hexdigest()
+
+def _atomic_write(path, content):
+	f, tmp_path = _temp_file(path)
+	with f:
+		f.write(content)
+	_replace(tmp_path, path)
+
+def _atomic_savez(path, **arrays):
+	f, tmp_path = _temp_file(path, suffix='.npz')
+	with f:
+		np.savez(f, **arrays)
+	_replace(tmp_path, path)
+
+def load_covid_data(sources=None, data_dir=DATA_DIR, country=COUNTRY):
+	'''
+	Returns (historical_df, last_updated, version), using the reduced .npz
+	frame when none of the raw CSVs changed since it was written. version
+	is a hash of the raw CSVs, it changes whenever any of them does (even
+	when JHU revises past values without adding a date).
+	'''
+	sources = sources or get_sources()
+	fetched = [fetch_csv(source, data_dir) for source in sources]
+	key = hashlib.md5('|'.join(validator for _, validator in fetched).encode('utf-8')).hexdigest()
+	npz_path = os.path.join(data_dir, 'historical-%s.npz' % hashlib.md5(country.encode('utf-8')).hexdigest())
+
+	if os.path.exists(npz_path):
+		with np.load(npz_path) as npz:
+			if str(npz['key']) == key:
+				historical_df = func.index_by_date(pd.DataFrame({
+					'date': pd.to_datetime(npz['date']),
+					'num_confirmed': npz['num_confirmed'],
+					'num_recovered': npz['num_recovered'],
+					'num_deaths': npz['num_deaths']}))
+				return historical_df, str(npz['last_updated']), key
+
+	historical_df, last_updated = func.get_covid_data(sources=[path for path, _ in fetched], country=country)
+
+	os.makedirs(data_dir, exist_ok=True)
+	_atomic_savez(npz_path,
+		key=key,
+		last_updated=last_updated,
+		date=historical_df.date.to_numpy(dtype='datetime64[D]'),
+		num_confirmed=historical_df.num_confirmed.to_numpy(),
+		num_recovered=historical_df.num_recovered.to_numpy(),
+		num_deaths=historical_df.num_deaths.to_numpy())
+
+	return historical_df, last_updated, key
+
+def load_region_data(sources=None, data_dir=DATA_DIR, regions_file=func.REGIONS_FILE):
+	'''
+	Returns (region_data, last_updated, version) for every region in
+	regions_file (see func.get_region_data), cached like load_covid_data.
+	Editing regions_file also invalidates the cache and changes version.
+	'''
+	sources = sources or get_sources()
+	fetched = [fetch_csv(source, data_dir) for source in sources]
+	_, regions_validator = fetch_csv(regions_file)
+	validators = [validator for _, validator in fetched] + [regions_validator, str(REGION_DATA_FORMAT)]
+	key = hashlib.md5('|'.join(validators).encode('utf-8')).hexdigest()
+	npz_path = os.path.join(data_dir, 'regions-%s.npz' % hashlib.md5(regions_file.encode('utf-8')).hexdigest())
+	regions = func.load_regions(regions_file)
+
+	if os.path.exists(npz_path):
+		with np.load(npz_path) as npz:
+			if str(npz['key']) == key:
+				region_data = {'regions': regions, 'date': pd.to_datetime(npz['date'])}
+				for name in ('num_confirmed', 'num_recovered', 'num_deaths'):
+					region_data[name] = npz[name]
+				return region_data, str(npz['last_updated']), key
+
+	region_data, last_updated = func.get_region_data(regions, sources=[path for path, _ in fetched])
+
+	os.makedirs(data_dir, exist_ok=True)
+	_atomic_savez(npz_path,
+		key=key,
+		last_updated=last_updated,
+		date=region_data['date'].to_numpy(dtype='datetime64[D]'),
+		num_confirmed=region_data['num_confirmed'],
+		num_recovered=region_data['num_recovered'],
+		num_deaths=region_data['num_deaths'])
+
+	return region_data, last_updated, key
+
+class CovidData():
+	'''
+	Holds the current (historical_df, last_updated, version). Readers call
+	get() once per request; refresh() swaps in a new tuple in a single
+	assignment, so a request never sees a frame from one version and a date
+	or version from another. Caches of results computed from the data should
+	use version, see load_covid_data.
+	'''
+	def __init__(self, sources=None, data_dir=DATA_DIR, country=COUNTRY):
+		self.sources = sources
+		self.country = country
+		self.data_dir = data_dir
+		self._data = None
+		self._lock = threading.Lock()
+		self._refresher = None
+		self._refresher_lock = threading.Lock()
+		self._stop = threading.Event()
+
+	def get(self):
+		if self._data is None:
+			self.refresh()
+		return self._data
+
+	def refresh(self):
+		with self._lock:
+			self._data = load_covid_data(self.sources, self.data_dir, self.country)
+		return self._data
+
+	def start_refresher(self, interval=REFRESH_INTERVAL):
+		'''
+		Refreshes the data every interval seconds on a daemon thread. Only
+		the first call starts it.
+		'''
+		with self._refresher_lock:
+			if self._refresher is not None or interval <= 0:
+				return
+			self._refresher = threading.Thread(target=self._refresh_every, args=(interval,),
+				name='%s-refresher' % type(self).__name__, daemon=True)
+			self._refresher.start()
+
+	def _refresh_every(self, interval):
+		while not self._stop.wait(interval):
+			try:
+				self.refresh()
+			except Exception:
+				logger.exception('Refreshing covid data failed, keeping the previous version')
+
+	def stop_refresher(self):
+		self._stop.set()
+
+class RegionData(CovidData):
+	'''
+	CovidData for every region of func.REGIONS_FILE, get() returns
+	(region_data, last_updated, version).
+	'''
+	def __init__(self, sources=None, data_dir=DATA_DIR, regions_file=func.REGIONS_FILE):
+		super().__init__(sources, data_dir)
+		self.regions_file = regions_file
+
+	def refresh(self):
+		with self._lock:
+			self._data = load_region_data(self.sources, self.data_dir, self.regions_file)
+		return self._data
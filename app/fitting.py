@@ -0,0 +1,131 @@
+'''
+	Fits the SEIR parameters (R_0, inc_per, rec_time) to the historical data.
+
+	The fit is a successive grid refinement: every iteration evaluates a
+	points x points x points grid with func.parameter_sweep, then shrinks the
+	search box around the best parameter set. The search box is split into
+	FIT_SHARDS parts refined on a process pool, and fits are cached per
+	(data version, start date).
+'''
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from datetime import datetime
+import os
+import threading
+import numpy as np
+import func
+import timing
+from cache import ResultCache
+from data.parameters import START_DATE
+
+# Same ranges as the sliders on the tuning page
+PARAMETER_BOUNDS = ((0.05, 10), (1, 31), (1, 31))
+
+# Parts of the R_0 range refined separately. Fixed, so the fitted parameters
+# are the same whatever the number of workers.
+FIT_SHARDS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+fit_cache = ResultCache(maxsize=128, ttl=24*60*60)
+
+def _num_workers(processes=None):
+	return processes or int(os.environ.get('FIT_WORKERS', 0)) or os.cpu_count() or 1
+
+def _get_pool(processes=None):
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			# Not forked: the app runs in threaded gunicorn workers, and a fork
+			# taken while another thread holds a lock can deadlock the child
+			_pool = ProcessPoolExecutor(max_workers=_num_workers(processes),
+				mp_context=multiprocessing.get_context('spawn'))
+		return _pool
+
+def _refine(args):
+	'''
+	Successive grid refinement within bounds, returns (best parameters, rmse),
+	best being None when no parameter set converged.
+	'''
+	bounds, historical_df, start_date, points, iterations = args
+	min_bounds = np.array([b[0] for b in bounds], dtype=np.float64)
+	max_bounds = np.array([b[1] for b in bounds], dtype=np.float64)
+	lower, upper = min_bounds, max_bounds
+	best, best_rmse = None, np.inf
+
+	for _ in range(iterations):
+		axes = [np.linspace(lo, hi, points) for lo, hi in zip(lower, upper)]
+		param_sets = func.parameter_grid(*axes)
+		rmse = func.parameter_sweep(param_sets, historical_df, start_date=start_date).rmse.to_numpy()
+		rmse = np.where(np.isfinite(rmse), rmse, np.inf)
+
+		i = np.argmin(rmse)
+		if rmse[i] < best_rmse:
+			best, best_rmse = param_sets[i], rmse[i]
+		if best is None:
+			break
+
+		# Zoom in to one grid step around the best parameters so far
+		step = (upper - lower) / (points - 1)
+		lower = np.maximum(min_bounds, best - step)
+		upper = np.minimum(max_bounds, best + step)
+
+	return best, best_rmse
+
+def _shard(bounds, shards):
+	'''
+	Splits the R_0 range of bounds into shards consecutive ranges.
+	'''
+	edges = np.linspace(bounds[0][0], bounds[0][1], shards + 1)
+	return [((float(lo), float(hi)),) + tuple(bounds[1:]) for lo, hi in zip(edges[:-1], edges[1:])]
+
+def fit_parameters(historical_df, start_date=START_DATE, bounds=PARAMETER_BOUNDS,
+				points=9, iterations=4, processes=None):
+	'''
+	Finds the (R_0, inc_per, rec_time) that minimizes the rmse between the
+	simulated confirmed cases (Infected + Exposed) and num_confirmed from
+	start_date onwards.
+
+	The R_0 range is split into FIT_SHARDS parts, each refined on its own
+	and the best fit wins. With several workers the parts are refined in
+	parallel, the result does not depend on their number.
+
+	Returns a dict with R_0, inc_per, rec_time and rmse.
+	'''
+	if type(start_date) == str:
+		start_date = datetime.strptime(start_date, '%Y-%m-%d')
+
+	if not func.has_date(historical_df, start_date):
+		raise ValueError('No historical data for start date %s' % start_date.date())
+
+	args = [(shard, historical_df, start_date, points, iterations) for shard in _shard(bounds, FIT_SHARDS)]
+	if _num_workers(processes) == 1:
+		fits = list(map(_refine, args))
+	else:
+		fits = list(_get_pool(processes).map(_refine, args))
+
+	best, best_rmse = min(fits, key=lambda fit: fit[1])
+	if best is None:
+		raise ValueError('No parameter set converged for start date %s' % start_date.date())
+
+	return {
+		'R_0': float(best[0]),
+		'inc_per': float(best[1]),
+		'rec_time': float(best[2]),
+		'rmse': float(best_rmse)}
+
+def get_fit(historical_df, version, start_date=START_DATE, processes=None):
+	'''
+	Returns the fitted parameters and a plot of the fitted curve against the
+	actual confirmed cases. Results are cached per (version, start_date), so
+	a change of the data invalidates them.
+	'''
+	def compute():
+		with timing.stage('fit'):
+			fit = fit_parameters(historical_df, start_date, processes=processes)
+		params = (fit['R_0'], fit['inc_per'], fit['rec_time'], None)
+		fit['plot'] = func.create_tuning_plot(params, historical_df, start_date=start_date)
+		return fit
+
+	return fit_cache.get_or_compute(str(start_date), compute, version=str(version))
@@ -1,39 +1,89 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from data.parameters import CDR, START_DATE
+from datetime import datetime
+from data.parameters import START_DATE, COUNTRY, ENSEMBLE_SIZE, ENSEMBLE_SPREAD
 import plotly.express as px
 import plotly
 import plotly.graph_objs as go
 import json
 import os
-
-def get_covid_data():
+import base64
+import io
+import csv
+from urllib.request import urlopen
+from functools import lru_cache
+import itertools
+import seir
+import timing
+
+JHU_GLOBAL_CONFIRMED = 'https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
+JHU_GLOBAL_RECOVERED = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv'
+JHU_GLOBAL_DEATHS = 'https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv'
+
+JHU_ID_COLUMNS = ['Province/State', 'Country/Region', 'Lat', 'Long']
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+REGIONS_FILE = os.path.join(DATA_DIR, 'regions.csv')
+DEFAULT_AGE_FILE = 'age_data_canada_2019.csv'
+
+@timing.timed('jhu_load')
+def get_covid_data(sources=(JHU_GLOBAL_CONFIRMED, JHU_GLOBAL_RECOVERED, JHU_GLOBAL_DEATHS), country=COUNTRY):
 	'''
 	Gets covid data from the Johhn Hopkins Repo
 	https://github.com/CSSEGISandData/COVID-19
-	'''
-	JHU_GLOBAL_CONFIRMED = 'https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
-	JHU_GLOBAL_RECOVERED = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv'
-	JHU_GLOBAL_DEATHS = 'https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv'
 
-	# Get data from John Hopkins Repo
-	global_confirmed = pd.read_csv(JHU_GLOBAL_CONFIRMED).rename(columns = {'Country/Region':'Country'})
-	global_recovered = pd.read_csv(JHU_GLOBAL_RECOVERED).rename(columns = {'Country/Region':'Country'})
-	global_deaths = pd.read_csv(JHU_GLOBAL_DEATHS).rename(columns = {'Country/Region':'Country'})
+	sources - (confirmed, recovered, deaths) urls or local file paths
+	country - Country/Region to keep, all of its provinces are summed
+	'''
+	confirmed_source, recovered_source, deaths_source = sources
 
-	# Filter data for Canada Only
-	global_confirmed = global_confirmed[global_confirmed.Country == 'Canada']
-	global_recovered = global_recovered[global_recovered.Country == 'Canada']
-	global_deaths = global_deaths[global_deaths.Country == 'Canada']
+	# Get data from John Hopkins Repo, keeping only the rows for country
+	global_confirmed = _read_country_series(confirmed_source, country)
+	global_recovered = _read_country_series(recovered_source, country)
+	global_deaths = _read_country_series(deaths_source, country)
 
-	last_updated = global_confirmed.columns[-1]
 	historical_df = _create_historical_df(global_confirmed, global_recovered, global_deaths)
+	last_updated = global_confirmed[0][len(historical_df) - 1]
 	return historical_df, last_updated
 
+def _open_source(source):
+	if '://' in source and not source.startswith('file://'):
+		return io.TextIOWrapper(urlopen(source), encoding='utf-8', newline='')
+	if source.startswith('file://'):
+		source = source[len('file://'):]
+	return open(source, encoding='utf-8', newline='')
+
+def _read_country_series(source, country):
+	'''
+	Streams a JHU time series CSV row by row and sums the rows of country
+	as they are read, so only one country's series is ever held in memory.
+
+	Returns (date_headers, totals) where totals is an int32 array.
+	'''
+	with _open_source(source) as f:
+		header = next(csv.reader([next(f)]))
+		country_idx = header.index('Country/Region')
+		first_date_idx = max(header.index(column) for column in JHU_ID_COLUMNS) + 1
+		date_headers = header[first_date_idx:]
+		totals = np.zeros(len(date_headers), dtype=np.int32)
+		found = False
+
+		# Cheap substring test first, only candidate lines are split into fields
+		candidates = (line for line in f if country in line)
+		for row in csv.reader(candidates):
+			if row[country_idx] != country:
+				continue
+			values = row[first_date_idx:]
+			totals[:len(values)] += np.array([v or 0 for v in values], dtype=np.float64).astype(np.int32)
+			found = True
+
+	if not found:
+		raise ValueError('No rows for %s in %s' % (country, source))
+	return date_headers, totals
+
 def _create_historical_df(global_confirmed, global_recovered, global_deaths):
 	'''
-	Converts raw data obtained from the Johhn Hopkins Repo
+	Converts the (date_headers, totals) series read from the Johhn Hopkins Repo
 	and returns a single dataframe with the relevant information
 
 	date
@@ -41,37 +91,197 @@ def _create_historical_df(global_confirmed, global_recovered, global_deaths):
 	num_recovered
 	num_deaths
 	'''
-	historical_df = pd.DataFrame()
-	dates =  [datetime.strptime(date, '%m/%d/%y') \
-	          for date in global_confirmed.drop(['Province/State','Country','Lat','Long'],axis=1).sum(axis=0).index]
+	date_headers, num_confirmed = global_confirmed
+	_, num_recovered = global_recovered
+	_, num_deaths = global_deaths
 
-	num_confirmed = global_confirmed.drop(['Province/State', 'Country', 'Lat', 'Long'],axis=1)
-	num_confirmed = num_confirmed.sum(axis=0).values
+	# The three files are not always updated together, keep the dates all of them cover
+	n = min(len(num_confirmed), len(num_recovered), len(num_deaths))
 
-	num_recovered = global_recovered.drop(['Province/State', 'Country', 'Lat', 'Long'],axis=1)
-	num_recovered = num_recovered.sum(axis=0).values
+	return index_by_date(pd.DataFrame({
+		'date': pd.to_datetime(pd.Index(date_headers[:n]), format='%m/%d/%y'),
+		'num_confirmed': num_confirmed[:n],
+		'num_recovered': num_recovered[:n],
+		'num_deaths': num_deaths[:n]}))
 
-	num_deaths = global_deaths.drop(['Province/State', 'Country', 'Lat', 'Long'],axis=1)
-	num_deaths = num_deaths.sum(axis=0).values
+def index_by_date(historical_df):
+	'''
+	Returns historical_df with its dates as a DatetimeIndex (the date column
+	is kept). Done once when the data is loaded, so looking up a date or a
+	range of dates is a binary search instead of a scan of every row.
+	'''
+	if isinstance(historical_df.index, pd.DatetimeIndex):
+		return historical_df
+	return historical_df.set_index(pd.DatetimeIndex(historical_df.date.to_numpy()), drop=False)
+
+def has_date(historical_df, date):
+	return pd.Timestamp(date) in index_by_date(historical_df).index
 
-	historical_df['date'] = dates
-	historical_df['num_confirmed'] = num_confirmed
-	historical_df['num_recovered'] = num_recovered
-	historical_df['num_deaths'] = num_deaths
+def _date_position(historical_df, date):
+	try:
+		return index_by_date(historical_df).index.get_loc(pd.Timestamp(date))
+	except KeyError:
+		raise ValueError('No historical data for %s' % pd.Timestamp(date).date())
+
+def _date_range(historical_df, start_date, end_date):
+	'''
+	Rows from start_date to end_date (inclusive), sliced without a copy.
+	'''
+	return index_by_date(historical_df).loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
 
-	return historical_df
+@timing.timed('jhu_load')
+def get_region_data(regions, sources=(JHU_GLOBAL_CONFIRMED, JHU_GLOBAL_RECOVERED, JHU_GLOBAL_DEATHS)):
+	'''
+	Reads the series of every region in regions (see load_regions) with a
+	single pass over each JHU file.
+
+	Returns (region_data, last_updated), region_data being a dict with
+		regions - the regions dataframe
+		date - DatetimeIndex shared by every region
+		num_confirmed, num_recovered, num_deaths - int32 arrays of shape (regions, dates)
+
+	JHU only reports recovered cases for some countries as a whole (e.g.
+	Canada), so a province with no recovered series gets an estimate: the
+	country's recovered cases times the province's share of its confirmed
+	cases, day by day. Otherwise its whole confirmed count would start the
+	forecast as Infected.
+	'''
+	keys = list(zip(regions.country, regions.province))
+	# Whole country totals are needed for the estimates, even of countries not in regions
+	countries = [(country, '') for country, province in keys if province]
+	keys += sorted(set(countries) - set(keys))
+	series = [_read_region_series(source, keys) for source in sources]
+
+	# The three files are not always updated together, keep the dates all of them cover
+	n = min(len(date_headers) for date_headers, _ in series)
+	date_headers = series[0][0]
+	confirmed, recovered, deaths = (totals[:, :n] for _, totals in series)
+	_estimate_recovered(keys, confirmed, recovered)
+
+	region_data = {
+		'regions': regions,
+		'date': pd.to_datetime(pd.Index(date_headers[:n]), format='%m/%d/%y')}
+	for name, totals in zip(('num_confirmed', 'num_recovered', 'num_deaths'), (confirmed, recovered, deaths)):
+		region_data[name] = np.ascontiguousarray(totals[:len(regions)])
+	return region_data, date_headers[n - 1]
+
+def _estimate_recovered(keys, confirmed, recovered):
+	'''
+	Fills in, in place, the recovered cases of the provinces with none
+	reported from their country's (see get_region_data).
+	'''
+	index = {key: i for i, key in enumerate(keys)}
+	for i, (country, province) in enumerate(keys):
+		if not province or recovered[i].any():
+			continue
+		country_row = index[(country, '')]
+		country_confirmed = confirmed[country_row].astype(np.float64)
+		share = np.divide(confirmed[i], country_confirmed, out=np.zeros_like(country_confirmed),
+			where=country_confirmed > 0)
+		recovered[i] = np.round(recovered[country_row] * share)
+
+def _read_region_series(source, keys):
+	'''
+	Streams a JHU time series CSV and sums its rows into one row per
+	(country, province) key. A key with an empty province gets every row
+	of the country, like _read_country_series.
 
-def create_plot_from_data(data, value_vars=['num_confirmed', 'num_recovered', 'num_deaths']):
+	Regions missing from a file stay at zero; e.g. JHU only reports
+	recovered cases for Canada as a whole, not per province (see
+	_estimate_recovered).
+	'''
+	index = {key: i for i, key in enumerate(keys)}
+	countries = set(country for country, _ in keys)
+
+	with _open_source(source) as f:
+		reader = csv.reader(f)
+		header = next(reader)
+		country_idx = header.index('Country/Region')
+		province_idx = header.index('Province/State')
+		first_date_idx = max(header.index(column) for column in JHU_ID_COLUMNS) + 1
+		date_headers = header[first_date_idx:]
+		totals = np.zeros((len(keys), len(date_headers)), dtype=np.int32)
+
+		for row in reader:
+			country, province = row[country_idx], row[province_idx]
+			if country not in countries:
+				continue
+			values = row[first_date_idx:]
+			values = np.array([v or 0 for v in values], dtype=np.float64).astype(np.int32)
+			for key in set([(country, ''), (country, province)]):
+				if key in index:
+					totals[index[key], :len(values)] += values
+
+	return date_headers, totals
+
+@lru_cache(maxsize=None)
+def load_regions(path=REGIONS_FILE):
+	'''
+	Reads the regions that can be simulated, one per row of data/regions.csv:
+		region - name used by /simulation?region=, e.g. Canada or Canada/Ontario
+		country, province - JHU Country/Region and Province/State, no province
+			for a whole country
+		population
+		hospital_beds - empty to use the country's beds per capita
+		age_file - population by age group in data/, empty for the country's
+
+	Returns a dataframe indexed by region with every column filled in.
+	'''
+	regions = pd.read_csv(path, dtype={'province': str, 'age_file': str})
+	regions['province'] = regions.province.fillna('')
+
+	countries = regions[regions.province == ''].set_index('country')
+	beds_per_capita = regions.country.map(countries.hospital_beds / countries.population)
+	regions['hospital_beds'] = regions.hospital_beds.fillna(np.round(regions.population * beds_per_capita))
+	regions['age_file'] = regions.age_file.fillna(regions.country.map(countries.age_file)).fillna(DEFAULT_AGE_FILE)
+	return regions.set_index('region')
+
+@timing.timed('plot')
+def create_plot_from_data(data, value_vars=['num_confirmed', 'num_recovered', 'num_deaths'], compact=False):
+	if compact:
+		return compact_series(data.date.iloc[0], {name: data[name] for name in value_vars},
+			xaxis_title='date')
 	fig = px.line(data.melt(id_vars='date', value_vars=value_vars), x="date", y="value", color='variable')
 	return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
 
-def init_social_demographic_data():
+@timing.timed('plot')
+def compact_series(start_date, series, lines=None, fills=None, **titles):
+	'''
+	Compact alternative to the plotly figure JSON, turned into traces by
+	static/script.js: one value a day from start_date, each series as
+	base64 of little endian float32 (nan for gaps).
+		{'start': 'YYYY-MM-DD', 'step': 1,
+		 'series': [{'name': ..., 'data': <base64>, 'line': {...}}, ...],
+		 'layout': {'xaxis_title': ..., 'yaxis_title': ..., 'legend_title': ...}}
+	fills maps series names to a fill colour, filled down to the series
+	before it (e.g. a percentile band); those series get 'fill' too.
+	'''
+	layout = {'xaxis_title': 'dates', 'yaxis_title': 'value', 'legend_title': 'variable'}
+	layout.update(titles)
+	lines = lines or {}
+	fills = fills or {}
+	compact = {
+		'start': pd.Timestamp(start_date).strftime('%Y-%m-%d'),
+		'step': 1,
+		'series': [{
+			'name': name,
+			'data': base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii'),
+			'line': lines.get(name, {})} for name, values in series.items()],
+		'layout': layout}
+	for item in compact['series']:
+		if item['name'] in fills:
+			item['fill'] = fills[item['name']]
+	return compact
+
+def init_social_demographic_data(age_file=DEFAULT_AGE_FILE):
 	'''
 	Combines Canadian demographic data taken from: 
 		https://www.populationpyramid.net/canada/2019/
 	and data taken from a study down on COVID-19, grouped by age groups:
 		https://www.imperial.ac.uk/media/imperial-college/medicine/sph/ide/gida-fellowships/Imperial-College-COVID19-NPI-modelling-16-03-2020.pdf
 
+	age_file - population by age group in data/, the rates are the same for every region
+
 	Returns a pandas dataframe with the following info:
 		- Age group
 		- Total Population
@@ -79,9 +289,7 @@ def init_social_demographic_data():
 		- Hospitalization Rate
 		- Hospitalized Death Rate
 	'''
-	dirname = os.path.dirname(__file__)
-	filename = os.path.join(dirname, 'data/age_data_canada_2019.csv')
-	age_data_df = pd.read_csv(filename)
+	age_data_df = pd.read_csv(os.path.join(DATA_DIR, age_file))
 	age_data_df['distribution'] = age_data_df.population / age_data_df.population.sum()
 
 	# Add Data related to study: 
@@ -107,7 +315,19 @@ def init_social_demographic_data():
 	age_data_df.loc[age_data_df.Age=='80+','hospitalized_death_rate'] = 0.093
 	return age_data_df
 
-def _get_init_values_for_model(historical_df, start_date):
+@lru_cache(maxsize=None)
+def _get_age_arrays(age_file=DEFAULT_AGE_FILE):
+	'''
+	Returns the age distribution, hospitalization rate and hospitalized
+	death rate from init_social_demographic_data as float64 arrays.
+	Loaded once per process and shared by every simulation.
+	'''
+	age_data_df = init_social_demographic_data(age_file)
+	return (age_data_df.distribution.to_numpy(dtype=np.float64),
+		age_data_df.hospitalization_rate.to_numpy(dtype=np.float64),
+		age_data_df.hospitalized_death_rate.to_numpy(dtype=np.float64))
+
+def _get_init_values_for_model(historical_df, start_date, population=None):
 	'''
 	Return the Initial Values needed for SIER Model:
 	- Initial number of people Susceptible
@@ -119,26 +339,27 @@ def _get_init_values_for_model(historical_df, start_date):
 	- Disease Recovery Rate
 	'''
 
-	N = 37411038 # Population of Canada
+	N = population or load_regions().population[COUNTRY]
+
+	# Row of start_date, read straight from the column arrays
+	day = _date_position(historical_df, start_date)
+	num_confirmed = historical_df.num_confirmed.to_numpy()[day]
+	num_recovered = historical_df.num_recovered.to_numpy()[day]
+	num_deaths = historical_df.num_deaths.to_numpy()[day]
 
 	# Exposed = (num_confirmed - num_recovered - num_deaths) * (1 - reporting_rate / reporting_rate)
 	RR = 0.75
-	E_0 = (historical_df[historical_df.date == start_date].num_confirmed.values[0]\
-	        - historical_df[historical_df.date == start_date].num_recovered.values[0]\
-	        - historical_df[historical_df.date == start_date].num_deaths.values[0])\
-	    * ((1 - RR) / RR)
+	E_0 = (num_confirmed - num_recovered - num_deaths) * ((1 - RR) / RR)
 	E_0 = round(E_0)
 
 	# Infected = num_confirmed - (num_recovered + num_deaths)
-	I_0 = historical_df[historical_df.date == start_date].num_confirmed.values[0]\
-		- historical_df[historical_df.date == start_date].num_recovered.values[0]\
-	    - historical_df[historical_df.date == start_date].num_deaths.values[0]
+	I_0 = num_confirmed - num_recovered - num_deaths
 
 	# Recovered
-	R_0 = historical_df[historical_df.date == start_date].num_recovered.values[0]
+	R_0 = num_recovered
 
 	# Deaths
-	D_0 = historical_df[historical_df.date == start_date].num_deaths.values[0]
+	D_0 = num_deaths
 
 	# Susceptible = Total Population - (Exposed + Infected + Removed)
 	S_0 = N - (E_0 + I_0 + R_0 + D_0)
@@ -162,7 +383,7 @@ def _get_model_hyperparams(params):
 	return beta, sigma, gamma
 
 def base_seir_model(params, time_steps, historical_df, start_date, jsonify=True, 
-					value_vars = ['Exposed','Infected','Hospitalized', 'Total Deaths']):
+					value_vars = ['Exposed','Infected','Hospitalized', 'Total Deaths'], compact=False):
 	'''
 	SEIR Model to forecast the outcome of the COVID-19 pandemic.
 	For more details about the model see this link:
@@ -172,73 +393,38 @@ def base_seir_model(params, time_steps, historical_df, start_date, jsonify=True,
 	if type(start_date) == str:
 		start_date = datetime.strptime(start_date, '%m/%d/%y')
 
-	S_0, E_0, I_0, R_0, D_0 = _get_init_values_for_model(historical_df, start_date)
-	age_data_df = init_social_demographic_data()
-	num_hospital_beds = 93527
-
-	# Estimate initial people in hospital using social demographic data
-	round(I_0 * age_data_df.distribution * age_data_df.hospitalization_rate).sum()
-	H_0 = round(I_0 * age_data_df.distribution * age_data_df.hospitalization_rate).sum()
-
-	N = S_0 + E_0 + I_0 + R_0 + D_0 # Total Population
-	beta, sigma, gamma = _get_model_hyperparams(params)
-	
-	S, E, I, R, D, H = [S_0], [E_0], [I_0], [R_0], [D_0], [H_0]
-	dates = [start_date]
-
-	# Start simulation
-	for i in range(1,time_steps+1):
-		date = dates[-1] + timedelta(days=1)
-		next_S = S[-1] - (beta*S[-1]*I[-1])/N
-		next_E = E[-1] + (beta*S[-1]*I[-1])/N - sigma*E[-1]
-		next_I = I[-1] + (sigma*E[-1] - gamma*I[-1])
-		next_R = R[-1] + (gamma*I[-1])
-
-		# current hospital count = current infected * age distribution * hospitalization rate
-		next_H = round(next_I * age_data_df.distribution * age_data_df.hospitalization_rate).sum()
-
-		# If hospital care avaialble, death rate is lower
-		if next_H <= num_hospital_beds:
-			next_D = D[-1] + round(next_H * age_data_df.distribution * age_data_df.hospitalized_death_rate).sum()
-		# If hospital care unabailable, death rate is higher (we use the critical death rate, CDR, which is ~12%)
-		# CDR gotten from: https://wwwnc.cdc.gov/eid/article/26/6/20-0233_article
-		else:
-			deaths_with_hospital_care = round(num_hospital_beds * age_data_df.distribution * age_data_df.hospitalized_death_rate).sum()
-			deahts_no_hospital_care = round((next_H - num_hospital_beds) * CDR)
-			next_D = D[-1] + deaths_with_hospital_care + deahts_no_hospital_care
-
-		S.append(next_S)
-		E.append(next_E)
-		I.append(next_I)
-		R.append(next_R)
-		H.append(next_H)
-		D.append(next_D)
-		dates.append(date)
+	region = load_regions().loc[COUNTRY]
+	init_values = _get_init_values_for_model(historical_df, start_date, region.population)
+	hyperparams = _get_model_hyperparams(params)
+	with timing.stage('seir'):
+		results = seir.run_seir(init_values, hyperparams, time_steps, _get_age_arrays(region.age_file),
+			num_hospital_beds=region.hospital_beds)
+
+	if compact:
+		return compact_series(start_date, {name: results[name] for name in value_vars})
 
 	results_df = pd.DataFrame({
-		'dates': dates,
-		'Susceptible': S,
-		'Exposed': E,
-		'Infected': I,
-		'Recovered': R,
-		'Hospitalized': H,
-		'Total Deaths': D})
+		'dates': pd.date_range(start_date, periods=time_steps+1, freq='D'),
+		**results})
 
 	if not jsonify:
 		return results_df
-	
+	return _results_plot(results_df, value_vars)
+
+@timing.timed('plot')
+def _results_plot(results_df, value_vars):
 	results_df = results_df.melt(id_vars='dates',value_vars = value_vars)
 	plot = px.line(results_df, x='dates', y='value', color='variable')
 	return json.dumps(plot, cls=plotly.utils.PlotlyJSONEncoder)
 
 def create_tuning_plot(params, historical_df, start_date=START_DATE, end_date=None,
-				value_vars = ['num_confirmed','num_deaths']):
+				value_vars = ['num_confirmed','num_deaths'], compact=False):
 	# Plot from real data
 	if not end_date:
-		end_date = historical_df.iloc[-1].date
+		end_date = historical_df.date.iloc[-1]
 
 	start_date = datetime.strptime(start_date, '%Y-%m-%d')
-	historical_df = historical_df[(historical_df.date >= start_date) & (historical_df.date <= end_date)]
+	historical_df = _date_range(historical_df, start_date, end_date)
 	# plot = create_plot_from_data(historical_df, value_vars)
 
 	# Simulation
@@ -247,23 +433,198 @@ def create_tuning_plot(params, historical_df, start_date=START_DATE, end_date=No
 		jsonify=False,
 		value_vars=['Infected', 'Exposed', 'Total Deaths'])
 
-	fig = go.Figure()
+	if compact:
+		return compact_series(start_date, {
+				'Actual Confirmed Cases': historical_df.num_confirmed,
+				'Simulated Confirmed Cases': simulation_df.Infected + simulation_df.Exposed},
+			lines={
+				'Actual Confirmed Cases': dict(color='firebrick', width=2),
+				'Simulated Confirmed Cases': dict(color='firebrick', width=2, dash='dash')},
+			xaxis_title='date', legend_title=None)
 
-	fig.add_trace(go.Scatter(x=historical_df.date, 
-		y=historical_df.num_confirmed.values, 
-		name='Actual Confirmed Cases',
-		line=dict(color='firebrick', width=2)))
+	with timing.stage('plot'):
+		fig = go.Figure()
 
-	fig.add_trace(go.Scatter(x=simulation_df.dates,
-		y=(simulation_df.Infected + simulation_df.Exposed),
-		name='Simulated Confirmed Cases',
-		line=dict(color='firebrick', width=2, dash='dash')))
+		fig.add_trace(go.Scatter(x=historical_df.date, 
+			y=historical_df.num_confirmed.values, 
+			name='Actual Confirmed Cases',
+			line=dict(color='firebrick', width=2)))
 
-	fig.update_layout(xaxis_title='date',
-		yaxis_title='value')
+		fig.add_trace(go.Scatter(x=simulation_df.dates,
+			y=(simulation_df.Infected + simulation_df.Exposed),
+			name='Simulated Confirmed Cases',
+			line=dict(color='firebrick', width=2, dash='dash')))
 
-	return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+		fig.update_layout(xaxis_title='date',
+			yaxis_title='value')
 
+		return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
 
+def parameter_grid(R_0_values, inc_per_values, rec_time_values):
+	'''
+	Returns every (R_0, inc_per, rec_time) combination of the given values
+	as a P x 3 array, ready to be passed to parameter_sweep.
+	'''
+	grid = itertools.product(R_0_values, inc_per_values, rec_time_values)
+	return np.array(list(grid), dtype=np.float64).reshape(-1, 3)
+
+@timing.timed('seir')
+def parameter_sweep(param_sets, historical_df, start_date=START_DATE, end_date=None, chunk_size=2048, progress=None):
+	'''
+	Simulates every (R_0, inc_per, rec_time) tuple in param_sets from start_date
+	to end_date in one batch and compares the simulated confirmed cases
+	(Infected + Exposed) to the actual num_confirmed.
+
+	Parameter sets are simulated chunk_size at a time to bound memory.
+	progress, if given, is called with the fraction done after each chunk.
+
+	Returns a dataframe with one row per parameter set:
+		R_0, inc_per, rec_time, rmse (nan for parameter sets that diverge)
+	'''
+	param_sets = np.asarray(param_sets, dtype=np.float64).reshape(-1, 3)
+
+	if not end_date:
+		end_date = historical_df.date.iloc[-1]
+
+	if type(start_date) == str:
+		start_date = datetime.strptime(start_date, '%Y-%m-%d')
+
+	actual = _date_range(historical_df, start_date, end_date)
+	actual = actual.num_confirmed.to_numpy(dtype=np.float64)
+	time_steps = (end_date - start_date).days
+	init_values = _get_init_values_for_model(historical_df, start_date)
+
+	rmse = np.empty(param_sets.shape[0])
+	for i in range(0, param_sets.shape[0], chunk_size):
+		chunk = param_sets[i:i+chunk_size]
+		beta, sigma, gamma = _get_model_hyperparams((chunk[:, 0], chunk[:, 1], chunk[:, 2], time_steps))
+		# Unstable parameter sets (e.g. rec_time of one day with a high R_0) diverge to inf/nan
+		with np.errstate(over='ignore', invalid='ignore'):
+			results = seir.run_seir_batch(init_values, beta, sigma, gamma, time_steps)
+			simulated = results['Infected'] + results['Exposed']
+			rmse[i:i+chunk_size] = np.sqrt(np.mean((simulated - actual)**2, axis=1))
+		if progress:
+			progress(min(i + chunk_size, param_sets.shape[0]) / param_sets.shape[0])
+
+	return pd.DataFrame({
+		'R_0': param_sets[:, 0],
+		'inc_per': param_sets[:, 1],
+		'rec_time': param_sets[:, 2],
+		'rmse': rmse})
+
+@timing.timed('seir')
+def region_seir_model(params, time_steps, region_data, start_date):
+	'''
+	Forecasts every region of region_data (see get_region_data) from
+	start_date in one vectorized batch, with each region's population,
+	hospital beds and age structure.
+
+	Returns (dates, results), results being the dict of run_seir with arrays
+	of shape (regions, time_steps + 1), rows in region_data['regions'] order.
+	'''
+	if type(start_date) == str:
+		start_date = datetime.strptime(start_date, '%m/%d/%y')
 
+	regions = region_data['regions']
+	day = region_data['date'].get_loc(pd.Timestamp(start_date))
+	confirmed, recovered, deaths = (region_data[name][:, day].astype(np.float64)
+		for name in ('num_confirmed', 'num_recovered', 'num_deaths'))
 
+	# Same initial values as _get_init_values_for_model, for every region at once
+	RR = 0.75
+	I_0 = confirmed - recovered - deaths
+	E_0 = np.round(I_0 * ((1 - RR) / RR))
+	S_0 = regions.population.to_numpy(dtype=np.float64) - (E_0 + I_0 + recovered + deaths)
+	init_values = (S_0, E_0, I_0, recovered, deaths)
+
+	age_arrays = [_get_age_arrays(age_file) for age_file in regions.age_file]
+	age_arrays = tuple(np.stack(arrays) for arrays in zip(*age_arrays))
+
+	results = seir.run_seir_regions(init_values, _get_model_hyperparams(params), time_steps,
+		age_arrays, regions.hospital_beds.to_numpy(dtype=np.float64))
+	return pd.date_range(start_date, periods=time_steps+1, freq='D'), results
+
+@timing.timed('plot')
+def region_plot(dates, results, row, value_vars=['Exposed','Infected','Hospitalized', 'Total Deaths'], compact=False):
+	'''
+	Plot of one region (row of region_seir_model's results), like base_seir_model's.
+	'''
+	if compact:
+		return compact_series(dates[0], {name: results[name][row] for name in value_vars})
+	results_df = pd.DataFrame({'dates': dates, **{name: values[row] for name, values in results.items()}})
+	return _results_plot(results_df, value_vars)
+
+@timing.timed('seir')
+def ensemble_seir_model(params, time_steps, historical_df, start_date, members=ENSEMBLE_SIZE,
+					spread=ENSEMBLE_SPREAD, stochastic=False, seed=0, percentiles=(5, 50, 95),
+					value_vars=['Infected', 'Hospitalized', 'Total Deaths'], chunk_size=250, progress=None):
+	'''
+	Ensemble of base_seir_model forecasts. Every member samples R_0, inc_per
+	and rec_time from a lognormal centred on params (sigma = spread), and
+	with stochastic=True advances the compartments with the chain-binomial
+	step of seir.run_seir_stochastic instead of the deterministic one.
+
+	Members are simulated chunk_size at a time in one vectorized batch per
+	chunk. Each chunk draws from its own stream spawned from seed, so a
+	seed always gives the same ensemble. progress, if given, is called with
+	the fraction of members done after each chunk.
+
+	Returns (dates, bands), bands mapping each of value_vars to an array of
+	shape (len(percentiles), time_steps + 1).
+	'''
+	if type(start_date) == str:
+		start_date = datetime.strptime(start_date, '%m/%d/%y')
+
+	region = load_regions().loc[COUNTRY]
+	init_values = _get_init_values_for_model(historical_df, start_date, region.population)
+	age_arrays = _get_age_arrays(region.age_file)
+	R_0, inc_per, rec_time, _ = params
+
+	streams = np.random.SeedSequence(seed).spawn((members + chunk_size - 1) // chunk_size)
+	sizes = np.diff(np.r_[0:members:chunk_size, members])
+	results = {name: [] for name in value_vars}
+	for stream, size in zip(streams, sizes):
+		rng = np.random.default_rng(stream)
+		sampled = [value * rng.lognormal(0, spread, size) for value in (R_0, inc_per, rec_time)]
+		chunk = seir.run_seir_ensemble(init_values, _get_model_hyperparams((*sampled, time_steps)), time_steps,
+			age_arrays, num_hospital_beds=region.hospital_beds, rng=rng if stochastic else None)
+		for name in value_vars:
+			results[name].append(chunk[name])
+		if progress:
+			progress(min(len(results[value_vars[0]]) * chunk_size, members) / members)
+
+	dates = pd.date_range(start_date, periods=time_steps+1, freq='D')
+	return dates, {name: np.nanpercentile(np.concatenate(values), percentiles, axis=0)
+		for name, values in results.items()}
+
+@timing.timed('plot')
+def ensemble_plot(dates, bands, percentiles=(5, 50, 95), compact=False):
+	'''
+	Plot of ensemble_seir_model's bands: the middle percentile as a line,
+	the area between the outer ones filled.
+	'''
+	colors = plotly.colors.qualitative.Plotly
+	low, mid, high = percentiles[0], percentiles[len(percentiles) // 2], percentiles[-1]
+	series, lines, fills, medians = {}, {}, {}, set()
+	for k, (name, values) in enumerate(bands.items()):
+		lower, median, upper = ('%s %g%%' % (name, p) for p in (low, mid, high))
+		color = colors[k % len(colors)]
+		# upper is filled down to lower, the trace just before it
+		series[lower] = values[0]
+		series[upper] = values[-1]
+		series[median] = values[len(percentiles) // 2]
+		lines[lower] = lines[upper] = dict(color=color, width=0)
+		lines[median] = dict(color=color, width=2)
+		fills[upper] = 'rgba(%d, %d, %d, 0.2)' % plotly.colors.hex_to_rgb(color)
+		medians.add(median)
+
+	if compact:
+		return compact_series(dates[0], series, lines=lines, fills=fills)
+
+	fig = go.Figure()
+	for name, values in series.items():
+		fig.add_trace(go.Scatter(x=dates, y=values, name=name, mode='lines', line=lines[name],
+			fill='tonexty' if name in fills else None, fillcolor=fills.get(name),
+			showlegend=name in medians))
+	fig.update_layout(xaxis_title='dates', yaxis_title='value', legend_title='variable')
+	return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
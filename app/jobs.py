@@ -0,0 +1,157 @@
+'''
+	Background jobs for the long simulation requests.
+
+	JobQueue.submit(key, compute) returns a Job at once and runs compute()
+	on a bounded thread pool. Clients poll the job by id until it is done
+	(GET /jobs/<id>, which can wait for it to finish). A job submitted with
+	the key of one still queued or running is not started again, the
+	submitter gets the job in flight: concurrent users asking for the same
+	parameters share one computation.
+
+	Jobs live in the memory of the worker process that took them, so the
+	polls must reach the same one: the Procfile runs a single gunicorn
+	worker with threads, which also keeps a long poll from holding the only
+	worker. Several workers would need sticky sessions.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+class QueueFull(Exception):
+	pass
+
+class Job():
+	def __init__(self, key):
+		self.id = uuid.uuid4().hex
+		self.key = key
+		self.status = 'queued' # then 'running', 'done' or 'failed'
+		self.progress = 0.0
+		self.result = None
+		self.error = None
+		self.submitted_at = time.time()
+		self.finished_at = None
+		self._done = threading.Event()
+
+	def wait(self, timeout=None):
+		'''
+		Waits up to timeout seconds for the job to finish, returns whether it has.
+		'''
+		return self._done.wait(timeout)
+
+	def to_dict(self):
+		job = {'job_id': self.id, 'status': self.status, 'progress': round(self.progress, 4)}
+		if self.status == 'done':
+			job['result'] = self.result
+		if self.status == 'failed':
+			job['error'] = self.error
+		return job
+
+def report_progress(fraction):
+	'''
+	Progress callback for long computations: sets the progress (0 to 1) of
+	the job running on this thread. Does nothing outside a job.
+	'''
+	job = getattr(_current, 'job', None)
+	if job is not None:
+		job.progress = min(max(float(fraction), 0.0), 1.0)
+
+class JobQueue():
+	'''
+	Thread pool of max_workers running at most max_pending queued or
+	running jobs. Finished jobs are kept ttl seconds for polling.
+	'''
+	def __init__(self, max_workers=2, max_pending=32, ttl=600):
+		self.max_workers = max_workers
+		self.max_pending = max_pending
+		self.ttl = ttl
+		self.submitted = 0
+		self.coalesced = 0
+		self.rejected = 0
+		self.completed = 0
+		self.failed = 0
+		self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+		self._jobs = {} # id -> Job
+		self._in_flight = {} # key -> Job
+		self._lock = threading.Lock()
+
+	def submit(self, key, compute):
+		'''
+		Returns the job in flight for key, or a new job running compute().
+		Raises QueueFull when max_pending jobs are already queued or running.
+		'''
+		with self._lock:
+			self._prune()
+			job = self._in_flight.get(key)
+			if job is not None:
+				self.coalesced += 1
+				return job
+
+			if len(self._in_flight) >= self.max_pending:
+				self.rejected += 1
+				raise QueueFull('%d jobs already queued or running, try again later' % len(self._in_flight))
+
+			job = Job(key)
+			self._jobs[job.id] = job
+			self._in_flight[key] = job
+			self.submitted += 1
+
+		self._pool.submit(self._run, job, compute)
+		return job
+
+	def get(self, job_id):
+		with self._lock:
+			return self._jobs.get(job_id)
+
+	def stats(self):
+		with self._lock:
+			statuses = {'queued': 0, 'running': 0}
+			for job in self._in_flight.values():
+				statuses[job.status] = statuses.get(job.status, 0) + 1
+			return {
+				'queued': statuses['queued'],
+				'running': statuses['running'],
+				'jobs': len(self._jobs),
+				'max_workers': self.max_workers,
+				'max_pending': self.max_pending,
+				'submitted': self.submitted,
+				'coalesced': self.coalesced,
+				'rejected': self.rejected,
+				'completed': self.completed,
+				'failed': self.failed}
+
+	def _run(self, job, compute):
+		_current.job = job
+		job.status = 'running'
+		try:
+			job.result = compute()
+			job.progress = 1.0
+			job.status = 'done'
+		except ValueError as e:
+			job.error = str(e)
+			job.status = 'failed'
+		except Exception as e:
+			logger.exception('Job %s failed', job.id)
+			job.error = repr(e)
+			job.status = 'failed'
+		finally:
+			_current.job = None
+			job.finished_at = time.time()
+			with self._lock:
+				self._in_flight.pop(job.key, None)
+				if job.status == 'done':
+					self.completed += 1
+				else:
+					self.failed += 1
+			job._done.set()
+
+	def _prune(self):
+		expired = time.time() - self.ttl
+		for job_id, job in list(self._jobs.items()):
+			if job.finished_at is not None and job.finished_at < expired:
+				del self._jobs[job_id]
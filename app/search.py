@@ -1,30 +1,250 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, ElasticsearchException
 from elasticsearch_dsl import Search
-from bs4 import BeautifulSoup
 import pdb
 from datetime import datetime
+from dateutil import tz
+import asyncio
+import base64
+import html
+import re
+import atexit
+import json
 import os
+import threading
+import time
+from cache import ResultCache, RedisResultCache
+import timing
+
+# Connection pool settings for the process wide client
+ES_MAXSIZE = int(os.environ.get('ES_MAXSIZE', 25)) # connections kept alive per node
+ES_TIMEOUT = float(os.environ.get('ES_TIMEOUT', 5)) # seconds per request
+ES_MAX_RETRIES = int(os.environ.get('ES_MAX_RETRIES', 2))
+
+# Read alias over the rolling news indices (see bucket_to_elasticsearch.setup_index_layout)
+ES_INDEX = os.environ.get('ES_INDEX', 'news')
+
+# Search results are cached until the ingester bumps the generation counter
+# (bucket_to_elasticsearch.bump_generation). SEARCH_CACHE_URL=redis://... shares
+# the cache between workers.
+NEWS_META_INDEX = 'news-meta'
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1024))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 60*60))
+GENERATION_CHECK_INTERVAL = float(os.environ.get('GENERATION_CHECK_INTERVAL', 30))
+
+# Only the fields NewsArticle needs are fetched. Documents indexed before
+# description_text existed get their description in a second request.
+SOURCE_FIELDS = ['title', 'link', 'pubDate', 'description_text']
+
+# pubDate is stored in UTC (see rss_parser.parse_date), articles show it in this zone
+DISPLAY_TIMEZONE = tz.gettz(os.environ.get('NEWS_TIMEZONE', 'America/Toronto'))
+
+# Sort orders, each ending in a unique tie breaker so search_after pages
+# never skip or repeat a hit
+SORTS = {
+	'relevance': ['_score', {'pubDate': 'desc'}, {'link.keyword': 'asc'}],
+	'date': [{'pubDate': 'desc'}, {'link.keyword': 'asc'}]}
+
+_client = None
+_async_loop = None
+_async_client = None
+_client_lock = threading.Lock()
+_generation = (None, float('-inf')) # (value, time checked)
 
 class NewsArticle():
 	def __init__(self, title, description, link, pubDate):
 		self.title = title
 		self.description = description
 		self.link = link
-		date = datetime.strptime(pubDate, '%Y/%m/%d %H:%M:%S')
-		self.pubDate = date #datetime obj for sorting
-		self.displayDate = datetime.strftime(date, '%a, %d %b %Y %H:%M:%S') #string for human readability
+		date = _parse_date(pubDate)
+		self.pubDate = date #datetime obj for sorting, in UTC
+		self.displayDate = _display_date(date) #string for human readability
 
 	def from_doc(self, doc):
 		return NewsArticle(doc.title, doc.description, doc.link, doc.pubDate)
 
-def search(search_term, num_results):
+def get_client():
+	'''
+		Returns the process wide Elasticsearch client. Its connection pool
+		keeps connections alive between requests instead of opening new ones.
+	'''
+	global _client
+	if _client is None:
+		with _client_lock:
+			if _client is None:
+				_client = Elasticsearch(os.environ['ES_URL'],
+					maxsize=ES_MAXSIZE,
+					timeout=ES_TIMEOUT,
+					max_retries=ES_MAX_RETRIES,
+					retry_on_timeout=True)
+	return _client
+
+def search(search_term, num_results, sort_by=None, **filters):
 	'''
 		Searches ES database and returns list of NewsArticle objects
+
+		sort_by='date' orders the results newest first, see search_page for filters
+	'''
+	return search_page(search_term, num_results, sort_by, **filters)[0]
+
+def search_page(search_term, num_results, sort_by=None, after=None, date_from=None, date_to=None, outlet=None):
+	'''
+		Returns (list of NewsArticle, cursor of the next page or None).
+
+		Sorting, paging and filtering all happen in Elasticsearch:
+		- sort_by: 'relevance' (default) or 'date', newest first
+		- after: cursor returned with the previous page (search_after)
+		- date_from / date_to: 'YYYY-MM-DD', inclusive
+		- outlet: only articles from this outlet, e.g. 'cbc'
+
+		Raises ValueError for an unknown sort_by, a bad date or cursor.
+	'''
+	key, s = _page_query(search_term, num_results, sort_by, after, date_from, date_to, outlet)
+
+	def compute():
+		client = get_client()
+		with timing.stage('es_search'):
+			hits = client.search(index=ES_INDEX, body=s.to_dict())['hits']['hits']
+			_fill_descriptions(client.mget, hits)
+		return _page_json(hits, num_results)
+
+	return _from_page_json(search_cache.get_or_compute(key, compute, version=get_generation()))
+
+def search_pages(queries):
+	'''
+		Runs several searches concurrently on the process wide
+		AsyncElasticsearch client, e.g. the title search and the other
+		queries of one request. queries is a list of dicts of search_page
+		arguments. Returns their (list of NewsArticle, cursor of the next
+		page or None), in order.
+
+		Pages are cached like search_page's, only the missing ones are searched.
 	'''
-	# es = Elasticsearch('http://localhost:9200')
-	es = Elasticsearch(os.environ['ES_URL'])
-	news_articles = []
+	version = get_generation()
+	pages = [_page_query(**query) for query in queries]
+	values = [search_cache.get(key, version) for key, _ in pages]
+	missing = [i for i, value in enumerate(values) if value is None]
+
+	if missing:
+		with timing.stage('es_search'):
+			searches = [pages[i][1] for i in missing]
+			results = asyncio.run_coroutine_threadsafe(_async_search_all(searches), _get_async_loop()).result()
+		for i, hits in zip(missing, results):
+			key = pages[i][0]
+			values[i] = _page_json(hits, key[1])
+			search_cache.set(key, values[i], version)
 
+	return [_from_page_json(value) for value in values]
+
+def _page_query(search_term, num_results, sort_by=None, after=None, date_from=None, date_to=None, outlet=None):
+	# Returns (cache key, Search) of a page
+	search_term = normalize_term(search_term)
+	sort_by = sort_by or 'relevance'
+	key = (search_term, int(num_results), sort_by, after, date_from, date_to, outlet)
+	return key, _title_search(search_term, num_results, sort_by, decode_cursor(after), date_from, date_to, outlet)
+
+def _page_json(hits, num_results):
+	return json.dumps({
+		'articles': [_to_payload(hit['_source']) for hit in hits],
+		'next': _next_cursor(hits, num_results)})
+
+def _from_page_json(value):
+	page = json.loads(value)
+	return [NewsArticle(**payload) for payload in page['articles']], page['next']
+
+async def _async_search_all(searches):
+	return await asyncio.gather(*[_async_search_hits(s) for s in searches])
+
+async def _async_search_hits(s):
+	'''
+		Async version of search_page's Elasticsearch requests, must run on
+		the loop returned by _get_async_loop().
+	'''
+	hits = (await _async_client.search(index=ES_INDEX, body=s.to_dict()))['hits']['hits']
+	missing = _missing_descriptions(hits)
+	if missing:
+		_merge_descriptions(hits, await _async_client.mget(body={'docs': missing}, _source=['description']))
+	return hits
+
+def _get_async_loop():
+	'''
+		Starts the event loop thread that owns the AsyncElasticsearch client,
+		pooled and tuned like get_client(). The client needs the
+		elasticsearch[async] extra (elasticsearch>=7.8 and aiohttp).
+	'''
+	global _async_loop, _async_client
+	if _async_loop is None:
+		with _client_lock:
+			if _async_loop is None:
+				from elasticsearch import AsyncElasticsearch
+
+				loop = asyncio.new_event_loop()
+				threading.Thread(target=loop.run_forever, name='es-async-loop', daemon=True).start()
+
+				async def create_client():
+					return AsyncElasticsearch(os.environ['ES_URL'],
+						maxsize=ES_MAXSIZE,
+						timeout=ES_TIMEOUT,
+						max_retries=ES_MAX_RETRIES,
+						retry_on_timeout=True)
+
+				_async_client = asyncio.run_coroutine_threadsafe(create_client(), loop).result()
+				_async_loop = loop
+				atexit.register(lambda: asyncio.run_coroutine_threadsafe(_async_client.close(), loop).result(ES_TIMEOUT))
+	return _async_loop
+
+def encode_cursor(sort_values):
+	return base64.urlsafe_b64encode(json.dumps(sort_values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+	if not cursor:
+		return None
+	try:
+		sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+	except (ValueError, UnicodeError):
+		raise ValueError('Invalid cursor')
+	if not isinstance(sort_values, list):
+		raise ValueError('Invalid cursor')
+	return sort_values
+
+def _next_cursor(hits, num_results):
+	if len(hits) < num_results:
+		return None
+	return encode_cursor(list(hits[-1]['sort']))
+
+def normalize_term(search_term):
+	'''
+		Lowercases and collapses whitespace, the title analyzer does the same
+		so the normalized term returns the same hits.
+	'''
+	return ' '.join((search_term or '').lower().split())
+
+def get_generation():
+	'''
+		Returns the news generation counter, checked at most every
+		GENERATION_CHECK_INTERVAL seconds. Keeps the last known value if
+		Elasticsearch can't be reached.
+	'''
+	global _generation
+	value, checked_at = _generation
+	if time.monotonic() - checked_at < GENERATION_CHECK_INTERVAL:
+		return value
+
+	try:
+		doc = get_client().get(index=NEWS_META_INDEX, id='generation', ignore=404)
+		value = doc['_source']['value'] if doc.get('found') else 0
+	except ElasticsearchException:
+		pass
+	_generation = (value, time.monotonic())
+	return value
+
+def _create_search_cache():
+	if os.environ.get('SEARCH_CACHE_URL'):
+		return RedisResultCache(os.environ['SEARCH_CACHE_URL'], prefix='search', ttl=SEARCH_CACHE_TTL)
+	return ResultCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+search_cache = _create_search_cache()
+
+def _title_search(search_term, num_results, sort_by='relevance', after=None, date_from=None, date_to=None, outlet=None):
 	# Searching Title of News Article
 	query = {
 		"match": {
@@ -33,22 +253,76 @@ def search(search_term, num_results):
 			}
 		}
 	}
-	s = Search(using=es)
-	docs = s.query(query)[:num_results].execute()
+	if sort_by not in SORTS:
+		raise ValueError('Unknown sort_by: %s' % sort_by)
+
+	s = Search(index=ES_INDEX).query(query).sort(*SORTS[sort_by]).source(SOURCE_FIELDS)
+	if date_from or date_to:
+		s = s.filter('range', pubDate=_date_range(date_from, date_to))
+	if outlet:
+		s = s.filter('term', outlet=outlet)
+	if after:
+		s = s.extra(search_after=after)
+	return s[:num_results]
+
+def _date_range(date_from, date_to):
+	date_range = {'format': 'yyyy-MM-dd'}
+	if date_from:
+		date_range['gte'] = _check_date(date_from)
+	if date_to:
+		date_range['lte'] = _check_date(date_to) + '||/d' # to the end of that day
+	return date_range
+
+def _check_date(date):
+	datetime.strptime(date, '%Y-%m-%d')
+	return date
+
+def _missing_descriptions(hits):
+	return [{'_index': hit['_index'], '_id': hit['_id']} for hit in hits if 'description_text' not in hit['_source']]
+
+def _fill_descriptions(mget, hits):
+	missing = _missing_descriptions(hits)
+	if missing:
+		_merge_descriptions(hits, mget(body={'docs': missing}, _source=['description']))
+
+def _merge_descriptions(hits, docs):
+	descriptions = {(doc['_index'], doc['_id']): doc['_source']['description'] for doc in docs['docs'] if doc.get('found')}
+	for hit in hits:
+		if 'description_text' not in hit['_source']:
+			hit['_source']['description'] = descriptions.get((hit['_index'], hit['_id']), '')
+
+def _to_article(source):
+	return NewsArticle(**_to_payload(source))
+
+def _to_payload(source):
+	return {
+		'title': source['title'],
+		'description': _description(source),
+		'link': source['link'],
+		'pubDate': source['pubDate']}
+
+def _parse_date(pubDate):
+	return datetime.strptime(pubDate, '%Y/%m/%d %H:%M:%S')
+
+def _display_date(date):
+	local = date.replace(tzinfo=tz.UTC).astimezone(DISPLAY_TIMEZONE)
+	return local.strftime('%a, %d %b %Y %H:%M:%S %Z')
 
-	for doc in docs:
-		title = doc.title
-		description = clean_text(doc.description)
-		link = doc.link
-		pubDate = doc.pubDate
-		news_articles.append(NewsArticle(title, description, link, pubDate))
+def _description(source):
+	# Documents indexed since descriptions are cleaned at ingestion carry description_text
+	if 'description_text' in source:
+		return source['description_text']
+	return clean_text(source.get('description'))
 
-	return news_articles
+_SKIPPED_HTML = re.compile(r'<!--.*?-->|<(script|style)\b.*?</\1\s*>', re.S | re.I)
+_HTML_TAG = re.compile(r'<[^>]*>')
 
 def clean_text(text):
 	'''
 		This function takes in a string argument and makes it human readable:
+		- Removes comments, scripts and styles
 		- Removes html tags
+		- Unescapes html entities
 	'''
-	soup = BeautifulSoup(text, features='lxml')
-	return soup.get_text()
\ No newline at end of file
+	text = _SKIPPED_HTML.sub('', text or '')
+	return html.unescape(_HTML_TAG.sub('', text))
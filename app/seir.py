@@ -0,0 +1,220 @@
+'''
+	NumPy engine for the SEIR model.
+
+	The compartment recurrence is advanced with plain floats into
+	preallocated float64 arrays, then the age weighted hospitalization
+	and death counts are computed for every time step at once.
+
+	run_seir_ensemble runs many parameter sets at once, deterministically or
+	with the chain-binomial step of run_seir_stochastic.
+'''
+import numpy as np
+from data.parameters import CDR
+
+NUM_HOSPITAL_BEDS = 93527
+
+def run_seir(init_values, hyperparams, time_steps, age_arrays,
+			num_hospital_beds=NUM_HOSPITAL_BEDS, cdr=CDR):
+	'''
+	Runs the SEIR model for time_steps days.
+
+	init_values - (S_0, E_0, I_0, R_0, D_0)
+	hyperparams - (beta, sigma, gamma)
+	age_arrays - (distribution, hospitalization_rate, hospitalized_death_rate)
+	             as float64 arrays, one entry per age group
+
+	Returns a dict of float64 arrays of length time_steps + 1:
+		Susceptible, Exposed, Infected, Recovered, Hospitalized, Total Deaths
+	'''
+	S_0, E_0, I_0, R_0, D_0 = init_values
+	beta, sigma, gamma = hyperparams
+	N = S_0 + E_0 + I_0 + R_0 + D_0 # Total Population
+	n = time_steps + 1
+
+	S = np.empty(n)
+	E = np.empty(n)
+	I = np.empty(n)
+	R = np.empty(n)
+	s, e, i, r = float(S_0), float(E_0), float(I_0), float(R_0)
+	S[0], E[0], I[0], R[0] = s, e, i, r
+
+	for t in range(1, n):
+		new_exposed = (beta*s*i)/N
+		s, e, i, r = (s - new_exposed,
+			e + new_exposed - sigma*e,
+			i + (sigma*e - gamma*i),
+			r + (gamma*i))
+		S[t], E[t], I[t], R[t] = s, e, i, r
+
+	H, D = _hospitalized_and_deaths(I, D_0, age_arrays, num_hospital_beds, cdr)
+
+	return {
+		'Susceptible': S,
+		'Exposed': E,
+		'Infected': I,
+		'Recovered': R,
+		'Hospitalized': H,
+		'Total Deaths': D}
+
+def _hospitalized_and_deaths(I, D_0, age_arrays, num_hospital_beds, cdr):
+	'''
+	Returns the hospitalized and cumulative death arrays for the infected
+	array I (last axis is time). For several regions at once, I is
+	(regions, time), the age arrays (regions, 1, age groups) and
+	num_hospital_beds and D_0 one entry per region, shaped to broadcast
+	against I.
+
+	Products are taken in the same order as the original per-day pandas
+	code (count * distribution * rate) and rounded per age group before
+	summing, so results match it exactly.
+	'''
+	distribution, hospitalization_rate, hospitalized_death_rate = age_arrays
+
+	# current hospital count = current infected * age distribution * hospitalization rate
+	H = np.round(I[..., None] * distribution * hospitalization_rate).sum(axis=-1)
+
+	# If hospital care avaialble, death rate is lower
+	deaths_with_care = np.round(H[..., None] * distribution * hospitalized_death_rate).sum(axis=-1)
+
+	# If hospital care unabailable, death rate is higher (we use the critical death rate, CDR, which is ~12%)
+	# CDR gotten from: https://wwwnc.cdc.gov/eid/article/26/6/20-0233_article
+	beds = np.asarray(num_hospital_beds, dtype=np.float64)
+	deaths_at_capacity = np.round(beds[..., None] * distribution * hospitalized_death_rate).sum(axis=-1)
+	deaths_over_capacity = deaths_at_capacity + np.round((H - num_hospital_beds) * cdr)
+
+	new_deaths = np.where(H <= num_hospital_beds, deaths_with_care, deaths_over_capacity)
+	new_deaths[..., 0] = D_0
+	D = np.cumsum(new_deaths, axis=-1)
+
+	return H, D
+
+def run_seir_batch(init_values, beta, sigma, gamma, time_steps):
+	'''
+	Runs the SEIR compartments for many parameter sets at once.
+
+	beta, sigma and gamma are arrays of length P (one entry per parameter
+	set). The state is held as a P x 4 matrix (S, E, I, R) and advanced
+	for every parameter set in a single step per day. init_values are
+	scalars shared by every row, or arrays of length P (e.g. one region
+	per row).
+
+	Returns a dict of float64 arrays of shape (P, time_steps + 1):
+		Susceptible, Exposed, Infected, Recovered
+	'''
+	S_0, E_0, I_0, R_0, D_0 = init_values
+	N = S_0 + E_0 + I_0 + R_0 + D_0 # Total Population
+	beta = np.asarray(beta, dtype=np.float64)
+	sigma = np.asarray(sigma, dtype=np.float64)
+	gamma = np.asarray(gamma, dtype=np.float64)
+
+	trajectory = np.empty((time_steps + 1, beta.shape[0], 4))
+	for j, value in enumerate((S_0, E_0, I_0, R_0)):
+		trajectory[0, :, j] = value
+
+	for t in range(1, time_steps + 1):
+		s, e, i, r = trajectory[t-1].T
+		new_exposed = (beta*s*i)/N
+		incubated = sigma*e
+		recovered = gamma*i
+		state = trajectory[t]
+		state[:, 0] = s - new_exposed
+		state[:, 1] = e + new_exposed - incubated
+		state[:, 2] = i + (incubated - recovered)
+		state[:, 3] = r + recovered
+
+	trajectory = trajectory.transpose(1, 2, 0)
+	return {
+		'Susceptible': trajectory[:, 0],
+		'Exposed': trajectory[:, 1],
+		'Infected': trajectory[:, 2],
+		'Recovered': trajectory[:, 3]}
+
+def run_seir_stochastic(init_values, beta, sigma, gamma, time_steps, rng):
+	'''
+	Chain-binomial version of run_seir_batch: every day each transition
+	draws a binomial count with the deterministic rate as probability
+	(capped at 1), e.g. new_exposed ~ Binomial(S, beta*I/N), so the
+	expected step is the deterministic one while the counts stay whole
+	people. rng is a numpy Generator, one draw per member and transition.
+
+	Returns the same dict as run_seir_batch, shape (P, time_steps + 1).
+	'''
+	S_0, E_0, I_0, R_0, D_0 = init_values
+	N = S_0 + E_0 + I_0 + R_0 + D_0 # Total Population
+	beta = np.asarray(beta, dtype=np.float64)
+	sigma = np.minimum(np.asarray(sigma, dtype=np.float64), 1)
+	gamma = np.minimum(np.asarray(gamma, dtype=np.float64), 1)
+
+	trajectory = np.empty((time_steps + 1, beta.shape[0], 4), dtype=np.int64)
+	for j, value in enumerate((S_0, E_0, I_0, R_0)):
+		trajectory[0, :, j] = np.round(value)
+
+	for t in range(1, time_steps + 1):
+		s, e, i, r = trajectory[t-1].T
+		new_exposed = rng.binomial(s, np.minimum(beta*i/N, 1))
+		incubated = rng.binomial(e, sigma)
+		recovered = rng.binomial(i, gamma)
+		state = trajectory[t]
+		state[:, 0] = s - new_exposed
+		state[:, 1] = e + new_exposed - incubated
+		state[:, 2] = i + (incubated - recovered)
+		state[:, 3] = r + recovered
+
+	trajectory = trajectory.transpose(1, 2, 0).astype(np.float64)
+	return {
+		'Susceptible': trajectory[:, 0],
+		'Exposed': trajectory[:, 1],
+		'Infected': trajectory[:, 2],
+		'Recovered': trajectory[:, 3]}
+
+def run_seir_ensemble(init_values, hyperparams, time_steps, age_arrays,
+			num_hospital_beds=NUM_HOSPITAL_BEDS, cdr=CDR, rng=None):
+	'''
+	Runs the full model for an ensemble of P parameter sets sharing the
+	initial values, with the chain-binomial step of run_seir_stochastic
+	when rng is given.
+
+	hyperparams - (beta, sigma, gamma) as arrays of length P
+
+	Returns the same dict as run_seir, with arrays of shape (P, time_steps + 1).
+	'''
+	beta, sigma, gamma = hyperparams
+	if rng is not None:
+		results = run_seir_stochastic(init_values, beta, sigma, gamma, time_steps, rng)
+	else:
+		# Sampled parameters can be unstable and diverge to inf/nan, like in a sweep
+		with np.errstate(over='ignore', invalid='ignore'):
+			results = run_seir_batch(init_values, beta, sigma, gamma, time_steps)
+
+	with np.errstate(invalid='ignore'):
+		H, D = _hospitalized_and_deaths(results['Infected'], init_values[4], age_arrays, num_hospital_beds, cdr)
+	results['Hospitalized'] = H
+	results['Total Deaths'] = D
+	return results
+
+def run_seir_regions(init_values, hyperparams, time_steps, age_arrays, num_hospital_beds, cdr=CDR):
+	'''
+	Runs the full model for R regions at once, one row per region.
+
+	init_values - (S_0, E_0, I_0, R_0, D_0), arrays of length R
+	hyperparams - (beta, sigma, gamma), scalars or arrays of length R
+	age_arrays - (distribution, hospitalization_rate, hospitalized_death_rate)
+	             as arrays of shape (R, age groups)
+	num_hospital_beds - array of length R
+
+	Returns the same dict as run_seir, with arrays of shape (R, time_steps + 1).
+	'''
+	init_values = tuple(np.asarray(value, dtype=np.float64) for value in init_values)
+	num_regions = init_values[0].shape[0]
+	beta, sigma, gamma = (np.broadcast_to(np.asarray(value, dtype=np.float64), (num_regions,))
+		for value in hyperparams)
+
+	results = run_seir_batch(init_values, beta, sigma, gamma, time_steps)
+
+	age_arrays = tuple(np.asarray(values, dtype=np.float64)[:, None, :] for values in age_arrays)
+	beds = np.asarray(num_hospital_beds, dtype=np.float64)[:, None]
+	H, D = _hospitalized_and_deaths(results['Infected'], init_values[4], age_arrays, beds, cdr)
+
+	results['Hospitalized'] = H
+	results['Total Deaths'] = D
+	return results
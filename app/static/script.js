@@ -13,11 +13,125 @@ $("#tuning_btn").click(function(event){
   make_tuning_request();
 });
 
+// Draws the plot of a /simulation or /tuning response: the compact series
+// (format=compact, see func.compact_series) or the plotly figure JSON.
+function render_plot(graphDiv, data) {
+	if (!data['series']) {
+		Plotly.newPlot(graphDiv, JSON.parse(data['plot']), {});
+		return;
+	}
+
+	var compact = data['series'];
+	var start = Date.parse(compact['start']);
+	var step = compact['step'] * 24 * 60 * 60 * 1000;
+	var traces = compact['series'].map(function(series){
+		var y = decode_float32(series['data']);
+		var x = new Array(y.length);
+		for (var i = 0; i < y.length; i++) {
+			x[i] = start + i * step;
+		}
+		var trace = {x: x, y: y, name: series['name'], type: 'scatter', mode: 'lines', line: series['line']};
+		if (series['fill']) {
+			// Band filled down to the previous trace, its edges stay out of the legend
+			trace.fill = 'tonexty';
+			trace.fillcolor = series['fill'];
+		}
+		if (series['fill'] || series['line']['width'] === 0) {
+			trace.showlegend = false;
+		}
+		return trace;
+	});
+
+	var layout = compact['layout'];
+	Plotly.newPlot(graphDiv, traces, {
+		xaxis: {type: 'date', title: {text: layout['xaxis_title']}},
+		yaxis: {title: {text: layout['yaxis_title']}},
+		legend: {title: {text: layout['legend_title'] || ''}}
+	});
+}
+
+// base64 of little endian float32 values to a Float32Array
+function decode_float32(data) {
+	var bytes = atob(data);
+	var buffer = new Uint8Array(bytes.length);
+	for (var i = 0; i < bytes.length; i++) {
+		buffer[i] = bytes.charCodeAt(i);
+	}
+	return new Float32Array(buffer.buffer);
+}
+
+function run_job(url, type, data, success) {
+	// Long simulations run as background jobs: the server answers with a job
+	// id at once, then we poll the job until its result is ready.
+	data['async'] = 1;
+	hide_error();
+	$.ajax({
+		url: url,
+		type: type,
+		data: data,
+		dataType: 'json',
+		success: function(job){
+			poll_job(job, success);
+		},
+		error: function(xhr){
+			if (xhr.status == 503) {
+				// Queue full, submit again once the server says so
+				var retry_after = parseInt(xhr.getResponseHeader('Retry-After')) || 5;
+				show_error('The server is busy, retrying in ' + retry_after + ' seconds...');
+				setTimeout(function(){ run_job(url, type, data, success); }, retry_after * 1000);
+				return;
+			}
+			show_error(error_message(xhr));
+		}
+	});
+}
+
+function poll_job(job, success) {
+	if (job['status'] == 'done') {
+		hide_error();
+		success(job['result']);
+		return;
+	}
+	if (job['status'] == 'failed') {
+		show_error('The simulation failed: ' + job['error']);
+		return;
+	}
+	$.ajax({
+		url: job['status_url'],
+		type: 'GET',
+		data: {wait: 5},
+		dataType: 'json',
+		success: function(job){
+			poll_job(job, success);
+		},
+		error: function(xhr){
+			show_error(error_message(xhr));
+		}
+	});
+}
+
+function error_message(xhr) {
+	if (xhr.responseJSON && xhr.responseJSON['error']) {
+		return 'Error: ' + xhr.responseJSON['error'];
+	}
+	return 'Request failed (' + (xhr.status || 'no response') + '), please try again.';
+}
+
+function show_error(message) {
+	var alert = document.getElementById('job_error');
+	alert.textContent = message;
+	alert.classList.remove('d-none');
+}
+
+function hide_error() {
+	document.getElementById('job_error').classList.add('d-none');
+}
+
 function make_historical_request() {
 	$.ajax({
 		url: '/simulation',
 		type: 'POST',
-		data: {btn: 'historical_btn'},
+		data: {btn: 'historical_btn', format: 'compact'},
 		dataType: "json",
 		success: function(data){
 
@@ -29,82 +143,55 @@ function make_historical_request() {
 			var title = document.getElementById("plot_title");
 			title.textContent = 'Plot of Historical Data (Last Updated : ' + data['last_updated'] + ')';
 			var graphDiv = document.getElementById('historical_chart');
-			plot = JSON.parse(data['plot']);
-			Plotly.newPlot(graphDiv, plot, {});
+			render_plot(graphDiv, data);
 		}
 	});
 }
 
 function make_simulation_request(req_data) {
-	$.ajax({
-		url: '/simulation',
-		type: 'POST',
-		data: {btn: 'simulate_btn', 
-			r_0: req_data['r_0'], 
-			inc_per: req_data['inc_per'], 
-			rec_time: req_data['rec_time'], 
-			time_steps: req_data['time_steps']},
-		dataType: "json",
-		success: function(data){
-			var title = document.getElementById("plot_title");
-			title.textContent = 'Simulation of COVID-19 Virus Effects in Canada';
-			// populate_slider_form(data, '/simulation', 'Simulate');
-			var graphDiv = document.getElementById('historical_chart')
-			plot = JSON.parse(data['plot'])
-			Plotly.newPlot(graphDiv, plot, {});
-		}
+	run_job('/simulation', 'POST', {btn: 'simulate_btn', 
+		r_0: req_data['r_0'], 
+		inc_per: req_data['inc_per'], 
+		rec_time: req_data['rec_time'], 
+		time_steps: req_data['time_steps'],
+		format: 'compact'}, function(data){
+		var title = document.getElementById("plot_title");
+		title.textContent = 'Simulation of COVID-19 Virus Effects in Canada';
+		// populate_slider_form(data, '/simulation', 'Simulate');
+		var graphDiv = document.getElementById('historical_chart')
+		render_plot(graphDiv, data);
 	});	
 }
 
 function make_forecast_request() {
-	$.ajax({
-		url: '/simulation',
-		type: 'POST',
-		data: {btn: 'forecast_btn'},
-		dataType: "json",
-		success: function(data){
-			var title = document.getElementById("plot_title");
-			title.textContent = 'Simulation of COVID-19 Virus Effects in Canada';
-			populate_slider_form(data,'/simulation', 'Simulate');
-			var graphDiv = document.getElementById('historical_chart')
-			plot = JSON.parse(data['plot'])
-			Plotly.newPlot(graphDiv, plot, {});
-		}
+	run_job('/simulation', 'POST', {btn: 'forecast_btn', format: 'compact'}, function(data){
+		var title = document.getElementById("plot_title");
+		title.textContent = 'Simulation of COVID-19 Virus Effects in Canada';
+		populate_slider_form(data,'/simulation', 'Simulate');
+		var graphDiv = document.getElementById('historical_chart')
+		render_plot(graphDiv, data);
 	});
 }
 
 function make_tuning_request(){
-	$.ajax({
-		url: '/tuning',
-		type: 'GET',
-		data: {btn: 'tuning_btn'},
-		dataType: 'json',
-		success: function(data){
-			var title = document.getElementById("plot_title");
-			title.textContent = 'Fine Tuning: Please experiment with sliders to find optimal parameters.';
-			populate_slider_form(data, '/tuning', 'Tune');
-			var graphDiv = document.getElementById('historical_chart');
-			plot = JSON.parse(data['plot']);
-			Plotly.newPlot(graphDiv, plot, {});
-		}
+	run_job('/tuning', 'GET', {btn: 'tuning_btn', format: 'compact'}, function(data){
+		var title = document.getElementById("plot_title");
+		title.textContent = 'Fine Tuning: Please experiment with sliders to find optimal parameters.';
+		populate_slider_form(data, '/tuning', 'Tune');
+		var graphDiv = document.getElementById('historical_chart');
+		render_plot(graphDiv, data);
 	});
 }
 
 function make_finetuning_request(req_data) {
-	$.ajax({
-		url: '/tuning',
-		type: 'POST',
-		data: {btn: 'tuning_btn',
-			r_0: req_data['r_0'], 
-			inc_per: req_data['inc_per'], 
-			rec_time: req_data['rec_time'], 
-			start_date: req_data['start_date']},
-		dataType: 'json',
-		success: function(data){
-			var graphDiv = document.getElementById('historical_chart');
-			plot = JSON.parse(data['plot']);
-			Plotly.newPlot(graphDiv, plot, {});
-		}
+	run_job('/tuning', 'POST', {btn: 'tuning_btn',
+		r_0: req_data['r_0'], 
+		inc_per: req_data['inc_per'], 
+		rec_time: req_data['rec_time'], 
+		start_date: req_data['start_date'],
+		format: 'compact'}, function(data){
+		var graphDiv = document.getElementById('historical_chart');
+		render_plot(graphDiv, data);
 	});
 }
 
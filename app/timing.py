@@ -0,0 +1,199 @@
+'''
+	Per stage timing of requests.
+
+	Wrap the work of a stage with stage(name) (or decorate it with
+	timed(name)). Its duration is added to:
+	- the timer of the current request, sent back as a Server-Timing header
+	  and logged as one JSON line on the 'timing' logger (to stderr unless
+	  the logger is already configured, TIMING_LOG_LEVEL=WARNING silences it)
+	- the process wide histograms served by /metrics in the Prometheus text
+	  format (one set per worker process)
+
+	Stages nest: a stage already running higher up the stack (e.g. 'plot'
+	inside 'plot') is only counted once. Outside a request only the
+	histograms are updated.
+'''
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import json
+import logging
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger('timing')
+
+_timer = ContextVar('timing_timer', default=None)
+_active = ContextVar('timing_active', default=frozenset())
+
+class Histogram():
+	'''
+	Cumulative histogram of durations per label tuple.
+	'''
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = buckets
+		self._series = {} # labels -> [bucket counts..., count, sum]
+		self._lock = threading.Lock()
+
+	def observe(self, labels, seconds):
+		with self._lock:
+			series = self._series.get(labels)
+			if series is None:
+				series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+			for i, bound in enumerate(self.buckets):
+				if seconds <= bound:
+					series[i] += 1
+			series[-2] += 1
+			series[-1] += seconds
+
+	def samples(self, name, label_names):
+		with self._lock:
+			series = sorted(self._series.items())
+		for labels, values in series:
+			labels = list(zip(label_names, labels))
+			for bound, count in zip(self.buckets, values):
+				yield name + '_bucket', labels + [('le', '%g' % bound)], count
+			yield name + '_bucket', labels + [('le', '+Inf')], values[-2]
+			yield name + '_sum', labels, values[-1]
+			yield name + '_count', labels, values[-2]
+
+class Metrics():
+	'''
+	Stage and request metrics of this process.
+	'''
+	def __init__(self):
+		self.stages = Histogram()
+		self.requests = Histogram()
+
+	def render(self, extra=()):
+		'''
+		Returns the metrics in the Prometheus text format. extra is a list of
+		(name, type, help, samples) for metrics kept elsewhere, samples being
+		(labels dict, value) pairs.
+		'''
+		lines = []
+		lines += _family('covid_stage_seconds', 'histogram', 'Time spent in each stage',
+			self.stages.samples('covid_stage_seconds', ('stage',)))
+		lines += _family('covid_request_seconds', 'histogram', 'Request duration',
+			self.requests.samples('covid_request_seconds', ('endpoint', 'method', 'status')))
+		for name, metric_type, help_text, samples in extra:
+			lines += _family(name, metric_type, help_text,
+				((name, sorted(labels.items()), value) for labels, value in samples))
+		return '\n'.join(lines) + '\n'
+
+def _family(name, metric_type, help_text, samples):
+	lines = ['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, metric_type)]
+	for sample_name, labels, value in samples:
+		if labels:
+			sample_name += '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+		lines.append('%s %s' % (sample_name, _format_value(value)))
+	return lines
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+metrics = Metrics()
+
+class Timer():
+	'''
+	Stage durations of one request, in seconds.
+	'''
+	def __init__(self):
+		self.start = time.perf_counter()
+		self.stages = {}
+		self._lock = threading.Lock()
+
+	def add(self, name, seconds):
+		with self._lock:
+			self.stages[name] = self.stages.get(name, 0) + seconds
+
+	def elapsed(self):
+		return time.perf_counter() - self.start
+
+	def server_timing(self):
+		'''
+		Value of the Server-Timing header, durations in milliseconds.
+		'''
+		entries = ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in self.stages.items()]
+		return ', '.join(entries + ['total;dur=%.1f' % (self.elapsed() * 1000)])
+
+@contextmanager
+def stage(name):
+	active = _active.get()
+	if name in active:
+		yield
+		return
+
+	token = _active.set(active | {name})
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		seconds = time.perf_counter() - start
+		_active.reset(token)
+		metrics.stages.observe((name,), seconds)
+		timer = _timer.get()
+		if timer is not None:
+			timer.add(name, seconds)
+
+def timed(name):
+	'''
+	Decorator running the whole function as stage name.
+	'''
+	def decorator(fn):
+		@wraps(fn)
+		def wrapper(*args, **kwargs):
+			with stage(name):
+				return fn(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def init_app(app):
+	'''
+	Times every request of the Flask app: Server-Timing header, a JSON log
+	line and the covid_request_seconds histogram.
+	'''
+	from flask import g, request
+
+	# Neither gunicorn nor app.run configure this logger, without a handler
+	# the INFO lines would be dropped
+	if not logger.handlers:
+		handler = logging.StreamHandler()
+		handler.setFormatter(logging.Formatter('%(message)s'))
+		logger.addHandler(handler)
+		logger.setLevel(os.environ.get('TIMING_LOG_LEVEL', 'INFO'))
+		logger.propagate = False
+
+	@app.before_request
+	def start_timer():
+		g.timer = Timer()
+		_timer.set(g.timer)
+
+	@app.after_request
+	def finish_timer(response):
+		timer = g.pop('timer', None)
+		if timer is None:
+			return response
+
+		seconds = timer.elapsed()
+		response.headers['Server-Timing'] = timer.server_timing()
+		metrics.requests.observe((request.endpoint or 'unknown', request.method, str(response.status_code)), seconds)
+		logger.info(json.dumps({
+			'method': request.method,
+			'path': request.path,
+			'endpoint': request.endpoint,
+			'status': response.status_code,
+			'duration_ms': round(seconds * 1000, 2),
+			'stages_ms': {name: round(value * 1000, 2) for name, value in timer.stages.items()}}))
+		return response
+
+	@app.teardown_request
+	def reset_timer(exc):
+		_timer.set(None)
@@ -0,0 +1,90 @@
+'''
+	Persistent record of the articles already uploaded / indexed, so the
+	daily pipeline only passes on articles that are new or changed.
+
+	Stored as one JSON object in the news bucket:
+		{md5(link): [md5(title + description), last seen date]}
+	Entries not seen for RETENTION_DAYS are dropped when saving.
+'''
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+
+RETENTION_DAYS = 90
+
+def link_hash(link):
+	# Same hash bucket_to_elasticsearch uses as the document _id
+	return hashlib.md5(link.encode('utf-8')).hexdigest()
+
+def content_hash(item):
+	return hashlib.md5((item['title'] + '\0' + item['description']).encode('utf-8')).hexdigest()
+
+class SeenArticles():
+	def __init__(self, s3, bucket, key):
+		self.s3 = s3
+		self.bucket = bucket
+		self.key = key
+		self._lock = threading.Lock()
+		self._seen = {}
+
+	def load(self):
+		try:
+			obj = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+		except self.s3.exceptions.NoSuchKey:
+			self._seen = {}
+		else:
+			self._seen = json.loads(obj['Body'].read().decode('utf-8'))
+		return self
+
+	def save(self, today=None):
+		today = today or datetime.utcnow().strftime('%Y-%m-%d')
+		cutoff = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=RETENTION_DAYS)).strftime('%Y-%m-%d')
+		with self._lock:
+			self._seen = {k: v for k, v in self._seen.items() if v[1] >= cutoff}
+			body = json.dumps(self._seen)
+		self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body)
+
+	def diff(self, items):
+		'''
+		Splits items into the ones that are new or changed.
+
+		Returns (delta, pending, counts): pass pending to commit() once the
+		delta has been stored, counts has new / updated / skipped.
+		'''
+		pending = {}
+		counts = {'new': 0, 'updated': 0, 'skipped': 0}
+		delta = list(self.iter_delta(items, pending, counts))
+		return delta, pending, counts
+
+	def iter_delta(self, items, pending, counts):
+		'''
+		Streaming version of diff(): yields the new or changed items one at a
+		time, filling pending and counts as it goes.
+		'''
+		for item in items:
+			key, value = link_hash(item['link']), content_hash(item)
+			if key in pending:
+				continue
+			pending[key] = value
+			with self._lock:
+				previous = self._seen.get(key)
+
+			if previous is None:
+				counts['new'] += 1
+			elif previous[0] != value:
+				counts['updated'] += 1
+			else:
+				counts['skipped'] += 1
+				continue
+			yield item
+
+	def commit(self, pending, today=None):
+		'''
+		Marks pending (from diff) as seen today, including the skipped
+		articles so they are kept past RETENTION_DAYS while still live.
+		'''
+		today = today or datetime.utcnow().strftime('%Y-%m-%d')
+		with self._lock:
+			for key, value in pending.items():
+				self._seen[key] = [value, today]
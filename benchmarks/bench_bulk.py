@@ -0,0 +1,96 @@
+'''
+	Compare indexing throughput (docs/sec) of the old path, which reads each
+	day's whole <date>-<outlet>.json and sends it with helpers.bulk, with the
+	streaming path: NDJSON read line by line into index_news (parallel_bulk,
+	refresh and replicas off during the load).
+
+	S3 is mocked with moto; needs the local Elasticsearch from
+	docker-compose.yml and settings.py (imported by bucket_to_elasticsearch):
+		docker-compose up -d es7
+		ES_URL=http://localhost:9200 python benchmarks/bench_bulk.py
+
+	Everything is created under a bench- prefix and deleted afterwards.
+'''
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import boto3
+from moto import mock_aws
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+import bucket_to_elasticsearch
+from bucket_to_elasticsearch import INDEX_BODY, BUCKET_NAME, bulk_load, clean_text, index_news, iter_data_from_s3
+
+MONTHS = 3
+OUTLETS = ['thestar', 'cbc', 'ctv']
+DOCS_PER_FEED = 200
+CONFIGS = [(500, 1), (500, 4), (1000, 4), (1000, 8)] # (chunk_size, thread_count)
+INDEX = 'bench-bulk'
+
+def item(day, outlet, i):
+	link = 'https://example.com/%s/%s/%d' % (outlet, day, i)
+	return {
+		'guid': link,
+		'title': 'Story %d from %s' % (i, outlet),
+		'link': link,
+		'pubDate': day.strftime('%Y/%m/%d') + ' 10:00:00',
+		'description': ('<p>COVID-19 update <b>%d</b> &amp; more</p>' % i) * 10}
+
+def upload(s3, days):
+	for day in days:
+		for outlet in OUTLETS:
+			items = [item(day, outlet, i) for i in range(DOCS_PER_FEED)]
+			name = '%s-%s' % (day, outlet)
+			s3.put_object(Bucket=BUCKET_NAME, Key=name + '.json', Body=json.dumps({'items': items}))
+			s3.put_object(Bucket=BUCKET_NAME, Key=name + '.ndjson', Body=''.join(json.dumps(x) + '\n' for x in items))
+
+def legacy(es, s3, object_names):
+	for name in object_names:
+		obj = s3.get_object(Bucket=BUCKET_NAME, Key=name + '.json')
+		data = json.loads(obj['Body'].read().decode('utf-8'))['items']
+		bulk(es, ({'_index': INDEX, '_id': hashlib.md5(news['link'].encode('utf-8')).hexdigest(),
+			'_source': dict(news, description_text=clean_text(news['description']))} for news in data))
+
+def streaming(es, s3, object_names, chunk_size, thread_count):
+	with bulk_load(es, INDEX):
+		for name in object_names:
+			index_news(es, iter_data_from_s3(name, s3), INDEX, chunk_size=chunk_size, thread_count=thread_count)
+
+def run(es, label, load):
+	es.indices.delete(index=INDEX, ignore=404)
+	es.indices.create(index=INDEX, body=INDEX_BODY)
+	start = time.perf_counter()
+	load()
+	es.indices.refresh(index=INDEX)
+	elapsed = time.perf_counter() - start
+	count = es.count(index=INDEX)['count']
+	print('%-24s %10d %10.2f %12.0f' % (label, count, elapsed, count / elapsed))
+
+@mock_aws
+def main():
+	es = Elasticsearch(os.environ['ES_URL'], timeout=120)
+	s3 = boto3.client('s3', region_name='us-east-1')
+	s3.create_bucket(Bucket=BUCKET_NAME)
+	days = [date(2020, 1, 1) + timedelta(days=i) for i in range(30 * MONTHS)]
+	upload(s3, days)
+	object_names = ['%s-%s' % (day, outlet) for day in days for outlet in OUTLETS]
+
+	# The benchmark index is not behind the news aliases, skip the dedup pass
+	bucket_to_elasticsearch.READ_ALIAS = 'bench-no-such-alias'
+
+	print('%d days x %d outlets x %d docs' % (len(days), len(OUTLETS), DOCS_PER_FEED))
+	print('%-24s %10s %10s %12s' % ('path', 'docs', 'time (s)', 'docs/sec'))
+	run(es, 'json + bulk', lambda: legacy(es, s3, object_names))
+	for chunk_size, thread_count in CONFIGS:
+		run(es, 'ndjson + parallel %d/%d' % (chunk_size, thread_count),
+			lambda: streaming(es, s3, object_names, chunk_size, thread_count))
+	es.indices.delete(index=INDEX, ignore=404)
+
+if __name__ == '__main__':
+	main()
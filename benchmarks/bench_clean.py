@@ -0,0 +1,60 @@
+'''
+	Micro-benchmark the per-request cost of turning search hits into articles.
+
+	Compares parsing every description with BeautifulSoup (the old request
+	path), the regex fallback for documents indexed before descriptions were
+	cleaned at ingestion, and reading the pre-cleaned description_text.
+
+	Usage:
+		python benchmarks/bench_clean.py
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from bs4 import BeautifulSoup
+import search
+
+HITS = [10, 100, 1000]
+
+DESCRIPTION = ('<p><img src="https://example.com/image.jpg" alt="Ontario" width="460"/>'
+	'Ontario is reporting <b>468</b> new cases of COVID-19 &amp; 15 more deaths, '
+	'according to the province&#39;s latest figures. <a href="https://example.com/story">Read more</a></p>')
+
+def make_hits(n):
+	return [{
+		'title': 'Story %d' % i,
+		'description': DESCRIPTION,
+		'description_text': BeautifulSoup(DESCRIPTION, features='lxml').get_text(),
+		'link': 'https://example.com/%d' % i,
+		'pubDate': '2020/04/05 10:00:00'} for i in range(n)]
+
+def with_beautifulsoup(hits):
+	for hit in hits:
+		search.NewsArticle(hit['title'], BeautifulSoup(hit['description'], features='lxml').get_text(),
+			hit['link'], hit['pubDate'])
+
+def with_regex(hits):
+	for hit in hits:
+		search.NewsArticle(hit['title'], search.clean_text(hit['description']), hit['link'], hit['pubDate'])
+
+def with_precleaned(hits):
+	for hit in hits:
+		search._to_article(hit)
+
+def main():
+	sample = make_hits(1)[0]
+	assert search.clean_text(sample['description']) == sample['description_text']
+
+	print('%6s %18s %12s %16s' % ('hits', 'beautifulsoup (ms)', 'regex (ms)', 'pre-cleaned (ms)'))
+	for n in HITS:
+		hits = make_hits(n)
+		number = max(1, 1000 // n)
+		times = [min(timeit.repeat(lambda: fn(hits), number=number, repeat=5)) / number * 1000
+			for fn in (with_beautifulsoup, with_regex, with_precleaned)]
+		print('%6d %18.3f %12.3f %16.3f' % tuple([n] + times))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,71 @@
+'''
+	Benchmark initial value extraction and date range slicing on
+	historical_df: the old boolean scans against the date indexed frame.
+
+	Usage:
+		python benchmarks/bench_dates.py
+'''
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import numpy as np
+import pandas as pd
+import func
+
+NUM_DAYS = [120, 1500, 10000]
+REPEAT = 200
+
+def synthetic_historical_df(num_days):
+	num_confirmed = np.cumsum(np.linspace(1, 1500, num_days)).astype(np.int32)
+	return pd.DataFrame({
+		'date': pd.date_range(datetime(2020, 1, 22), periods=num_days, freq='D'),
+		'num_confirmed': num_confirmed,
+		'num_recovered': num_confirmed // 3,
+		'num_deaths': num_confirmed // 25})
+
+def legacy_init_values(historical_df, start_date):
+	'''
+	_get_init_values_for_model before the date index: eight boolean scans.
+	'''
+	RR = 0.75
+	E_0 = round((historical_df[historical_df.date == start_date].num_confirmed.values[0]
+		- historical_df[historical_df.date == start_date].num_recovered.values[0]
+		- historical_df[historical_df.date == start_date].num_deaths.values[0]) * ((1 - RR) / RR))
+	I_0 = (historical_df[historical_df.date == start_date].num_confirmed.values[0]
+		- historical_df[historical_df.date == start_date].num_recovered.values[0]
+		- historical_df[historical_df.date == start_date].num_deaths.values[0])
+	R_0 = historical_df[historical_df.date == start_date].num_recovered.values[0]
+	D_0 = historical_df[historical_df.date == start_date].num_deaths.values[0]
+	return 37411038 - (E_0 + I_0 + R_0 + D_0), E_0, I_0, R_0, D_0
+
+def legacy_range(historical_df, start_date, end_date):
+	return historical_df[(historical_df.date >= start_date) & (historical_df.date <= end_date)]
+
+def per_call_us(fn, *args):
+	return min(timeit.repeat(lambda: fn(*args), number=REPEAT, repeat=3)) / REPEAT * 1e6
+
+def main():
+	print('%8s %-16s %12s %12s' % ('days', 'operation', 'scan (us)', 'index (us)'))
+	for num_days in NUM_DAYS:
+		plain_df = synthetic_historical_df(num_days)
+		indexed_df = func.index_by_date(plain_df)
+		start_date = datetime(2020, 1, 22) + timedelta(days=num_days // 2)
+		end_date = start_date + timedelta(days=60)
+
+		assert legacy_init_values(plain_df, start_date) == func._get_init_values_for_model(indexed_df, start_date, 37411038)
+		assert legacy_range(plain_df, start_date, end_date).reset_index(drop=True).equals(
+			func._date_range(indexed_df, start_date, end_date).reset_index(drop=True))
+
+		print('%8d %-16s %12.1f %12.1f' % (num_days, 'init values',
+			per_call_us(legacy_init_values, plain_df, start_date),
+			per_call_us(func._get_init_values_for_model, indexed_df, start_date, 37411038)))
+		print('%8d %-16s %12.1f %12.1f' % (num_days, 'date range',
+			per_call_us(legacy_range, plain_df, start_date, end_date),
+			per_call_us(func._date_range, indexed_df, start_date, end_date)))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,68 @@
+'''
+	Benchmark ensemble forecasts (func.ensemble_seir_model): one run_seir
+	call per member against the vectorized ensemble, deterministic and
+	chain-binomial, for several ensemble sizes over 365 days.
+
+	Usage:
+		python benchmarks/bench_ensemble.py
+'''
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import numpy as np
+import pandas as pd
+import func
+import seir
+from data.parameters import R0, INC_PER, REC_TIME, ENSEMBLE_SPREAD
+
+MEMBERS = [100, 1000, 5000]
+TIME_STEPS = 365
+START_DATE = datetime(2020, 4, 5)
+
+def synthetic_historical_df(num_days=120):
+	num_confirmed = np.cumsum(np.linspace(1, 1500, num_days)).astype(np.int64)
+	return func.index_by_date(pd.DataFrame({
+		'date': pd.date_range(datetime(2020, 1, 22), periods=num_days, freq='D'),
+		'num_confirmed': num_confirmed,
+		'num_recovered': num_confirmed // 3,
+		'num_deaths': num_confirmed // 25}))
+
+def per_member(historical_df, members, seed=0):
+	'''
+	The same ensemble as one base_seir_model style run per member.
+	'''
+	region = func.load_regions().loc[func.COUNTRY]
+	init_values = func._get_init_values_for_model(historical_df, START_DATE, region.population)
+	rng = np.random.default_rng(seed)
+	results = []
+	for _ in range(members):
+		sampled = [value * rng.lognormal(0, ENSEMBLE_SPREAD) for value in (R0, INC_PER, REC_TIME)]
+		results.append(seir.run_seir(init_values, func._get_model_hyperparams((*sampled, TIME_STEPS)), TIME_STEPS,
+			func._get_age_arrays(region.age_file), num_hospital_beds=region.hospital_beds))
+	return {name: np.percentile([r[name] for r in results], (5, 50, 95), axis=0)
+		for name in ('Infected', 'Hospitalized', 'Total Deaths')}
+
+def timed(fn, *args, **kwargs):
+	start = time.perf_counter()
+	fn(*args, **kwargs)
+	return time.perf_counter() - start
+
+def main():
+	historical_df = synthetic_historical_df()
+	params = (R0, INC_PER, REC_TIME, TIME_STEPS)
+	func.ensemble_seir_model(params, TIME_STEPS, historical_df, START_DATE, members=10) # warm up the age arrays
+
+	print('%d days' % TIME_STEPS)
+	print('%8s %16s %16s %16s' % ('members', 'per member (s)', 'vectorized (s)', 'stochastic (s)'))
+	for members in MEMBERS:
+		print('%8d %16.3f %16.3f %16.3f' % (members,
+			timed(per_member, historical_df, members),
+			timed(func.ensemble_seir_model, params, TIME_STEPS, historical_df, START_DATE, members=members),
+			timed(func.ensemble_seir_model, params, TIME_STEPS, historical_df, START_DATE, members=members, stochastic=True)))
+
+if __name__ == '__main__':
+	main()
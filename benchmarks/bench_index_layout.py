@@ -0,0 +1,97 @@
+'''
+	Compare search latency of the old one-index-per-outlet-per-day layout
+	with the rolling indices behind a read alias, as history grows.
+
+	Needs the local Elasticsearch from docker-compose.yml and settings.py
+	(imported by bucket_to_elasticsearch):
+		docker-compose up -d es7
+		ES_URL=http://localhost:9200 python benchmarks/bench_index_layout.py
+
+	Everything is created under a bench- prefix and deleted afterwards.
+'''
+import hashlib
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+from bucket_to_elasticsearch import INDEX_BODY
+
+HISTORY_DAYS = [30, 90, 180]
+OUTLETS = ['thestar', 'cbc', 'ctv']
+DOCS_PER_FEED = 30
+DAYS_PER_ROLLING_INDEX = 30
+NUM_QUERIES = 200
+TERMS = ['COVID-19', 'Ontario', 'hospital', 'vaccine', 'Toronto', 'economy']
+
+SINGLE_SHARD = {'number_of_shards': 1, 'number_of_replicas': 0}
+
+def docs_for(day, outlet):
+	for i in range(DOCS_PER_FEED):
+		link = 'https://example.com/%s/%s/%d' % (outlet, day, i)
+		yield hashlib.md5(link.encode('utf-8')).hexdigest(), {
+			'guid': link,
+			'title': '%s story %d from %s' % (TERMS[i % len(TERMS)], i, outlet),
+			'link': link,
+			'pubDate': day.strftime('%Y/%m/%d') + ' 10:00:00',
+			'description': '<p>%s</p>' % TERMS[i % len(TERMS)],
+			'description_text': TERMS[i % len(TERMS)]}
+
+def index_body():
+	body = dict(INDEX_BODY)
+	body['settings'] = dict(INDEX_BODY['settings'], **SINGLE_SHARD)
+	return body
+
+def build_daily(es, days):
+	actions = []
+	for day in days:
+		for outlet in OUTLETS:
+			index_name = 'bench-%s-%s' % (day, outlet)
+			es.indices.create(index=index_name, body=index_body())
+			actions += [{'_index': index_name, '_id': _id, '_source': source} for _id, source in docs_for(day, outlet)]
+	bulk(es, actions, refresh=True)
+	return 'bench-20*'
+
+def build_rolling(es, days):
+	actions = []
+	for i, day in enumerate(days):
+		index_name = 'bench-articles-%06d' % (i // DAYS_PER_ROLLING_INDEX + 1)
+		if not es.indices.exists(index=index_name):
+			es.indices.create(index=index_name, body=dict(index_body(), aliases={'bench-news': {}}))
+		for outlet in OUTLETS:
+			actions += [{'_index': index_name, '_id': _id, '_source': source} for _id, source in docs_for(day, outlet)]
+	bulk(es, actions, refresh=True)
+	return 'bench-news'
+
+def measure(es, index):
+	latencies = []
+	for i in range(NUM_QUERIES):
+		start = time.perf_counter()
+		es.search(index=index, body={'query': {'match': {'title': TERMS[i % len(TERMS)]}}, 'size': 10})
+		latencies.append((time.perf_counter() - start) * 1000)
+	return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def cleanup(es):
+	es.indices.delete(index='bench-*', ignore=404)
+
+def main():
+	es = Elasticsearch(os.environ['ES_URL'], timeout=120)
+	print('%6s %8s %10s %10s %10s' % ('days', 'layout', 'indices', 'p50 (ms)', 'p99 (ms)'))
+	for num_days in HISTORY_DAYS:
+		days = [date(2020, 1, 1) + timedelta(days=i) for i in range(num_days)]
+		for name, build in (('daily', build_daily), ('rolling', build_rolling)):
+			cleanup(es)
+			index = build(es, days)
+			num_indices = len(es.indices.get(index=index))
+			measure(es, index) # warm up
+			p50, p99 = measure(es, index)
+			print('%6d %8s %10d %10.2f %10.2f' % (num_days, name, num_indices, p50, p99))
+	cleanup(es)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+'''
+	Benchmark streaming JHU ingestion against reading the full CSVs with pandas.
+
+	Uses synthetic 300 country x 1,500 day files.
+
+	Usage:
+		python benchmarks/bench_ingest.py
+'''
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import pandas as pd
+import func
+from fixtures import write_jhu_files
+
+NUM_COUNTRIES = 300
+NUM_DAYS = 1500
+
+def legacy_get_covid_data(sources):
+	'''
+	The pandas path get_covid_data used before streaming ingestion.
+	'''
+	frames = [pd.read_csv(source).rename(columns = {'Country/Region':'Country'}) for source in sources]
+	frames = [frame[frame.Country == 'Canada'] for frame in frames]
+	global_confirmed, global_recovered, global_deaths = frames
+	last_updated = global_confirmed.columns[-1]
+
+	id_columns = ['Province/State','Country','Lat','Long']
+	historical_df = pd.DataFrame()
+	historical_df['date'] = [datetime.strptime(date, '%m/%d/%y') \
+	          for date in global_confirmed.drop(id_columns,axis=1).sum(axis=0).index]
+	historical_df['num_confirmed'] = global_confirmed.drop(id_columns,axis=1).sum(axis=0).values
+	historical_df['num_recovered'] = global_recovered.drop(id_columns,axis=1).sum(axis=0).values
+	historical_df['num_deaths'] = global_deaths.drop(id_columns,axis=1).sum(axis=0).values
+	return historical_df, last_updated
+
+def measure(fn, *args):
+	tracemalloc.start()
+	start = time.perf_counter()
+	result = fn(*args)
+	elapsed = time.perf_counter() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, elapsed, peak
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		sources = write_jhu_files(directory, num_countries=NUM_COUNTRIES, num_days=NUM_DAYS)
+		size = sum(os.path.getsize(source) for source in sources)
+		print('%d countries x %d days, %.1f MB over 3 files' % (NUM_COUNTRIES, NUM_DAYS, size / 1e6))
+
+		(expected, _), legacy_time, legacy_peak = measure(legacy_get_covid_data, sources)
+		(actual, _), stream_time, stream_peak = measure(func.get_covid_data, sources)
+
+		columns = ['num_confirmed', 'num_recovered', 'num_deaths']
+		assert (expected[columns].to_numpy() == actual[columns].to_numpy()).all()
+		assert (expected.date.to_numpy() == actual.date.to_numpy()).all()
+
+		print('%10s %10s %16s' % ('', 'time (s)', 'peak alloc (MB)'))
+		print('%10s %10.3f %16.1f' % ('pandas', legacy_time, legacy_peak / 1e6))
+		print('%10s %10.3f %16.1f' % ('streaming', stream_time, stream_peak / 1e6))
+
+if __name__ == '__main__':
+	main()
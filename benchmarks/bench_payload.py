@@ -0,0 +1,69 @@
+'''
+	Benchmark plot payloads: the plotly figure JSON (px.line of the melted
+	frame) against the compact series of func.compact_series, which
+	static/script.js turns into traces. Reports the time to build and
+	serialize a response body and its size, raw and gzipped.
+
+	Usage:
+		python benchmarks/bench_payload.py
+'''
+import gzip
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import numpy as np
+import pandas as pd
+import func
+from data.parameters import R0, INC_PER, REC_TIME
+
+NUM_DAYS = 300
+TIME_STEPS = 365
+START_DATE = datetime(2020, 4, 5)
+REPEAT = 20
+VALUE_VARS = ['Exposed', 'Infected', 'Hospitalized', 'Total Deaths']
+
+def synthetic_historical_df(num_days=NUM_DAYS):
+	num_confirmed = np.cumsum(np.linspace(1, 1500, num_days)).astype(np.int64)
+	return func.index_by_date(pd.DataFrame({
+		'date': pd.date_range(datetime(2020, 1, 22), periods=num_days, freq='D'),
+		'num_confirmed': num_confirmed,
+		'num_recovered': num_confirmed // 3,
+		'num_deaths': num_confirmed // 25}))
+
+def body(field, plot):
+	return json.dumps({'last_updated': 'Sat, 05 Sep 2020 00:00:00 GMT', field: plot}).encode('utf-8')
+
+def per_call_ms(fn):
+	return min(timeit.repeat(fn, number=REPEAT, repeat=3)) / REPEAT * 1e3
+
+def main():
+	historical_df = synthetic_historical_df()
+	params = (R0, INC_PER, REC_TIME, TIME_STEPS)
+	results_df = func.base_seir_model(params, TIME_STEPS, historical_df, START_DATE, jsonify=False)
+	tuning_start = (historical_df.date.iloc[-1] - timedelta(days=90)).strftime('%Y-%m-%d')
+
+	cases = [
+		('historical',
+			lambda: body('plot', func.create_plot_from_data(historical_df)),
+			lambda: body('series', func.create_plot_from_data(historical_df, compact=True))),
+		('simulation (%d days)' % TIME_STEPS,
+			lambda: body('plot', func._results_plot(results_df, VALUE_VARS)),
+			lambda: body('series', func.compact_series(START_DATE, {name: results_df[name] for name in VALUE_VARS}))),
+		('tuning, incl. simulation',
+			lambda: body('plot', func.create_tuning_plot(params, historical_df, start_date=tuning_start)),
+			lambda: body('series', func.create_tuning_plot(params, historical_df, start_date=tuning_start, compact=True))),
+	]
+
+	print('%-26s %-8s %10s %10s %10s' % ('payload', 'format', 'time (ms)', 'bytes', 'gzipped'))
+	for name, figure, compact in cases:
+		for label, fn in (('plotly', figure), ('compact', compact)):
+			payload = fn()
+			print('%-26s %-8s %10.2f %10d %10d' % (name, label, per_call_ms(fn), len(payload), len(gzip.compress(payload))))
+
+if __name__ == '__main__':
+	main()
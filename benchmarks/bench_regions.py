@@ -0,0 +1,83 @@
+'''
+	Benchmark forecasting every JHU country: one base_seir_model style run
+	per country against the vectorized region batch of func.region_seir_model.
+
+	Uses synthetic JHU files and a synthetic regions table (one row per
+	country) written to a temporary directory.
+
+	Usage:
+		python benchmarks/bench_regions.py
+'''
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import numpy as np
+import func
+import seir
+from fixtures import write_jhu_files
+
+NUM_COUNTRIES = 190
+NUM_DAYS = 300
+TIME_STEPS = 365
+PARAMS = (2.65, 7, 21, TIME_STEPS)
+START_DATE = '4/5/20'
+
+def write_regions(path, num_countries, seed=0):
+	rng = np.random.default_rng(seed)
+	names = ['Canada'] + ['Country %d' % i for i in range(num_countries - 1)]
+	with open(path, 'w') as f:
+		f.write('region,country,province,population,hospital_beds,age_file\n')
+		for name in names:
+			population = int(rng.integers(10**6, 10**8))
+			beds = int(population * rng.uniform(0.001, 0.008))
+			f.write('%s,%s,,%d,%d,%s\n' % (name, name, population, beds, func.DEFAULT_AGE_FILE))
+
+def per_region(sources, regions):
+	'''
+	One read of the JHU files and one simulation per region.
+	'''
+	results = []
+	for region, row in regions.iterrows():
+		historical_df, _ = func.get_covid_data(sources=sources, country=row.country)
+		init_values = func._get_init_values_for_model(historical_df, datetime.strptime(START_DATE, '%m/%d/%y'), row.population)
+		results.append(seir.run_seir(init_values, func._get_model_hyperparams(PARAMS), TIME_STEPS,
+			func._get_age_arrays(row.age_file), num_hospital_beds=row.hospital_beds))
+	return results
+
+def batched(sources, regions):
+	region_data, _ = func.get_region_data(regions, sources)
+	return func.region_seir_model(PARAMS, TIME_STEPS, region_data, START_DATE)
+
+def timed(fn, *args):
+	start = time.perf_counter()
+	result = fn(*args)
+	return time.perf_counter() - start, result
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		sources = write_jhu_files(directory, num_countries=NUM_COUNTRIES, num_days=NUM_DAYS)
+		regions_file = os.path.join(directory, 'regions.csv')
+		write_regions(regions_file, NUM_COUNTRIES)
+		regions = func.load_regions(regions_file)
+
+		region_data, _ = func.get_region_data(regions, sources)
+		sim_time, _ = timed(func.region_seir_model, PARAMS, TIME_STEPS, region_data, START_DATE)
+		loop_time, loop_results = timed(per_region, sources, regions)
+		batch_time, (_, batch_results) = timed(batched, sources, regions)
+
+		for name in batch_results:
+			assert np.allclose(batch_results[name], [r[name] for r in loop_results], equal_nan=True), name
+
+	print('%d regions, %d steps' % (len(regions), TIME_STEPS))
+	print('%-32s %10s' % ('mode', 'time (s)'))
+	print('%-32s %10.3f' % ('read + simulate per region', loop_time))
+	print('%-32s %10.3f' % ('read once + region batch', batch_time))
+	print('%-32s %10.3f' % ('region batch simulation only', sim_time))
+
+if __name__ == '__main__':
+	main()
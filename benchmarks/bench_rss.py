@@ -0,0 +1,69 @@
+'''
+	Benchmark the streaming RSS parser against the BeautifulSoup path.
+
+	Each parser runs in a fresh interpreter on synthetic feeds so peak RSS
+	(resident memory) can be compared. Throughput is items per second.
+
+	Usage:
+		python benchmarks/bench_rss.py
+'''
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from fixtures import write_rss_feed
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SIZES = [10000, 50000]
+
+CHILD = '''
+import json, resource, sys, time
+sys.path.insert(0, %(root)r)
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+method, path = sys.argv[1], sys.argv[2]
+
+if method == 'beautifulsoup':
+	from datetime import datetime
+	from bs4 import BeautifulSoup
+	def parse_date(date):
+		return datetime.strptime(date[:-4], '%%a, %%d %%b %%Y %%H:%%M:%%S').strftime("%%Y/%%m/%%d %%H:%%M:%%S")
+	def parse(path):
+		with open(path, 'rb') as f:
+			soup = BeautifulSoup(f.read(), features='xml')
+		items = []
+		for item in soup.findAll('item'):
+			items.append({'guid': item.guid.text, 'title': item.title.text, 'link': item.link.text,
+				'pubDate': parse_date(item.pubDate.text), 'description': item.description.text})
+		return len(items)
+else:
+	from rss_parser import iter_items
+	def parse(path):
+		return sum(1 for _ in iter_items(path))
+
+start = time.perf_counter()
+count = parse(path)
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+print(json.dumps([count, elapsed, peak]))
+'''
+
+def run(method, path):
+	output = subprocess.run([sys.executable, '-c', CHILD % {'root': ROOT}, method, path],
+		check=True, capture_output=True, text=True).stdout
+	return json.loads(output.strip().splitlines()[-1])
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		print('%8s %14s %12s %14s %14s' % ('items', 'parser', 'time (s)', 'items/s', 'peak RSS (MB)'))
+		for size in SIZES:
+			path = os.path.join(directory, 'feed-%d.xml' % size)
+			write_rss_feed(path, size)
+			for method in ('beautifulsoup', 'streaming'):
+				count, elapsed, peak = run(method, path)
+				assert count == size
+				print('%8d %14s %12.3f %14.0f %14.1f' % (size, method, elapsed, count / elapsed, peak / 1024))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,141 @@
+'''
+	Load test the news search path against a local Elasticsearch.
+
+	Start the container from docker-compose.yml first:
+		docker-compose up -d es7
+		ES_URL=http://localhost:9200 python benchmarks/bench_search.py
+
+	Compares p50/p99 latency of a new client per call (the old behaviour),
+	the pooled process wide client, and two searches per request run one
+	after the other or concurrently on the async client (search_pages).
+	Then walks DEEP_PAGES pages of date sorted results with from/size and
+	with the search_after cursors of search.search_page. The search cache
+	is off throughout, so every row measures Elasticsearch.
+'''
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+INDEX = 'bench-search'
+os.environ.setdefault('ES_INDEX', INDEX)
+
+import numpy as np
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+import search
+
+NUM_DOCS = 5000
+NUM_REQUESTS = 2000
+CONCURRENCY = 16
+TERMS = ['COVID-19', 'Ontario', 'hospital', 'vaccine', 'Toronto', 'economy', 'schools', 'Trudeau']
+OUTLETS = ['thestar', 'cbc', 'ctv']
+PAGE_SIZE = 10
+DEEP_PAGES = 50
+
+def seed(es):
+	if es.indices.exists(index=INDEX):
+		return
+	es.indices.create(index=INDEX, body={'mappings': {'properties': {
+		'pubDate': {'type': 'date', 'format': 'yyyy/MM/dd HH:mm:ss'},
+		'outlet': {'type': 'keyword'}}}})
+	def gen_data():
+		for i in range(NUM_DOCS):
+			link = 'https://example.com/news/%d' % i
+			yield {
+				'_index': INDEX,
+				'_id': hashlib.md5(link.encode('utf-8')).hexdigest(),
+				'_source': {
+					'guid': str(i),
+					'title': '%s update number %d' % (TERMS[i % len(TERMS)], i),
+					'link': link,
+					'pubDate': '2020/04/%02d %02d:%02d:00' % (i % 28 + 1, i % 24, i % 60),
+					'description': '<p>Story <b>%d</b> about %s.</p>' % (i, TERMS[i % len(TERMS)]),
+					'outlet': OUTLETS[i % len(OUTLETS)]
+				}
+			}
+	bulk(es, gen_data(), refresh=True)
+
+def new_client_search(search_term, num_results):
+	'''
+	The old search(): a new client and connection pool on every call.
+	'''
+	es = Elasticsearch(os.environ['ES_URL'])
+	body = search._title_search(search_term, num_results).to_dict()
+	hits = es.search(index=INDEX, body=body)['hits']['hits']
+	search._fill_descriptions(es.mget, hits)
+	return [search._to_article(hit['_source']) for hit in hits]
+
+def timed(fn, *args):
+	start = time.perf_counter()
+	fn(*args)
+	return time.perf_counter() - start
+
+def run_sync(fn):
+	with ThreadPoolExecutor(CONCURRENCY) as pool:
+		args = [(TERMS[i % len(TERMS)], 10) for i in range(NUM_REQUESTS)]
+		return list(pool.map(lambda a: timed(fn, *a), args))
+
+def run_sync_pair():
+	def request(i):
+		start = time.perf_counter()
+		search.search(TERMS[i % len(TERMS)], 10)
+		search.search('COVID-19', 10)
+		return time.perf_counter() - start
+	with ThreadPoolExecutor(CONCURRENCY) as pool:
+		return list(pool.map(request, range(NUM_REQUESTS)))
+
+def run_async_pair():
+	def request(i):
+		queries = [
+			{'search_term': TERMS[i % len(TERMS)], 'num_results': 10},
+			{'search_term': 'COVID-19', 'num_results': 10}]
+		return timed(search.search_pages, queries)
+	with ThreadPoolExecutor(CONCURRENCY) as pool:
+		return list(pool.map(request, range(NUM_REQUESTS)))
+
+def walk_from_size(es):
+	'''
+	Pages by offset, every page sorts and skips all the hits before it.
+	'''
+	latencies = []
+	for page in range(DEEP_PAGES):
+		body = search._title_search('COVID-19', PAGE_SIZE, 'date').to_dict()
+		body['from'] = page * PAGE_SIZE
+		start = time.perf_counter()
+		es.search(index=INDEX, body=body)
+		latencies.append(time.perf_counter() - start)
+	return latencies
+
+def walk_search_after():
+	latencies, after = [], None
+	for page in range(DEEP_PAGES):
+		start = time.perf_counter()
+		_, after = search.search_page('COVID-19', PAGE_SIZE, 'date', after=after)
+		latencies.append(time.perf_counter() - start)
+		if after is None:
+			break
+	return latencies
+
+def report(name, latencies):
+	latencies = np.array(latencies) * 1000
+	print('%-28s %10.2f %10.2f' % (name, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+def main():
+	seed(Elasticsearch(os.environ['ES_URL']))
+	search.get_client()
+	search_cache_was = search.search_cache
+	search.search_cache = search.ResultCache(maxsize=0) # measure Elasticsearch, not the cache
+	print('%-28s %10s %10s' % ('mode', 'p50 (ms)', 'p99 (ms)'))
+	report('new client per call', run_sync(new_client_search))
+	report('pooled client', run_sync(search.search))
+	report('pooled, 2 searches serial', run_sync_pair())
+	report('async, 2 searches gathered', run_async_pair())
+	report('%d pages, from/size' % DEEP_PAGES, walk_from_size(search.get_client()))
+	report('%d pages, search_after' % DEEP_PAGES, walk_search_after())
+	search.search_cache = search_cache_was
+
+if __name__ == '__main__':
+	main()
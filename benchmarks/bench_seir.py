@@ -0,0 +1,94 @@
+'''
+	Benchmark the NumPy SEIR engine against the original per-day pandas loop.
+
+	Usage:
+		python benchmarks/bench_seir.py
+'''
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import numpy as np
+import pandas as pd
+import func
+from data.parameters import R0, INC_PER, REC_TIME, CDR
+
+STEPS = [183, 1000, 10000]
+START_DATE = datetime(2020, 4, 5)
+
+def synthetic_historical_df(num_days=120):
+	dates = [datetime(2020, 1, 22) + timedelta(days=i) for i in range(num_days)]
+	num_confirmed = np.cumsum(np.linspace(1, 1500, num_days)).astype(np.int64)
+	return pd.DataFrame({
+		'date': dates,
+		'num_confirmed': num_confirmed,
+		'num_recovered': num_confirmed // 3,
+		'num_deaths': num_confirmed // 25})
+
+def legacy_seir_model(params, time_steps, historical_df, start_date):
+	'''
+	The per-day pandas loop that base_seir_model used before the NumPy engine.
+	'''
+	S_0, E_0, I_0, R_0, D_0 = func._get_init_values_for_model(historical_df, start_date)
+	age_data_df = func.init_social_demographic_data()
+	num_hospital_beds = 93527
+	H_0 = round(I_0 * age_data_df.distribution * age_data_df.hospitalization_rate).sum()
+	N = S_0 + E_0 + I_0 + R_0 + D_0
+	beta, sigma, gamma = func._get_model_hyperparams(params)
+
+	S, E, I, R, D, H = [S_0], [E_0], [I_0], [R_0], [D_0], [H_0]
+	dates = [start_date]
+	for i in range(1,time_steps+1):
+		date = dates[-1] + timedelta(days=1)
+		next_S = S[-1] - (beta*S[-1]*I[-1])/N
+		next_E = E[-1] + (beta*S[-1]*I[-1])/N - sigma*E[-1]
+		next_I = I[-1] + (sigma*E[-1] - gamma*I[-1])
+		next_R = R[-1] + (gamma*I[-1])
+		next_H = round(next_I * age_data_df.distribution * age_data_df.hospitalization_rate).sum()
+		if next_H <= num_hospital_beds:
+			next_D = D[-1] + round(next_H * age_data_df.distribution * age_data_df.hospitalized_death_rate).sum()
+		else:
+			deaths_with_hospital_care = round(num_hospital_beds * age_data_df.distribution * age_data_df.hospitalized_death_rate).sum()
+			deahts_no_hospital_care = round((next_H - num_hospital_beds) * CDR)
+			next_D = D[-1] + deaths_with_hospital_care + deahts_no_hospital_care
+		S.append(next_S)
+		E.append(next_E)
+		I.append(next_I)
+		R.append(next_R)
+		H.append(next_H)
+		D.append(next_D)
+		dates.append(date)
+
+	return pd.DataFrame({
+		'dates': dates,
+		'Susceptible': S,
+		'Exposed': E,
+		'Infected': I,
+		'Recovered': R,
+		'Hospitalized': H,
+		'Total Deaths': D})
+
+def best_of(fn, repeat):
+	return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+def main():
+	historical_df = synthetic_historical_df()
+	params = (R0, INC_PER, REC_TIME, None)
+
+	print('%8s %12s %12s %9s' % ('steps', 'legacy (s)', 'numpy (s)', 'speedup'))
+	for steps in STEPS:
+		expected = legacy_seir_model(params, steps, historical_df, START_DATE)
+		actual = func.base_seir_model(params, steps, historical_df, START_DATE, jsonify=False)
+		columns = ['Susceptible', 'Exposed', 'Infected', 'Recovered', 'Hospitalized', 'Total Deaths']
+		assert np.array_equal(expected[columns].to_numpy(dtype=np.float64), actual[columns].to_numpy()), steps
+
+		repeat = 3 if steps >= 10000 else 5
+		legacy = best_of(lambda: legacy_seir_model(params, steps, historical_df, START_DATE), repeat)
+		numpy = best_of(lambda: func.base_seir_model(params, steps, historical_df, START_DATE, jsonify=False), repeat)
+		print('%8d %12.4f %12.4f %8.1fx' % (steps, legacy, numpy, legacy / numpy))
+
+if __name__ == '__main__':
+	main()
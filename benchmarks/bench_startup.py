@@ -0,0 +1,66 @@
+'''
+	Measure cold start to first response for the Flask app, eager vs lazy.
+
+	Each case runs in a fresh interpreter against local fixture CSVs, so no
+	network access is needed. Elasticsearch is not contacted: the first
+	response is the /ready probe (news routes only need search.py), then the
+	first /simulation page.
+
+	Usage:
+		python benchmarks/bench_startup.py
+'''
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from fixtures import write_jhu_files
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %r)
+import app
+imported = time.perf_counter() - start
+client = app.app.test_client()
+client.get('/ready')
+first_response = time.perf_counter() - start
+client.get('/simulation')
+first_simulation = time.perf_counter() - start
+print(json.dumps([imported, first_response, first_simulation]))
+'''
+
+CASES = [
+	('eager', {'LAZY_STARTUP': '0'}),
+	('lazy, warm-up', {'LAZY_STARTUP': '1', 'WARMUP': '1'}),
+	('lazy, on use', {'LAZY_STARTUP': '1', 'WARMUP': '0'}),
+]
+
+def run(env, repeat=3):
+	results = []
+	for _ in range(repeat):
+		output = subprocess.run([sys.executable, '-c', CHILD % APP_DIR],
+			env=env, check=True, capture_output=True, text=True).stdout
+		results.append(json.loads(output.strip().splitlines()[-1]))
+	return [min(r[i] for r in results) for i in range(3)]
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		confirmed, recovered, deaths = write_jhu_files(directory, num_countries=200, num_days=500)
+		base_env = dict(os.environ,
+			JHU_CONFIRMED_URL=confirmed,
+			JHU_RECOVERED_URL=recovered,
+			JHU_DEATHS_URL=deaths,
+			COVID_DATA_DIR=os.path.join(directory, 'cache'),
+			ES_URL='http://127.0.0.1:9200')
+
+		print('%-16s %12s %18s %18s' % ('mode', 'import (s)', 'first response (s)', 'first /simulation (s)'))
+		for name, env in CASES:
+			imported, first_response, first_simulation = run(dict(base_env, **env))
+			print('%-16s %12.3f %18.3f %18.3f' % (name, imported, first_response, first_simulation))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,118 @@
+'''
+	Synthetic fixture data shared by the benchmarks.
+'''
+from datetime import date, timedelta
+import json
+import numpy as np
+
+def jhu_date_headers(num_days, start=date(2020, 1, 22)):
+	days = [start + timedelta(days=i) for i in range(num_days)]
+	return ['%d/%d/%d' % (d.month, d.day, d.year % 100) for d in days]
+
+def write_jhu_csv(path, num_countries=300, num_days=1500, provinces=('Ontario', 'Quebec'),
+				country='Canada', divisor=1, seed=0):
+	'''
+	Writes a JHU style global time series CSV with num_countries countries
+	(country with one row per province, every other country with one row)
+	and num_days date columns.
+	'''
+	rng = np.random.default_rng(seed)
+	with open(path, 'w') as f:
+		f.write('Province/State,Country/Region,Lat,Long,' + ','.join(jhu_date_headers(num_days)) + '\n')
+		names = [country] + ['Country %d' % i for i in range(num_countries - 1)]
+		for name in names:
+			for province in (provinces if name == country else ('',)):
+				values = np.cumsum(rng.integers(0, 500, num_days)) // divisor
+				f.write('%s,%s,%.4f,%.4f,' % (province, name, rng.uniform(-90, 90), rng.uniform(-180, 180)))
+				f.write(','.join(map(str, values)) + '\n')
+
+def write_jhu_files(directory, **kwargs):
+	'''
+	Writes confirmed, recovered and deaths files to directory and returns their paths.
+	'''
+	paths = []
+	for kind, divisor in (('confirmed', 1), ('recovered', 3), ('deaths', 25)):
+		path = '%s/%s.csv' % (directory, kind)
+		write_jhu_csv(path, divisor=divisor, **kwargs)
+		paths.append(path)
+	return tuple(paths)
+
+RSS_DESCRIPTION = ('&lt;p&gt;&lt;img src="https://example.com/image.jpg" /&gt;Ontario is reporting '
+	'468 new cases of COVID-19 and 15 more deaths, according to the province\'s latest figures.&lt;/p&gt;')
+
+def write_rss_feed(path, num_items, outlet='news'):
+	'''
+	Writes an RSS feed with num_items items to path (a file name or a
+	binary file object).
+	'''
+	lines = ['<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel><title>Bench</title>\n']
+	for i in range(num_items):
+		lines.append('<item><title>Story number %d about COVID-19</title>'
+			'<link>https://example.com/%s/%d</link><guid>https://example.com/%s/%d</guid>'
+			'<pubDate>Fri, %d Apr 2020 %02d:%02d:00 EDT</pubDate>'
+			'<description>%s</description></item>\n'
+			% (i, outlet, i, outlet, i, i % 28 + 1, i % 24, i % 60, RSS_DESCRIPTION))
+	lines.append('</channel></rss>\n')
+	body = ''.join(lines).encode('utf-8')
+	if hasattr(path, 'write'):
+		path.write(body)
+	else:
+		with open(path, 'wb') as f:
+			f.write(body)
+
+class StubElasticsearch():
+	'''
+	Stand-in for the Elasticsearch client, enough for search.search_page
+	and bucket_to_elasticsearch.index_news: canned search hits, every bulk
+	action accepted, no aliases. Measures the client side cost only.
+	'''
+	def __init__(self, hits=()):
+		from elasticsearch.serializer import JSONSerializer
+		self.hits = list(hits)
+		self.indices = _StubIndices()
+		self.transport = _StubTransport(JSONSerializer())
+		self.bulk_actions = 0
+
+	def search(self, index=None, body=None, **kwargs):
+		size = (body or {}).get('size', len(self.hits))
+		return {'hits': {'hits': [dict(hit, _source=dict(hit['_source'])) for hit in self.hits[:size]]}}
+
+	def mget(self, body=None, **kwargs):
+		return {'docs': [dict(doc, found=True, _source={'description': ''}) for doc in body['docs']]}
+
+	def get(self, index=None, id=None, **kwargs):
+		return {'found': False}
+
+	def bulk(self, *args, body=None, **kwargs):
+		lines = body.splitlines()
+		items = []
+		for line in lines[::2]:
+			action = json.loads(line)
+			op_type, meta = action.popitem()
+			items.append({op_type: {'_id': meta.get('_id'), '_index': meta.get('_index'), 'status': 201}})
+		self.bulk_actions += len(items)
+		return {'took': 0, 'errors': False, 'items': items}
+
+class _StubTransport():
+	def __init__(self, serializer):
+		self.serializer = serializer # parallel_bulk serializes the actions with it
+
+class _StubIndices():
+	def exists_alias(self, name=None, **kwargs):
+		return False
+
+def search_hits(num_hits):
+	'''
+	Search hits shaped like the news index returns them.
+	'''
+	return [{
+		'_index': 'news-000001',
+		'_id': '%032x' % i,
+		'_score': 1.0,
+		'sort': [1.0, 1586000000000 - i, 'https://example.com/news/%d' % i],
+		'_source': {
+			'title': 'Story number %d about COVID-19' % i,
+			'link': 'https://example.com/news/%d' % i,
+			'pubDate': '2020/04/05 10:00:00',
+			'description_text': 'Ontario is reporting 468 new cases of COVID-19 and 15 more deaths.'}}
+		for i in range(num_hits)]
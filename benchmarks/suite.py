@@ -0,0 +1,313 @@
+'''
+	Benchmark suite for the hot paths of simulation, search and ingestion.
+
+	Runs on fixture data and local stand-ins only, no network access or
+	Elasticsearch needed: fixture JHU CSVs and RSS feeds (fixtures.py),
+	S3 mocked with moto and fixtures.StubElasticsearch in place of the
+	Elasticsearch client (so the search and indexing cases measure the
+	client side work).
+
+	Every case reports the median and best time per call. Save a run with
+	--save, then compare a later run against it with --compare: any case
+	slower than the saved median by more than --tolerance is reported and
+	the suite exits with status 1.
+
+	The ingestion cases import rss_to_bucket and bucket_to_elasticsearch,
+	which need settings.py, and moto. Without them they are skipped.
+
+	Usage:
+		python benchmarks/suite.py [--filter seir] [--save baseline.json]
+		python benchmarks/suite.py --compare baseline.json [--tolerance 0.25]
+'''
+from io import BytesIO
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, ROOT)
+
+from fixtures import write_jhu_files, write_rss_feed, StubElasticsearch, search_hits, RSS_DESCRIPTION
+
+NUM_COUNTRIES = 190
+NUM_DAYS = 500
+TIME_STEPS = 365
+START_DATE = datetime(2020, 4, 5)
+VALUE_VARS = ['Exposed', 'Infected', 'Hospitalized', 'Total Deaths']
+FEED_ITEMS = 1000
+OUTLETS = ['thestar', 'cbc', 'ctv']
+
+CASES = [] # (group, name, repeat, setup), setup returns the function to time
+
+def case(group, repeat=20):
+	def register(setup):
+		CASES.append((group, setup.__name__, repeat, setup))
+		return setup
+	return register
+
+# Simulation
+
+@case('simulation', repeat=5)
+def jhu_load(env):
+	import func
+	return lambda: func.get_covid_data(sources=env['sources'])
+
+@case('simulation')
+def seir(env):
+	import func
+	params = (2.65, 7, 21, TIME_STEPS)
+	return lambda: func.base_seir_model(params, TIME_STEPS, env['historical_df'], START_DATE, jsonify=False)
+
+@case('simulation')
+def plot_plotly(env):
+	import func
+	return lambda: func._results_plot(env['results_df'], VALUE_VARS)
+
+@case('simulation')
+def plot_compact(env):
+	import func
+	series = {name: env['results_df'][name] for name in VALUE_VARS}
+	return lambda: func.compact_series(START_DATE, series)
+
+@case('simulation', repeat=10)
+def sweep_1000(env):
+	import func
+	param_sets = func.parameter_grid([1.5 + i / 5 for i in range(10)], range(3, 13), range(10, 20))
+	return lambda: func.parameter_sweep(param_sets, env['historical_df'], start_date='2020-04-05')
+
+@case('simulation', repeat=5)
+def ensemble_1000(env):
+	import func
+	params = (2.65, 7, 21, TIME_STEPS)
+	return lambda: func.ensemble_seir_model(params, TIME_STEPS, env['historical_df'], START_DATE, members=1000)
+
+@case('simulation')
+def request_simulation(env):
+	import app
+	client = app.app.test_client()
+	client.get('/ready')
+	app.load_simulation()
+
+	def request():
+		app.plot_cache.clear()
+		response = client.post('/simulation', data={'btn': 'simulate_btn', 'format': 'compact'})
+		assert response.status_code == 200, response.status_code
+	return request
+
+# Search
+
+@case('search', repeat=50)
+def search_page(env):
+	import search
+	search._client = StubElasticsearch(search_hits(50))
+
+	def request():
+		search.search_cache.clear()
+		search.search_page('covid ontario', 50, sort_by='date', outlet='cbc')
+	return request
+
+@case('search', repeat=50)
+def request_search(env):
+	import app
+	import search
+	search._client = StubElasticsearch(search_hits(10))
+	client = app.app.test_client()
+
+	def request():
+		search.search_cache.clear()
+		response = client.get('/search?search=covid&sort_by=date')
+		assert response.status_code == 200, response.status_code
+	return request
+
+# Ingestion
+
+@case('ingestion')
+def rss_parse(env):
+	from rss_parser import iter_items
+	return lambda: list(iter_items(BytesIO(env['feed'])))
+
+@case('ingestion')
+def clean_text(env):
+	from bucket_to_elasticsearch import clean_text
+	descriptions = ['<p>%s <b>%d</b></p>' % (RSS_DESCRIPTION, i) for i in range(200)]
+	return lambda: [clean_text(description) for description in descriptions]
+
+@case('ingestion', repeat=10)
+def rss_to_bucket(env):
+	import rss_to_bucket
+	s3 = env['s3']
+	feeds = [('https://example.com/%s.xml' % outlet, outlet) for outlet in OUTLETS]
+	session = StubSession(env['feed'])
+
+	def run():
+		# Forget the articles seen by the previous run so every run uploads them again
+		s3.delete_object(Bucket=env['bucket'], Key=rss_to_bucket.SEEN_KEY)
+		rss_to_bucket.rss_to_bucket(feeds, s3, session=session, date='2020-04-05')
+	return run
+
+@case('ingestion', repeat=10)
+def archive_read(env):
+	from news_archive import Manifest, read_items
+	s3 = env['s3']
+	manifest = Manifest(s3, env['bucket']).load()
+	return lambda: list(read_items(s3, env['bucket'], '2020-04-05-cbc', manifest))
+
+@case('ingestion', repeat=10)
+def index_news(env):
+	from bucket_to_elasticsearch import index_news
+	from rss_parser import iter_items
+	items = list(iter_items(BytesIO(env['feed'])))
+	return lambda: index_news(StubElasticsearch(), items, 'bench-news', outlet='cbc')
+
+class StubSession():
+	'''
+	Stand-in for the requests session of rss_to_bucket, serving one feed body.
+	'''
+	def __init__(self, body):
+		self.body = body
+
+	def get(self, url, **kwargs):
+		return StubResponse(self.body)
+
+class StubResponse():
+	status_code = 200
+	headers = {}
+
+	def __init__(self, body):
+		self.raw = BytesIO(body)
+
+	def raise_for_status(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+def create_env(directory, groups):
+	'''
+	Writes the fixtures and points the app at them. Returns the shared
+	state handed to every setup function.
+	'''
+	env = {}
+	env['sources'] = write_jhu_files(directory, num_countries=NUM_COUNTRIES, num_days=NUM_DAYS)
+	for variable, source in zip(('JHU_CONFIRMED_URL', 'JHU_RECOVERED_URL', 'JHU_DEATHS_URL'), env['sources']):
+		os.environ[variable] = source
+	os.environ['COVID_DATA_DIR'] = os.path.join(directory, 'cache')
+	os.environ['WARMUP'] = '0'
+	os.environ['TIMING_LOG_LEVEL'] = 'WARNING' # no log line per request
+	os.environ.setdefault('ES_URL', 'http://localhost:9200')
+
+	feed = BytesIO()
+	write_rss_feed(feed, FEED_ITEMS)
+	env['feed'] = feed.getvalue()
+
+	if 'simulation' in groups:
+		import func
+		historical_df, _ = func.get_covid_data(sources=env['sources'])
+		env['historical_df'] = historical_df
+		env['results_df'] = func.base_seir_model((2.65, 7, 21, TIME_STEPS), TIME_STEPS, historical_df,
+			START_DATE, jsonify=False)
+	return env
+
+def create_bucket(env):
+	'''
+	Mocked S3 bucket with one day of uploads, for the ingestion cases.
+	'''
+	import boto3
+	import rss_to_bucket
+	os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+	s3 = boto3.client('s3', region_name='us-east-1')
+	s3.create_bucket(Bucket=rss_to_bucket.BUCKET_NAME)
+	env['s3'], env['bucket'] = s3, rss_to_bucket.BUCKET_NAME
+	rss_to_bucket.rss_to_bucket([('https://example.com/cbc.xml', 'cbc')], s3, session=StubSession(env['feed']),
+		date='2020-04-05')
+
+def measure(fn, repeat):
+	fn() # warm up caches and lazy imports
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		times.append(time.perf_counter() - start)
+	return {'median_ms': statistics.median(times) * 1000, 'min_ms': min(times) * 1000, 'calls': repeat}
+
+def run(cases, env):
+	results = {}
+	for group, name, repeat, setup in cases:
+		key = '%s/%s' % (group, name)
+		if env.get(group) is False:
+			print('%-32s skipped' % key)
+			continue
+		results[key] = measure(setup(env), repeat)
+		print('%-32s %12.2f %12.2f %8d' % (key, results[key]['median_ms'], results[key]['min_ms'], repeat))
+	return results
+
+def compare(results, baseline, tolerance):
+	'''
+	Prints the cases slower than baseline by more than tolerance and
+	returns how many there are.
+	'''
+	regressions = 0
+	print('\n%-32s %12s %12s %8s' % ('case', 'baseline ms', 'median ms', 'ratio'))
+	for key, result in results.items():
+		if key not in baseline:
+			continue
+		ratio = result['median_ms'] / baseline[key]['median_ms']
+		flag = ''
+		if ratio > 1 + tolerance:
+			regressions += 1
+			flag = '  REGRESSION'
+		print('%-32s %12.2f %12.2f %8.2f%s' % (key, baseline[key]['median_ms'], result['median_ms'], ratio, flag))
+	return regressions
+
+def main(argv=None):
+	args = parse_args(argv)
+	cases = [c for c in CASES if not args.filter or args.filter in '%s/%s' % (c[0], c[1])]
+	groups = set(c[0] for c in cases)
+
+	with tempfile.TemporaryDirectory() as directory:
+		env = create_env(directory, groups)
+		print('%-32s %12s %12s %8s' % ('case', 'median ms', 'min ms', 'calls'))
+		if 'ingestion' in groups:
+			try:
+				from moto import mock_aws
+				import rss_to_bucket, bucket_to_elasticsearch
+			except ImportError as e:
+				print('ingestion cases need moto and settings.py: %s' % e)
+				env['ingestion'] = False
+				results = run(cases, env)
+			else:
+				with mock_aws():
+					create_bucket(env)
+					results = run(cases, env)
+		else:
+			results = run(cases, env)
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		if compare(results, baseline, args.tolerance):
+			sys.exit(1)
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark the hot paths on fixture data')
+	parser.add_argument('--filter', help='only cases whose group/name contains this')
+	parser.add_argument('--save', help='write the results to this JSON file')
+	parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 for 25%%')
+	return parser.parse_args(argv)
+
+if __name__ == '__main__':
+	main()
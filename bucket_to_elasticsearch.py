@@ -2,111 +2,513 @@
 	Get Data from S3 and put into ElasticSearch
 '''
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import parallel_bulk
 from settings import BUCKET_NAME, NEWS_OUTLETS
 import boto3
+from bs4 import BeautifulSoup
 import pdb
 from time import gmtime, strftime
 import json
 import hashlib
 import os
+import argparse
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from contextlib import contextmanager
+from article_state import SeenArticles, link_hash
+from news_archive import Manifest, read_items
 
-def main():
-	date = strftime("%Y-%m-%d", gmtime())
-	index_names = [date + '-' + name for name in NEWS_OUTLETS]
+# Holds the generation counter app/search.py uses to invalidate cached results
+NEWS_META_INDEX = 'news-meta'
+
+# Articles already indexed, only new or changed ones are sent to Elasticsearch
+SEEN_KEY = '_state/indexed.json'
+
+# Articles that failed to index, retried by the next run before the day's
+# objects and dropped as lost after MAX_INDEX_ATTEMPTS runs
+RETRY_KEY = '_state/retry.ndjson'
+MAX_INDEX_ATTEMPTS = 5
+
+# Articles are written through WRITE_ALIAS into rolling news-articles-NNNNNN
+# indices and searched through READ_ALIAS, which covers all of them.
+READ_ALIAS = 'news'
+WRITE_ALIAS = 'news-write'
+INDEX_PREFIX = 'news-articles-'
+INDEX_TEMPLATE = 'news-articles'
+ROLLOVER_CONDITIONS = {'max_age': '30d', 'max_docs': 5000000, 'max_size': '20gb'}
+
+# Bulk loading, see index_news
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500)) # documents per request
+BULK_THREADS = int(os.environ.get('BULK_THREADS', 4)) # requests in flight
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', 10*1024*1024)) # bytes per request
+
+# Layout used before the aliases, e.g. 2020-04-05-cbc
+DAILY_INDEX_PATTERN = '20*-*'
+
+# Objects written by rss_to_bucket, e.g. 2020-04-05-cbc.ndjson.gz
+OBJECT_KEY = re.compile(r'^(\d{4}-\d{2}-\d{2})-(.+?)\.(?:ndjson|ndjson\.gz|ndjson\.zst|json)$')
+
+# Backfill progress, one object per date range (see backfill)
+BACKFILL_KEY = '_state/backfill-%s-%s.json'
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', 8)) # concurrent S3 downloads
+
+# Set to e.g. http://localhost:9000 to use MinIO instead of S3
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+def main(argv=None):
+	args = parse_args(argv)
 	es = Elasticsearch(os.environ['ES_URL'])
 	# es = Elasticsearch()
 
-	for index_name in index_names:
-		data = get_data_from_s3(index_name)
-		create_index(es, index_name)
-		index_news(es, data, index_name)
+	if args.command == 'backfill':
+		bulk_options = dict(chunk_size=args.chunk_size, thread_count=args.threads, max_chunk_bytes=args.max_chunk_bytes)
+		indexed, failed = backfill(es, args.start, args.end, args.workers, args.restart, **bulk_options)
+		print('Backfilled %d objects from %s to %s, %d failed' % (len(indexed), args.start, args.end, len(failed)))
+	elif args.command == 'compact':
+		setup_index_layout(es)
+		merged = compact_daily_indices(es, args.pattern, args.delete)
+		bump_generation(es)
+		print('Merged %d daily indices into %s' % (len(merged), WRITE_ALIAS))
+	else:
+		index_today(es, chunk_size=args.chunk_size, thread_count=args.threads, max_chunk_bytes=args.max_chunk_bytes)
+
+def index_today(es, **bulk_options):
+	date = strftime("%Y-%m-%d", gmtime())
+	object_names = [date + '-' + name for name in NEWS_OUTLETS]
+	setup_index_layout(es)
+	s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+	seen = SeenArticles(s3, BUCKET_NAME, SEEN_KEY).load()
+	manifest = Manifest(s3, BUCKET_NAME).load()
+	retries = load_retries(s3)
+	failed = {} # link hash -> retry entry
+
+	with bulk_load(es, WRITE_ALIAS):
+		# Articles that failed in earlier runs first, rss_to_bucket won't upload them again
+		for outlet in sorted(set(entry['outlet'] for entry in retries.values())):
+			entries = [entry for entry in retries.values() if entry['outlet'] == outlet]
+			for item in index_delta(es, 'retry-' + outlet, outlet, [entry['item'] for entry in entries],
+					seen, date, bulk_options):
+				attempts = retries[link_hash(item['link'])]['attempts'] + 1
+				if attempts < MAX_INDEX_ATTEMPTS:
+					failed[link_hash(item['link'])] = {'outlet': outlet, 'item': item, 'attempts': attempts}
+				else:
+					print('  lost %s after %d attempts' % (item['link'], attempts))
+
+		for object_name in object_names:
+			data = iter_data_from_s3(object_name, s3, manifest)
+			if data is None:
+				print('%s: no new articles uploaded' % object_name)
+				continue
+
+			# Skip what the retries just sent, e.g. when running twice on the same day
+			data = (item for item in data if link_hash(item['link']) not in retries)
+			outlet = outlet_of(object_name)
+			for item in index_delta(es, object_name, outlet, data, seen, date, bulk_options):
+				failed[link_hash(item['link'])] = {'outlet': outlet, 'item': item, 'attempts': 1}
+
+	save_retries(s3, failed)
+	seen.save(date)
+	rollover(es)
+	bump_generation(es)
+
+def index_delta(es, name, outlet, data, seen, date, bulk_options):
+	'''
+	Indexes the new or changed articles of data and marks them as seen.
+	Returns the items that failed, which stay unseen.
+	'''
+	start = time.perf_counter()
+	pending, counts, sent = {}, {'new': 0, 'updated': 0, 'skipped': 0}, {}
+
+	def remember(items):
+		for item in items:
+			sent[link_hash(item['link'])] = item
+			yield item
 
-def index_news(es, data, index_name):
+	_, failures = index_news(es, remember(seen.iter_delta(data, pending, counts)), WRITE_ALIAS,
+		outlet=outlet, **bulk_options)
+	for failure in failures:
+		pending.pop(failure['_id'], None)
+	seen.commit(pending, date)
+
+	print('%s: %d new, %d updated, %d skipped, %d failed in %.2fs' % (name,
+		counts['new'], counts['updated'], counts['skipped'], len(failures), time.perf_counter() - start))
+	report_failures(failures)
+	return [sent[failure['_id']] for failure in failures if failure['_id'] in sent]
+
+def load_retries(s3):
+	'''
+	Returns the articles left to retry, {link hash: {'outlet', 'item', 'attempts'}}.
+	'''
+	try:
+		obj = s3.get_object(Bucket=BUCKET_NAME, Key=RETRY_KEY)
+	except s3.exceptions.NoSuchKey:
+		return {}
+	entries = (json.loads(line) for line in obj['Body'].iter_lines() if line.strip())
+	return {link_hash(entry['item']['link']): entry for entry in entries}
+
+def save_retries(s3, retries):
+	if not retries:
+		s3.delete_object(Bucket=BUCKET_NAME, Key=RETRY_KEY)
+		return
+	body = ''.join(json.dumps(entry) + '\n' for entry in retries.values())
+	s3.put_object(Bucket=BUCKET_NAME, Key=RETRY_KEY, Body=body.encode('utf-8'), ContentType='application/x-ndjson')
+
+def bump_generation(es):
+	'''
+	Increments the news generation counter so every search result cache
+	drops results cached before this run.
+	'''
+	es.update(index=NEWS_META_INDEX, id='generation', refresh=True, body={
+		'script': {'source': 'ctx._source.value += 1', 'lang': 'painless'},
+		'upsert': {'value': 1}})
+
+def index_news(es, data, index_name, outlet=None, chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREADS,
+			max_chunk_bytes=BULK_MAX_BYTES):
+	'''
+	Streams data (any iterable of items) into index_name (normally
+	WRITE_ALIAS) with parallel_bulk, tagged with outlet (e.g. 'cbc') for
+	the search filter. Documents that fail are reported instead of aborting
+	the load.
+
+	Earlier copies of the indexed articles in older rolled over indices are
+	deleted afterwards, so an updated article is not returned twice.
+
+	Returns (number indexed, list of failures with _id, status and error).
+	'''
+	ids = []
 	def gen_data():
 		for news in data:
+			_id = hashlib.md5(news['link'].encode('utf-8')).hexdigest() #Hash url and use as primary key
+			ids.append(_id)
 			body = {
 				"_op_type": "index",
 				"_index": index_name,
-				"_id": hashlib.md5(news['link'].encode('utf-8')).hexdigest(), #Hash url and use as primary key
+				"_id": _id,
 				"_source": {
 					'guid': news['guid'],
 					'title': news['title'],
 					'link': news['link'],
 					'pubDate': news['pubDate'],
-					'description': news['description']
+					'description': news['description'],
+					'description_text': clean_text(news['description']),
+					'outlet': outlet
 				}
 			}
 			yield body
-	bulk(es, gen_data())
-
-def create_index(es, index_name):
-	if not es.indices.exists(index = index_name):
-		es.indices.create(
-				index=index_name,
-				body={
-					'mappings': {
-						'properties': {
-							'description': {
-								'type':'text',
-								'analyzer': 'index_analyzer', 
-								'fields': {
-									'keyword': {'type': 'keyword', 'ignore_above': 256}
-								}
-							},
-							'pubDate':{'type': 'date', "format": "yyyy/MM/dd HH:mm:ss"},
-							'link':{
-								'type': 'text', 
-								'fields': {
-									'keyword': {'type': 'keyword', 'ignore_above': 256}
-								}
-							},
-							'title':{
-								'type': 'text', 
-								'fields': {
-									'keyword': {'type': 'keyword', 'ignore_above': 256}
-								}
-							},
-							'guid':{
-								'type': 'text', 
-								'fields': {
-									'keyword': {'type': 'keyword', 'ignore_above': 256}
-								}
-							},
-						}
-					},
-					'settings': {
-						'analysis': {
-							'analyzer': {
-								'index_analyzer': {
-									'type': 'custom',
-									'tokenizer': 'standard',
-									'char_filter': ['html_strip']
-								},
-								'query_analyzer': {
-										'type': 'custom',
-										'tokenizer': 'standard',
-										'filter': ['lowercase', 'english_stop']
-								}
-							},
-							'filter': {
-								'english_stop': {
-									'type': 'stop',
-									'stopwords': '_english_'
-								}
-							}
-						}
-					},
+
+	indexed, failures = 0, []
+	results = parallel_bulk(es, gen_data(),
+		thread_count=thread_count,
+		chunk_size=chunk_size,
+		max_chunk_bytes=max_chunk_bytes,
+		raise_on_error=False,
+		raise_on_exception=False)
+
+	for ok, result in results:
+		_, info = result.popitem()
+		if ok:
+			indexed += 1
+		else:
+			failures.append({'_id': info.get('_id'),
+				'status': info.get('status'),
+				'error': info.get('error')})
+
+	failed = set(failure['_id'] for failure in failures)
+	delete_older_copies(es, [_id for _id in ids if _id not in failed], index_name)
+	return indexed, failures
+
+def delete_older_copies(es, ids, index_name, batch_size=10000):
+	if not ids or not es.indices.exists_alias(name=READ_ALIAS):
+		return
+
+	write_index = get_write_index(es, index_name)
+	for i in range(0, len(ids), batch_size):
+		es.delete_by_query(index=READ_ALIAS, conflicts='proceed', body={
+			'query': {
+				'bool': {
+					'filter': [{'ids': {'values': ids[i:i+batch_size]}}],
+					'must_not': [{'term': {'_index': write_index}}]
+				}
+			}
+		})
+
+def get_write_index(es, index_name):
+	'''
+	Resolves an alias to the concrete index it writes to.
+	'''
+	if not es.indices.exists_alias(name=index_name):
+		return index_name
+
+	aliases = es.indices.get_alias(name=index_name)
+	for concrete_index, info in aliases.items():
+		if info['aliases'][index_name].get('is_write_index', len(aliases) == 1):
+			return concrete_index
+	raise ValueError('Alias %s has no write index' % index_name)
+
+@contextmanager
+def bulk_load(es, index_name):
+	'''
+	Disables refresh and replicas on the index behind index_name for the
+	duration of a bulk load, then restores the previous settings.
+	'''
+	write_index = get_write_index(es, index_name)
+	current = es.indices.get_settings(index=write_index, flat_settings=True)[write_index]['settings']
+	previous = {
+		'index.refresh_interval': current.get('index.refresh_interval'), # None restores the default
+		'index.number_of_replicas': current.get('index.number_of_replicas')}
+
+	es.indices.put_settings(index=write_index, body={
+		'index.refresh_interval': '-1',
+		'index.number_of_replicas': 0})
+	try:
+		yield write_index
+	finally:
+		es.indices.put_settings(index=write_index, body=previous)
+		es.indices.refresh(index=write_index)
+
+def report_failures(failures, limit=10):
+	for failure in failures[:limit]:
+		print('  failed %s (%s): %s' % (failure['_id'], failure['status'], failure['error']))
+	if len(failures) > limit:
+		print('  ... and %d more' % (len(failures) - limit))
+
+def clean_text(text):
+	'''
+	Strips html from a description once at ingestion, so search requests
+	don't have to parse it.
+	'''
+	return BeautifulSoup(text, features='lxml').get_text()
+
+# Mapping and analysis settings shared by every news index
+INDEX_BODY = {
+	'mappings': {
+		'properties': {
+			'description': {
+				'type':'text',
+				'analyzer': 'index_analyzer', 
+				'fields': {
+					'keyword': {'type': 'keyword', 'ignore_above': 256}
+				}
+			},
+			'description_text': {'type': 'text'},
+			'outlet': {'type': 'keyword'},
+			'pubDate':{'type': 'date', "format": "yyyy/MM/dd HH:mm:ss"},
+			'link':{
+				'type': 'text', 
+				'fields': {
+					'keyword': {'type': 'keyword', 'ignore_above': 256}
+				}
+			},
+			'title':{
+				'type': 'text', 
+				'fields': {
+					'keyword': {'type': 'keyword', 'ignore_above': 256}
+				}
+			},
+			'guid':{
+				'type': 'text', 
+				'fields': {
+					'keyword': {'type': 'keyword', 'ignore_above': 256}
+				}
+			},
+		}
+	},
+	'settings': {
+		'analysis': {
+			'analyzer': {
+				'index_analyzer': {
+					'type': 'custom',
+					'tokenizer': 'standard',
+					'char_filter': ['html_strip']
 				},
-			)
-
-def get_data_from_s3(index_name):
-	s3 = boto3.resource('s3')
-	bucket = s3.Bucket(BUCKET_NAME)
-	obj = s3.Object(BUCKET_NAME,index_name + '.json')
-	data = obj.get()['Body'].read().decode('utf-8')
-	data = json.loads(data)
-	return data['items']
+				'query_analyzer': {
+						'type': 'custom',
+						'tokenizer': 'standard',
+						'filter': ['lowercase', 'english_stop']
+				}
+			},
+			'filter': {
+				'english_stop': {
+					'type': 'stop',
+					'stopwords': '_english_'
+				}
+			}
+		}
+	},
+}
+
+def setup_index_layout(es):
+	'''
+	Creates the index template and, on first run, the first rolling index
+	behind the read and write aliases.
+
+	Every news-articles-* index gets INDEX_BODY and joins READ_ALIAS
+	through the template; WRITE_ALIAS points at the newest one.
+	'''
+	es.indices.put_template(name=INDEX_TEMPLATE, body=dict(INDEX_BODY,
+		index_patterns=[INDEX_PREFIX + '*'],
+		aliases={READ_ALIAS: {}}))
+
+	if not es.indices.exists_alias(name=WRITE_ALIAS):
+		es.indices.create(index=INDEX_PREFIX + '000001', body={
+			'aliases': {WRITE_ALIAS: {'is_write_index': True}}})
+	else:
+		# Fields added to INDEX_BODY since the existing indices were created
+		es.indices.put_mapping(index=READ_ALIAS, body=INDEX_BODY['mappings'])
+
+def rollover(es, conditions=ROLLOVER_CONDITIONS):
+	'''
+	Starts a new index behind WRITE_ALIAS once the current one is a month
+	old or large, so no single index grows without bound.
+	'''
+	return es.indices.rollover(alias=WRITE_ALIAS, body={'conditions': conditions})
+
+def compact_daily_indices(es, pattern=DAILY_INDEX_PATTERN, delete=False):
+	'''
+	Reindexes the old one-index-per-outlet-per-day indices into WRITE_ALIAS.
+	Documents keep their md5(link) _id, so an article indexed on several
+	days ends up as one document. With delete=True the daily indices are
+	removed afterwards.
+	'''
+	daily_indices = sorted(es.indices.get(index=pattern, expand_wildcards='open'))
+	if not daily_indices:
+		return []
+
+	es.reindex(body={
+		'source': {'index': daily_indices},
+		'dest': {'index': WRITE_ALIAS, 'op_type': 'index'},
+		'script': {'source': 'ctx._source.outlet = ctx._index.substring(11)', 'lang': 'painless'}}, # e.g. 2020-04-05-cbc
+		wait_for_completion=True, refresh=True, request_timeout=3600)
+
+	if delete:
+		for index_name in daily_indices:
+			es.indices.delete(index=index_name)
+	return daily_indices
+
+def backfill(es, start, end, workers=BACKFILL_WORKERS, restart=False, s3=None, **bulk_options):
+	'''
+	Indexes every object rss_to_bucket wrote between start and end
+	(YYYY-MM-DD, inclusive), e.g. after a missed run or a mapping change.
+
+	Objects are downloaded by a pool of workers, at most 2 * workers ahead
+	of the indexer. Each indexed object is recorded in a checkpoint in the
+	bucket, so running the same range again after an interruption resumes
+	where it stopped. Objects with failed documents are left out of the
+	checkpoint and retried next time. The checkpoint is removed once the
+	whole range is indexed.
+
+	Returns (indexed object names, failed object names).
+	'''
+	s3 = s3 or boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+	checkpoint_key = BACKFILL_KEY % (start, end)
+	done = set() if restart else load_checkpoint(s3, checkpoint_key)
+	manifest = Manifest(s3, BUCKET_NAME).load()
+	# Compacted objects are only in the manifest, older ones only in the listing
+	names = sorted(set(manifest.names(start, end)) | set(list_object_names(s3, start, end)))
+	todo = [name for name in names if name not in done]
+	print('%d objects to index, %d already done' % (len(todo), len(done)))
+
+	setup_index_layout(es)
+	indexed, failed = [], []
+
+	def download(object_name):
+		return list(iter_data_from_s3(object_name, s3, manifest) or [])
+
+	with ThreadPoolExecutor(max_workers=workers) as pool, bulk_load(es, WRITE_ALIAS):
+		futures = [(name, pool.submit(download, name)) for name in todo[:2 * workers]]
+		queued = len(futures)
+		while futures:
+			object_name, future = futures.pop(0)
+			if queued < len(todo):
+				futures.append((todo[queued], pool.submit(download, todo[queued])))
+				queued += 1
+
+			data = future.result()
+			start = time.perf_counter()
+			count, failures = index_news(es, data, WRITE_ALIAS,
+				outlet=outlet_of(object_name), **bulk_options)
+			print('%s: %d indexed, %d failed in %.2fs' % (object_name, count, len(failures), time.perf_counter() - start))
+			report_failures(failures)
+			if failures:
+				failed.append(object_name)
+				continue
+
+			indexed.append(object_name)
+			done.add(object_name)
+			save_checkpoint(s3, checkpoint_key, done)
+
+	if not failed:
+		s3.delete_object(Bucket=BUCKET_NAME, Key=checkpoint_key)
+	rollover(es)
+	bump_generation(es)
+	return indexed, failed
+
+def outlet_of(object_name):
+	return object_name[len('YYYY-MM-DD-'):]
+
+def list_object_names(s3, start, end):
+	'''
+	Lists the objects written between start and end, paginated, as
+	<date>-<outlet> names in date order. Keys start with the date, so the
+	listing starts at start and stops after end instead of reading the
+	whole bucket.
+	'''
+	names, listed = [], set()
+	paginator = s3.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=BUCKET_NAME, StartAfter=start):
+		for obj in page.get('Contents', []):
+			match = OBJECT_KEY.match(obj['Key'])
+			if not match:
+				continue # _state/ and anything else that isn't a feed
+			if match.group(1) > end:
+				return names
+			name = match.group(1) + '-' + match.group(2)
+			if name not in listed: # .json and .ndjson of the same day
+				listed.add(name)
+				names.append(name)
+	return names
+
+def load_checkpoint(s3, key):
+	try:
+		obj = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+	except s3.exceptions.NoSuchKey:
+		return set()
+	return set(json.loads(obj['Body'].read().decode('utf-8'))['done'])
+
+def save_checkpoint(s3, key, done):
+	s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=json.dumps({'done': sorted(done)}))
+
+def iter_data_from_s3(object_name, s3=None, manifest=None):
+	'''
+	Returns an iterator over the items stored for object_name, in any of the
+	formats of news_archive (found through the manifest when given), decoded
+	line by line. Returns None when rss_to_bucket didn't write an object (no
+	new or changed articles that day).
+	'''
+	s3 = s3 or boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+	return read_items(s3, BUCKET_NAME, object_name, manifest)
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE, help='documents per bulk request')
+	parser.add_argument('--threads', type=int, default=BULK_THREADS, help='bulk requests in flight')
+	parser.add_argument('--max-chunk-bytes', type=int, default=BULK_MAX_BYTES, help='bytes per bulk request')
+	subparsers = parser.add_subparsers(dest='command')
+	subparsers.add_parser('index', help="index today's articles (default)")
+	backfill = subparsers.add_parser('backfill', help='index every object in the bucket between two dates')
+	backfill.add_argument('--start', required=True, type=parse_date, help='first date, YYYY-MM-DD')
+	backfill.add_argument('--end', default=strftime("%Y-%m-%d", gmtime()), type=parse_date, help='last date, YYYY-MM-DD (default today)')
+	backfill.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help='objects downloaded at once')
+	backfill.add_argument('--restart', action='store_true', help='ignore the checkpoint of an earlier run')
+	compact = subparsers.add_parser('compact', help='merge the old daily indices into the rolling indices')
+	compact.add_argument('--pattern', default=DAILY_INDEX_PATTERN)
+	compact.add_argument('--delete', action='store_true', help='delete the daily indices once merged')
+	return parser.parse_args(argv)
+
+def parse_date(value):
+	return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,239 @@
+'''
+	Storage format of the articles in the news bucket.
+
+	rss_to_bucket writes one object per outlet per day, <date>-<outlet> plus
+	the suffix of ARCHIVE_FORMAT:
+		ndjson - .ndjson, one JSON item per line
+		gzip - .ndjson.gz
+		zstd - .ndjson.zst (needs the zstandard package)
+	Objects written before this module, <date>-<outlet>.json holding
+	{'items': [...]}, are still read.
+
+	compact_month merges a month of daily objects into
+	archive/<YYYY-MM>.ndjson.<gz|zst>, one compressed member / frame per daily
+	object, so a reader can fetch a single day with a ranged GET or the whole
+	month with one GET. It can also write archive/<YYYY-MM>.parquet (needs
+	pandas and pyarrow) for analysis.
+
+	The manifest (MANIFEST_KEY) maps every object name to the key, byte range
+	and item count holding it, so readers don't have to list the bucket:
+		{'objects': {'2020-04-05-cbc': {'key': ..., 'offset': ..., 'length': ..., 'count': ...}},
+		 'months': {'2020-04': {'key': ..., 'parquet': ...}}}
+
+	Usage:
+		python news_archive.py compact 2020-04 [--parquet] [--delete]
+'''
+from io import BytesIO, BufferedReader
+import argparse
+import gzip
+import json
+import os
+import threading
+
+MANIFEST_KEY = '_state/manifest.json'
+ARCHIVE_PREFIX = 'archive/'
+ARCHIVE_FORMAT = os.environ.get('ARCHIVE_FORMAT', 'gzip')
+
+SUFFIXES = {'ndjson': '.ndjson', 'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+
+# Suffixes tried, in order, for objects that aren't in the manifest
+READ_SUFFIXES = ('.ndjson.gz', '.ndjson.zst', '.ndjson', '.json')
+
+def encode_items(items, archive_format=ARCHIVE_FORMAT):
+	'''
+	Returns (suffix, body) of items in archive_format.
+	'''
+	body = ''.join(json.dumps(item) + '\n' for item in items).encode('utf-8')
+	suffix = SUFFIXES[archive_format]
+	return suffix, compress(body, suffix)
+
+def compress(body, suffix):
+	if suffix.endswith('.gz'):
+		return gzip.compress(body, mtime=0)
+	if suffix.endswith('.zst'):
+		import zstandard
+		return zstandard.ZstdCompressor().compress(body)
+	return body
+
+def iter_lines(stream, key):
+	'''
+	Yields the lines of a (possibly compressed) NDJSON file object, decoding
+	as it reads.
+	'''
+	if key.endswith('.gz'):
+		stream = gzip.GzipFile(fileobj=stream)
+	elif key.endswith('.zst'):
+		import zstandard
+		stream = BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True))
+	else:
+		stream = stream.iter_lines() # botocore StreamingBody
+	for line in stream:
+		if line.strip():
+			yield line
+
+def read_items(s3, bucket, object_name, manifest=None):
+	'''
+	Returns an iterator over the items of object_name, looked up in the
+	manifest first, then under each of READ_SUFFIXES. Returns None when
+	there is no such object.
+	'''
+	entry = manifest.get(object_name) if manifest is not None else None
+	if entry is not None:
+		return _read_entry(s3, bucket, entry)
+
+	for suffix in READ_SUFFIXES:
+		try:
+			obj = s3.get_object(Bucket=bucket, Key=object_name + suffix)
+		except s3.exceptions.NoSuchKey:
+			continue
+
+		if suffix == '.json':
+			return iter(json.loads(obj['Body'].read().decode('utf-8'))['items'])
+		return (json.loads(line) for line in iter_lines(obj['Body'], suffix))
+	return None
+
+def _read_entry(s3, bucket, entry):
+	kwargs = {}
+	if entry.get('offset') is not None:
+		kwargs['Range'] = 'bytes=%d-%d' % (entry['offset'], entry['offset'] + entry['length'] - 1)
+	obj = s3.get_object(Bucket=bucket, Key=entry['key'], **kwargs)
+	if entry['key'].endswith('.json'):
+		return iter(json.loads(obj['Body'].read().decode('utf-8'))['items'])
+	return (json.loads(line) for line in iter_lines(obj['Body'], entry['key']))
+
+class Manifest():
+	'''
+	The manifest kept at MANIFEST_KEY. Safe to update from several threads,
+	written back with save().
+	'''
+	def __init__(self, s3, bucket, key=MANIFEST_KEY):
+		self.s3 = s3
+		self.bucket = bucket
+		self.key = key
+		self._lock = threading.Lock()
+		self._data = {'objects': {}, 'months': {}}
+
+	def load(self):
+		try:
+			obj = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+		except self.s3.exceptions.NoSuchKey:
+			self._data = {'objects': {}, 'months': {}}
+		else:
+			self._data = json.loads(obj['Body'].read().decode('utf-8'))
+		return self
+
+	def save(self):
+		with self._lock:
+			body = json.dumps(self._data, sort_keys=True)
+		self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body)
+
+	def get(self, object_name):
+		with self._lock:
+			return self._data['objects'].get(object_name)
+
+	def add(self, object_name, key, count, offset=None, length=None):
+		with self._lock:
+			self._data['objects'][object_name] = {'key': key, 'count': count, 'offset': offset, 'length': length}
+
+	def add_month(self, month, key, parquet=None):
+		with self._lock:
+			self._data['months'][month] = {'key': key, 'parquet': parquet}
+
+	def names(self, start, end):
+		'''
+		Object names dated start to end (YYYY-MM-DD, inclusive), sorted.
+		'''
+		with self._lock:
+			return sorted(name for name in self._data['objects'] if start <= name[:10] <= end)
+
+def compact_month(s3, bucket, month, manifest, archive_format=ARCHIVE_FORMAT, parquet=False, delete=False):
+	'''
+	Merges the daily objects of month (YYYY-MM) into one archive object and
+	points their manifest entries at it. With delete=True the daily
+	objects are removed afterwards. Returns the names merged.
+	'''
+	names = sorted(set(manifest.names(month + '-01', month + '-31')) | set(list_daily_objects(s3, bucket, month)))
+	if not names:
+		return []
+
+	suffix = SUFFIXES[archive_format]
+	key = ARCHIVE_PREFIX + month + suffix
+	body, entries, rows, replaced = BytesIO(), {}, [], []
+	for name in names:
+		entry = manifest.get(name)
+		if entry is not None and entry['key'] == key:
+			data = list(_read_entry(s3, bucket, entry)) # already compacted, e.g. a rerun
+		else:
+			data = list(read_items(s3, bucket, name, manifest) or [])
+			replaced.append(name)
+
+		member = compress(''.join(json.dumps(item) + '\n' for item in data).encode('utf-8'), suffix)
+		entries[name] = (body.tell(), len(member), len(data))
+		body.write(member)
+		if parquet:
+			rows += [dict(item, object_name=name) for item in data]
+
+	s3.put_object(Bucket=bucket, Key=key, Body=body.getvalue())
+	parquet_key = write_parquet(s3, bucket, month, rows) if parquet else None
+
+	old_keys = set()
+	for name, (offset, length, count) in entries.items():
+		entry = manifest.get(name)
+		if entry is not None and entry['key'] != key:
+			old_keys.add(entry['key'])
+		manifest.add(name, key, count, offset, length)
+	manifest.add_month(month, key, parquet_key)
+	manifest.save()
+
+	if delete:
+		for name in replaced:
+			for old_suffix in READ_SUFFIXES:
+				old_keys.add(name + old_suffix)
+		for old_key in sorted(old_keys):
+			s3.delete_object(Bucket=bucket, Key=old_key)
+	return names
+
+def list_daily_objects(s3, bucket, month):
+	'''
+	Names of the daily objects of month still in the bucket, from a listing
+	limited to the month's prefix.
+	'''
+	names = set()
+	paginator = s3.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=bucket, Prefix=month + '-'):
+		for obj in page.get('Contents', []):
+			for suffix in READ_SUFFIXES:
+				if obj['Key'].endswith(suffix):
+					names.add(obj['Key'][:-len(suffix)])
+					break
+	return names
+
+def write_parquet(s3, bucket, month, rows):
+	import pandas as pd
+	key = ARCHIVE_PREFIX + month + '.parquet'
+	body = BytesIO()
+	pd.DataFrame(rows).to_parquet(body, index=False)
+	s3.put_object(Bucket=bucket, Key=key, Body=body.getvalue())
+	return key
+
+def main(argv=None):
+	import boto3
+	from settings import BUCKET_NAME
+	args = parse_args(argv)
+	s3 = boto3.client('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL'))
+	manifest = Manifest(s3, BUCKET_NAME).load()
+	names = compact_month(s3, BUCKET_NAME, args.month, manifest, args.format, args.parquet, args.delete)
+	print('Compacted %d objects into %s%s%s' % (len(names), ARCHIVE_PREFIX, args.month, SUFFIXES[args.format]))
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description='Compact a month of news objects into one archive object')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	compact = subparsers.add_parser('compact')
+	compact.add_argument('month', help='YYYY-MM')
+	compact.add_argument('--format', choices=['gzip', 'zstd', 'ndjson'], default=ARCHIVE_FORMAT)
+	compact.add_argument('--parquet', action='store_true', help='also write archive/<month>.parquet')
+	compact.add_argument('--delete', action='store_true', help='delete the daily objects once compacted')
+	return parser.parse_args(argv)
+
+if __name__ == '__main__':
+	main()
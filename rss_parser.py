@@ -0,0 +1,109 @@
+'''
+	Streaming RSS parser used by rss_to_bucket.
+
+	Items are yielded as soon as their closing tag is read and then cleared,
+	so memory stays bounded by one item instead of the whole feed.
+
+	pubDate is parsed as RFC 822 for every outlet, e.g.
+		CBC - 'Mon, 20 Jan 2020 17:11:33 EST'
+		TheStar - 'Fri, 3 Apr 2020 11:31:00 EDT'
+		CTV - 'Fri, 3 Apr 2020 10:13:00 -0400'
+	and stored in UTC. Items whose pubDate is missing or can't be parsed
+	are logged and skipped, the rest of the feed is still read.
+'''
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import logging
+import re
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+ITEM_FIELDS = ('guid', 'title', 'link', 'pubDate', 'description')
+
+_RFC822 = re.compile(r'^\s*(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{2,4})\s+'
+	r'(\d{1,2}):(\d{2})(?::(\d{2}))?\s*([+-]\d{4}|[A-Za-z]{1,5})?\s*$')
+
+_MONTHS = {name: i + 1 for i, name in
+	enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+
+# RFC 822 zone names, in hours from UTC
+_ZONES = {'ut': 0, 'utc': 0, 'gmt': 0, 'z': 0,
+	'est': -5, 'edt': -4, 'cst': -6, 'cdt': -5,
+	'mst': -7, 'mdt': -6, 'pst': -8, 'pdt': -7,
+	'ast': -4, 'adt': -3, 'nst': -3.5, 'ndt': -2.5}
+
+def iter_items(source):
+	'''
+	Yields each <item> of an RSS feed as a dict with guid, title, link,
+	pubDate (UTC, 'YYYY/MM/DD HH:MM:SS') and description.
+
+	source is a file name or a binary file-like object (e.g. a streamed
+	HTTP response body).
+	'''
+	for _, elem in etree.iterparse(source, events=('end',), tag='item', recover=True, huge_tree=True):
+		try:
+			item = jsonify_item(elem)
+		except (TypeError, ValueError) as e:
+			logger.warning('Skipped item %s: %s', elem.findtext('link') or '?', e)
+			item = None
+		if item is not None:
+			yield item
+
+		# Free the item and any siblings already processed
+		elem.clear()
+		while elem.getprevious() is not None:
+			del elem.getparent()[0]
+
+def jsonify_item(elem):
+	fields = {}
+	for child in elem:
+		if isinstance(child.tag, str):
+			name = etree.QName(child).localname
+			if name in ITEM_FIELDS and name not in fields:
+				fields[name] = (child.text or '').strip()
+
+	json = {}
+	json['guid'] = fields.get('guid') or fields.get('link', '')
+	json['title'] = fields.get('title', '')
+	json['link'] = fields.get('link', '')
+	json['pubDate'] = parse_date(fields.get('pubDate', ''))
+	json['description'] = fields.get('description', '')
+	return json
+
+@lru_cache(maxsize=4096)
+def parse_date(date):
+	'''
+	Parses an RFC 822 date (zone name or numeric offset) and returns it in
+	UTC as 'YYYY/MM/DD HH:MM:SS'. Falls back to email.utils for anything
+	the fast path doesn't recognise. Results are cached, feeds repeat dates.
+	'''
+	match = _RFC822.match(date)
+	offset = None
+	if match:
+		day, month, year, hour, minute, second, zone = match.groups()
+		month = _MONTHS.get(month.lower())
+		offset = _zone_offset(zone)
+
+	if match and month and offset is not None:
+		year = int(year)
+		if year < 100:
+			year += 2000
+		parsed = datetime(year, month, int(day), int(hour), int(minute), int(second or 0)) - offset
+	else:
+		parsed = parsedate_to_datetime(date)
+		if parsed.tzinfo is not None:
+			parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+	return parsed.strftime("%Y/%m/%d %H:%M:%S")
+
+@lru_cache(maxsize=None)
+def _zone_offset(zone):
+	if zone is None:
+		return timedelta(0)
+	if zone[0] in '+-':
+		sign = -1 if zone[0] == '-' else 1
+		return sign * timedelta(hours=int(zone[1:3]), minutes=int(zone[3:5]))
+	hours = _ZONES.get(zone.lower())
+	return None if hours is None else timedelta(hours=hours)
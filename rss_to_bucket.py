@@ -2,65 +2,180 @@
 	Access RSS feeds from multiple news websites
 	and store the data into an Amazon S3 bucket.
 
-	CBC - 'Mon, 20 Jan 2020 17:11:33 EST'
-	TheStar - 'Fri, 3 Apr 2020 11:31:00 EDT'
-	CTV - 'Fri, 3 Apr 2020 10:13:00 -0400'
+	Feeds are streamed through rss_parser.iter_items, which parses each
+	outlet's pubDate as RFC 822 and stores it in UTC.
+
+	Feeds are fetched, parsed and uploaded concurrently over one pooled
+	HTTP session. ETag / Last-Modified validators are kept in the bucket,
+	so a feed that hasn't changed since the last run is not downloaded or
+	parsed again. Only articles that are new or whose title / description
+	changed (see article_state) are uploaded; when there are none, no
+	object is written for that outlet and day. A second run on the same day
+	adds its articles to that day's object instead of replacing it.
+
+	FEEDS_FILE - optional JSON file of [[url, name], ...] replacing FEEDS
+	FEED_WORKERS - number of feeds processed at once
+	FEED_TIMEOUT - seconds to wait on a feed connection or read
 '''
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pdb
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import gmtime, strftime
 import json
+import logging
+import os
+import time
 from settings import BUCKET_NAME
+from rss_parser import iter_items
+from article_state import SeenArticles
+from news_archive import Manifest, encode_items, read_items
 import boto3
-from datetime import datetime
-
-def rss_to_bucket():
-	date = strftime("%Y-%m-%d", gmtime())
-	s3 = boto3.resource('s3')
-	news_headlines = []
-	urls = [('http://www.thestar.com/feeds.topstories.rss', 'thestar'), 
-		('https://rss.cbc.ca/lineup/topstories.xml', 'cbc'),
-		('http://ctvnews.ca/rss/TopStories', 'ctv')]
-
-	for url, name in urls:
-		data = {}
-		data['items'] = []
-		response = requests.get(url)
-		soup = BeautifulSoup(response.content, features='xml')
-		items = soup.findAll('item')
-
-		for item in items:
-			item_json = jsonify_item(item, name)
-			data['items'].append(item_json)
-
-		obj = s3.Object(BUCKET_NAME, date + '-' + name + '.json')
-		obj.put(Body=json.dumps(data))
-
-	return
-
-def jsonify_item(item, news_outlet):
-	json = {}
-	json['guid'] = item.guid.text
-	json['title'] = item.title.text
-	json['link'] = item.link.text
-	json['pubDate'] = parse_date(item.pubDate.text, news_outlet)
-	json['description'] = item.description.text
-	return json
-
-def parse_date(date, news_outlet):
-	if news_outlet == 'cbc' or news_outlet == 'thestar':
-		date = datetime.strptime(date[:-4], '%a, %d %b %Y %H:%M:%S')
-
-	if news_outlet == 'ctv':
-		date = datetime.strptime(date[:-6], '%a, %d %b %Y %H:%M:%S')
-
-	return date.strftime("%Y/%m/%d %H:%M:%S")
+
+logger = logging.getLogger(__name__)
+
+FEEDS = [('http://www.thestar.com/feeds.topstories.rss', 'thestar'),
+	('https://rss.cbc.ca/lineup/topstories.xml', 'cbc'),
+	('http://ctvnews.ca/rss/TopStories', 'ctv')]
+
+FEEDS_FILE = os.environ.get('FEEDS_FILE')
+FEED_WORKERS = int(os.environ.get('FEED_WORKERS', 16))
+FEED_TIMEOUT = float(os.environ.get('FEED_TIMEOUT', 10))
+FEED_RETRIES = 3
+STATE_KEY = '_state/feeds.json'
+SEEN_KEY = '_state/uploaded.json'
+
+# Set to e.g. http://localhost:9000 to use MinIO instead of S3
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+def rss_to_bucket(feeds=None, s3=None, session=None, date=None, max_workers=FEED_WORKERS):
+	'''
+	Fetches every feed and uploads its new or changed articles as
+	<date>-<name>.ndjson[.gz|.zst] (see news_archive), one JSON item per line,
+	merged with the articles already uploaded that day.
+	Returns {name: {'status': 'updated' | 'unchanged' | 'failed',
+		'new': n, 'updated': n, 'skipped': n,
+		'seconds': {'fetch': s, 'upload': s}}}, fetch including parsing.
+	'''
+	date = date or strftime("%Y-%m-%d", gmtime())
+	feeds = feeds or load_feeds()
+	s3 = s3 or boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+	session = session or create_session(min(len(feeds), max_workers))
+	state = load_state(s3)
+	seen = SeenArticles(s3, BUCKET_NAME, SEEN_KEY).load()
+	manifest = Manifest(s3, BUCKET_NAME).load()
+	results = {}
+
+	with ThreadPoolExecutor(max_workers=max_workers) as pool:
+		futures = {pool.submit(process_feed, url, name, date, state.get(name, {}), session, s3, seen, manifest): name
+			for url, name in feeds}
+
+		for future in as_completed(futures):
+			name = futures[future]
+			try:
+				results[name], state[name] = future.result()
+			except Exception:
+				logger.exception('Feed %s failed', name)
+				results[name] = {'status': 'failed', 'new': 0, 'updated': 0, 'skipped': 0}
+
+	seen.save(date)
+	manifest.save()
+	save_state(s3, state)
+	return results
+
+def process_feed(url, name, date, feed_state, session, s3, seen, manifest):
+	'''
+	Fetches, parses and uploads the new or changed articles of a single feed.
+	Returns (result, new feed_state).
+	'''
+	headers = {}
+	if feed_state.get('etag'):
+		headers['If-None-Match'] = feed_state['etag']
+	if feed_state.get('last_modified'):
+		headers['If-Modified-Since'] = feed_state['last_modified']
+
+	start = time.perf_counter()
+	with session.get(url, headers=headers, timeout=FEED_TIMEOUT, stream=True) as response:
+		if response.status_code == 304:
+			seconds = {'fetch': time.perf_counter() - start, 'upload': 0}
+			return {'status': 'unchanged', 'new': 0, 'updated': 0, 'skipped': 0, 'seconds': seconds}, feed_state
+
+		response.raise_for_status()
+		response.raw.decode_content = True
+		items = list(iter_items(response.raw))
+	seconds = {'fetch': time.perf_counter() - start}
+
+	start = time.perf_counter()
+	items, pending, counts = seen.diff(items)
+	if items:
+		upload_day(s3, manifest, date + '-' + name, items)
+	seen.commit(pending, date)
+	seconds['upload'] = time.perf_counter() - start
+
+	result = dict(counts, status='updated' if items else 'unchanged', seconds=seconds)
+	return result, {
+		'etag': response.headers.get('ETag'),
+		'last_modified': response.headers.get('Last-Modified')}
+
+def upload_day(s3, manifest, object_name, items):
+	'''
+	Writes items to the object of object_name (<date>-<outlet>), after the
+	articles an earlier run uploaded that day. Those are already marked as
+	uploaded, so replacing the object with only the new ones would lose
+	them. A changed article keeps its place and takes its new content.
+	'''
+	entry = manifest.get(object_name)
+	day = {item['link']: item for item in read_items(s3, BUCKET_NAME, object_name, manifest) or []}
+	day.update((item['link'], item) for item in items)
+
+	suffix, body = encode_items(list(day.values()))
+	key = object_name + suffix
+	s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=body, ContentType='application/x-ndjson')
+	manifest.add(object_name, key, len(day))
+
+	# e.g. ARCHIVE_FORMAT changed between two runs, archive objects are left alone
+	if entry is not None and entry['key'] != key and entry.get('offset') is None:
+		s3.delete_object(Bucket=BUCKET_NAME, Key=entry['key'])
+
+def load_feeds(path=FEEDS_FILE):
+	if not path:
+		return FEEDS
+	with open(path) as f:
+		return [tuple(feed) for feed in json.load(f)]
+
+def create_session(pool_size):
+	'''
+	Session shared by every worker, with a connection pool as large as the
+	worker pool and retries with exponential backoff on connection errors
+	and 429/5xx responses.
+	'''
+	retry = Retry(total=FEED_RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+	session = requests.Session()
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
+
+def load_state(s3):
+	try:
+		obj = s3.get_object(Bucket=BUCKET_NAME, Key=STATE_KEY)
+	except s3.exceptions.NoSuchKey:
+		return {}
+	return json.loads(obj['Body'].read().decode('utf-8'))
+
+def save_state(s3, state):
+	s3.put_object(Bucket=BUCKET_NAME, Key=STATE_KEY, Body=json.dumps(state))
 
 def main():
-	rss_to_bucket()
+	logging.basicConfig(level=logging.INFO)
+	results = rss_to_bucket()
+	for name, result in sorted(results.items()):
+		seconds = result.get('seconds', {})
+		print('%s %s: %d new, %d updated, %d skipped (fetch %.2fs, upload %.2fs)' % (name, result['status'],
+			result['new'], result['updated'], result['skipped'], seconds.get('fetch', 0), seconds.get('upload', 0)))
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()